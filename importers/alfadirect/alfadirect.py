@@ -1,11 +1,11 @@
 ''' Importer for Alfa Direct broker - broker reports from XLS files
     TODO: chcp 65001 & set PYTHONIOENCODING=utf-8
 '''
-import xlrd
 import datetime
 import re
 import os
 import csv
+from functools import lru_cache
 from importlib.resources import open_text
 
 from beancount.core.amount import D
@@ -15,11 +15,56 @@ from beancount.core import account
 from beancount.core import amount
 from beancount.core import position
 from beancount.ingest import importer
-from xlrd.biffh import XLRDError
-from xlrd.xldate import xldate_as_datetime
 from rich import print
 
-NOCOST = position.CostSpec(None, None, None, None, None, None)
+from ..rufinlib import compact
+from ..rufinlib import context
+from ..rufinlib import dates
+from ..rufinlib import decimals
+from ..rufinlib import directives
+from ..rufinlib import legs
+from ..rufinlib import tables
+from ..rufinlib import watermark
+from ..rufinlib import xls
+
+NOCOST = directives.NOCOST
+
+@lru_cache(maxsize=None)
+def load_isin():
+    ''' Load file with ISIN database used to find out tickers of assets.
+        It is possible to download up-to-date ISIN database
+        from: https://www.moex.com/msn/stock-instruments
+        TODO: fix loader to process original file (now I delete blank lines)
+        Out: dictionaries by ISIN of tickers, currencies, bond flags and face values -
+             loaded once and shared (read only) by all importers
+    '''
+    isindb = {}
+    isincur = {} # dictionary of isin code with corresponding asset base currencies
+    isinbond = {} # True if bond
+    isinfv = {} # Face value
+    # get file from module's directory
+    fn = os.path.join(os.path.dirname(__file__), 'moex_db.csv')
+    with open(fn, newline='', encoding='cp1251') as f:
+        r = csv.reader(f, delimiter=';')
+        line_count = 0
+        for row in r:
+            if line_count == 0:
+                line_count += 1
+                continue
+            try:
+                isindb[row[4]] = row[0] # ticker
+                isincur[row[4]] = row[8] # currency
+                isinfv[row[4]] = float(row[7].replace(',', '.')) # face value
+                if (row[3] == r'ОФЗ' or re.match(r'.*[Оо]блигации.*', row[3])):
+                    isinbond[row[4]] = True
+                line_count += 1
+            except IndexError:
+                break
+            except ValueError:
+                continue
+    isindb['US29355E2081'] = 'ENPLADR'
+    isindb['JE00B5BCW814'] = 'RUAL'
+    return isindb, isincur, isinbond, isinfv
 
 class Importer(importer.ImporterProtocol):
     '''An importer for Alfa Direct XLS files'''
@@ -34,7 +79,9 @@ class Importer(importer.ImporterProtocol):
                  account_gains,
                  account_external,
                  account_repo = None,
-                 balance = True):
+                 balance = True,
+                 watermark = None,
+                 compact = None):
         self.general_agreement_id = general_agreement_id
         self.account_root = account_root
         self.account_cash = account_cash
@@ -43,14 +90,13 @@ class Importer(importer.ImporterProtocol):
         self.account_interest = account_interest
         self.account_fees = account_fees
         self.account_gains = account_gains
+        self.accounts = directives.Accounts(account_root, account_gains)
         self.account_external = account_external
         self.balance = balance
+        self.watermark = watermark # file with watermarks - skip already imported operations
+        self.compact = compact # 'daily' or 'monthly' - aggregate fees into summary transactions
         self.account_repo = account_repo if account_repo else account_fees
 
-        self.isindb = {}
-        self.isincur = {} # dictionary of isin code with corresponding asset base currencies
-        self.isinbond = {} # True if bond
-        self.isinfv = {} # Face value
         self.exchanges = {
                             'РЦБ':self.account_cash,
                             'Вал. рынок':self.account_currencyexchange,
@@ -61,48 +107,17 @@ class Importer(importer.ImporterProtocol):
     def check_alfadirect(self, xlsfile, genid):
         ''' * Verify if file from Alfa Direct broker
         '''
-        workbook = xlrd.open_workbook(xlsfile, logfile=open(os.devnull, 'w'))
-        try:
-            sheet = workbook.sheet_by_index(0)
-        except XLRDError:
-            return False # No correct sheet in file
-        # No broker name as string - only logo TODO: check logo?
-        # broker_name = sheet.row_values(0, start_colx=1, end_colx=None)
-        # if not re.match(r'ООО "Компания БКС"', broker_name[4]):
-        #     return False
-        # Check general agreement id
-        if sheet.row(5)[8].value.find(genid) == -1:
-            return False
-        return True
-
-    def load_isin(self):
-        ''' Load file with ISIN database used to find out tickers of assets.
-            It is possible to download up-to-date ISIN database
-            from: https://www.moex.com/msn/stock-instruments
-            TODO: fix loader to process original file (now I delete blank lines)
-        '''
-        # get file from module's directory
-        fn = os.path.join(os.path.dirname(__file__), 'moex_db.csv')
-        with open(fn, newline='', encoding='cp1251') as f:
-            r = csv.reader(f, delimiter=';')
-            line_count = 0
-            for row in r:
-                if line_count == 0:
-                    line_count += 1
-                    continue
-                try:
-                    self.isindb[row[4]] = row[0] # ticker
-                    self.isincur[row[4]] = row[8] # currency
-                    self.isinfv[row[4]] = float(row[7].replace(',', '.')) # face value
-                    if (row[3] == r'ОФЗ' or re.match(r'.*[Оо]блигации.*', row[3])):
-                        self.isinbond[row[4]] = True
-                    line_count += 1
-                except IndexError:
-                    break
-                except ValueError:
-                    continue
-        self.isindb['US29355E2081'] = 'ENPLADR'
-        self.isindb['JE00B5BCW814'] = 'RUAL'
+        with xls.open_workbook(xlsfile) as workbook, xls.load_sheet(workbook, 0) as sheet:
+            if sheet is None:
+                return False # No correct sheet in file
+            # No broker name as string - only logo TODO: check logo?
+            # broker_name = sheet.row_values(0, start_colx=1, end_colx=None)
+            # if not re.match(r'ООО "Компания БКС"', broker_name[4]):
+            #     return False
+            # Check general agreement id
+            if sheet.row(5)[8].value.find(genid) == -1:
+                return False
+            return True
 
     def identify(self, file):
         ''' * Match if the filename is broker report from Alfa Direct
@@ -134,16 +149,28 @@ class Importer(importer.ImporterProtocol):
         ''' Open XLS file and create directives
         '''
         entries = []
-        workbook = xlrd.open_workbook(file.name, logfile=open(os.devnull, 'w'))
-        # 1. Load end of report balances: 'Динамика позиций' sheet
-        sheet = workbook.sheet_by_name('Динамика позиций') #TODO change sheet to 0 (first sheet in workbook)
-        # extract broker report dates - row 3 col 8
-        per = sheet.row(4)[8].value
-        self.stmt_begin = datetime.datetime.strptime(per[:10], '%d.%m.%Y').date()
-        self.stmt_end = datetime.datetime.strptime(per[13:], '%d.%m.%Y').date()
-        del sheet
-
-        self.load_isin()
+        isindb, _, _, isinfv = load_isin()
+        ctx = context.ExtractContext(file, isindb=isindb, isinfv=isinfv, compactable=[],
+                                     wm=watermark.Watermark(self.watermark, self.account_root))
+        # Sheets are loaded one by one and unloaded right after parsing
+        with xls.open_workbook(file.name) as workbook:
+            # 1. Load end of report balances: 'Динамика позиций' sheet
+            with xls.load_sheet(workbook, 'Динамика позиций') as sheet: #TODO change sheet to 0 (first sheet in workbook)
+                # extract broker report dates - row 3 col 8
+                per = sheet.row(4)[8].value
+                ctx.stmt_begin = dates.ru_date(per[:10])
+                ctx.stmt_end = dates.ru_date(per[13:])
+                if self.balance:
+                    entries += self.get_balance(sheet, ctx)
+
+            with xls.load_sheet(workbook, 'Завершенные сделки') as sheet:
+                if sheet is not None:
+                    entries += self.get_trn(sheet, ctx)
+
+            with xls.load_sheet(workbook, ' Движение ДС') as sheet: # Note space in sheet name
+                if sheet is not None:
+                    entries += self.get_cflow(sheet, ctx)
+
         # for index in range(sheet.nrows):
         #     if sheet.row(index)[1].value == r'1. Движение денежных средств': #'1.1. Движение денежных средств по совершенным сделкам:':
         #         cashflow = self.get_cashflow(workbook, sheet, index, file)
@@ -151,25 +178,16 @@ class Importer(importer.ImporterProtocol):
         #     # Find section 2.1 - transactions completed in report's period
         #     if sheet.row(index)[1].value == r'2.1. Сделки:': 
         #         entries += self.get_transactions(workbook, sheet, index, file)
-        
-        if self.balance:
-            entries += self.get_balance(workbook, file)
-
-        entries += self.get_trn(workbook, file)
-        entries += self.get_cflow(workbook, file)
 
+        entries += compact.compact(ctx.compactable, self.compact)
+        ctx.wm.save()
         return entries
 
-    def get_balance(self, workbook, file):
+    def get_balance(self, sheet, ctx):
         ''' * Parse broker report for end of period balances - cash and assets
-            In: XLS sheet, file
+            In: 'Динамика позиций' sheet, extraction context
             Out: list of transactions
         '''
-        try:
-            sheet = workbook.sheet_by_name('Динамика позиций')
-        except XLRDError:
-            return None # No balances sheet in file
-
         result = []
         ii = 0
         market = 0
@@ -190,23 +208,23 @@ class Importer(importer.ImporterProtocol):
             elif sheet.row(ii)[2].value == 'Акции' or sheet.row(ii)[2].value == 'Прочее':
                 asset_type = 2 # Stocks and ADRs
             if sheet.row(ii)[6].value:
-                meta = data.new_metadata(file.name, ii)
+                meta = directives.new_metadata(ctx.file.name, ii)
                 if asset_type == 1:
                     # line with currencies
                     ticker = sheet.row(ii)[6].value
                     acc = self.exchanges[sheet.row(ii)[market].value]
                     result.append(data.Balance(meta, 
-                                    self.stmt_end + datetime.timedelta(days=1),
+                                    ctx.stmt_end + datetime.timedelta(days=1),
                                     acc,
-                                    amount.Amount(D(str(sheet.row(ii)[15].value)), ticker),
+                                    amount.Amount(decimals.cell2d(sheet.row(ii)[15].value), ticker),
                                     None, None))
                 elif asset_type == 2:
                     # line with stocks
-                    ticker = self.isindb[sheet.row(ii+1)[6].value]
-                    account_inst = account.join(self.account_root, ticker)
-                    amt = amount.Amount(D(str(sheet.row(ii)[15].value)), ticker)
+                    ticker = ctx.isindb[sheet.row(ii+1)[6].value]
+                    account_inst = self.accounts.instrument(ticker)
+                    amt = amount.Amount(decimals.cell2d(sheet.row(ii)[15].value), ticker)
                     result.append(data.Balance(meta, 
-                                    self.stmt_end + datetime.timedelta(days=1),
+                                    ctx.stmt_end + datetime.timedelta(days=1),
                                     account_inst,
                                     amt,
                                     None, None))
@@ -216,14 +234,9 @@ class Importer(importer.ImporterProtocol):
 
         return result
 
-    def get_trn(self, workbook, file):
-        ''' Parse broker report for all assets transactions
+    def get_trn(self, sheet, ctx):
+        ''' Parse 'Завершенные сделки' sheet for all assets transactions
         '''
-        try:
-            sheet = workbook.sheet_by_name('Завершенные сделки')
-        except XLRDError:
-            return None # No balances sheet in file
-
         result = []
         ii = 0
 
@@ -262,8 +275,11 @@ class Importer(importer.ImporterProtocol):
 
         ii +=1 # pass to first row of the table
         while sheet.row(ii)[4].value != '':
-            meta = data.new_metadata(file.name, ii)
-            trn_date = datetime.datetime.strptime(sheet.row(ii)[date_col].value[:10], '%d.%m.%Y').date()
+            meta = directives.new_metadata(ctx.file.name, ii)
+            trn_date = dates.ru_date(sheet.row(ii)[date_col].value[:10])
+            if ctx.wm.skip(trn_date, row=sheet.row_values(ii)):
+                ii += 1
+                continue # imported already
             ticker_cur = sheet.row(ii)[cur_col].value
 
             # currency exchange
@@ -286,14 +302,14 @@ class Importer(importer.ImporterProtocol):
             # assets transactions
             if sheet.row(ii)[market_col].value == 'МБ ФР' or sheet.row(ii)[market_col].value == 'КЦ МФБ':
                 try:
-                    ticker = self.isindb[sheet.row(ii)[isin_col].value]
+                    ticker = ctx.isindb[sheet.row(ii)[isin_col].value]
                 except KeyError:
                     ticker = sheet.row(ii)[isin_col].value
                 desc = sheet.row(ii)[12].value #TODO column?
-                amt = amount.Amount(D(sheet.row(ii)[amt_col].value), ticker)
+                amt = amount.Amount(decimals.cell2d(sheet.row(ii)[amt_col].value), ticker)
                 sign = -1 if sheet.row(ii)[amt_col].value>=0 else 1
-                price = amount.Amount(sign*D(str(sheet.row(ii)[price_col].value)), ticker_cur)
-                account_inst = account.join(self.account_root, ticker)
+                price = amount.Amount(sign*decimals.cell2d(sheet.row(ii)[price_col].value), ticker_cur)
+                account_inst = self.accounts.instrument(ticker)
                 '''
                 isbond = False
                 if sheet.row(ii)[20].value:
@@ -301,7 +317,7 @@ class Importer(importer.ImporterProtocol):
                     #print(ticker, sheet.row(ii)[20].value)
                     isbond = True
                     try:
-                        cost = position.Cost(D(str(sheet.row(ii)[17].value*self.isinfv[sheet.row(ii)[11].value]/100)), 
+                        cost = position.Cost(D(str(sheet.row(ii)[17].value*ctx.isinfv[sheet.row(ii)[11].value]/100)), 
                                             ticker_cur, None, None)
                     except KeyError:
                         # no such ticker in DB - assume 1000 face value
@@ -320,11 +336,11 @@ class Importer(importer.ImporterProtocol):
                                         ])
                 else:
                     # we sold ticket
-                    account_gains = self.account_gains.format(ticker)
+                    account_gains = self.accounts.gains(ticker)
                     '''
                     if isbond:
                         try:
-                            cost = amount.Amount(D(str(sheet.row(ii)[17].value*self.isinfv[sheet.row(ii)[11].value]/100)), ticker_cur)
+                            cost = amount.Amount(D(str(sheet.row(ii)[17].value*ctx.isinfv[sheet.row(ii)[11].value]/100)), ticker_cur)
                         except KeyError:
                             cost = amount.Amount(D(str(sheet.row(ii)[17].value*10)), ticker_cur)
                     else:
@@ -345,17 +361,14 @@ class Importer(importer.ImporterProtocol):
 
         return result
 
-    def get_cflow(self, workbook, file):
-        ''' Parse broker report for all cash transactions
+    def get_cflow(self, sheet, ctx):
+        ''' Parse ' Движение ДС' sheet for all cash transactions
         '''
-        try:
-            sheet = workbook.sheet_by_name(' Движение ДС') # Note space in sheet name
-        except XLRDError:
-            return None # No balances sheet in file
-
         result = []
-        currconv = []
-        currconvamt = {}
+        cash = tables.CashTable()
+        fees = tables.CashTable() # may be compacted - see extract()
+        # legs of currency conversions - pair is a leg in other currency
+        currconv = legs.LegMatcher(accept=lambda pending, leg: pending.currency != leg.currency)
         ii = 0
 
         while ii < sheet.nrows-1:
@@ -367,51 +380,31 @@ class Importer(importer.ImporterProtocol):
                 ncur = len(cur)
                 #print(ncur, cur)
                 while sheet.row(ii)[10].value != 'Итого:':
-                    meta = data.new_metadata(file.name, ii)
+                    meta = directives.new_metadata(ctx.file.name, ii)
                     if sheet.row(ii)[2].value !='': # keep last date that was in 2d column
-                        trn_date = xldate_as_datetime(sheet.row(ii)[2].value, 0).date()
+                        trn_date = dates.xldate_as_date(sheet.row(ii)[2].value)
+                    if ctx.wm.skip(trn_date, row=sheet.row_values(ii)):
+                        ii += 1
+                        continue # imported already
                     #print(trn_date, sheet.row(ii)[9].value)
                     for c in cur:
                         if sheet.row(ii)[c[1]].value !='':
                             trn_cur = c[0]
                             trn_amt = sheet.row(ii)[c[1]].value
                             break
-                    amt = amount.Amount(D(str(trn_amt)), trn_cur)
+                    amt = amount.Amount(decimals.money(trn_amt, trn_cur), trn_cur)
                     desc = sheet.row(ii)[10].value
                     if sheet.row(ii)[9].value == 'Комиссия':
-                        if desc == 'по сделке РЕПО':
-                            txn = data.Transaction(
-                            meta, trn_date, self.FLAG, None, sheet.row(ii)[9].value+' '+sheet.row(ii)[10].value, data.EMPTY_SET, {trn_date}, [
-                                data.Posting(self.account_cash, amt, None, None, None,
-                                                None),
-                                data.Posting(self.account_repo, -amt, None, None, None,
-                                                None),
-                            ])
-                        else:
-                            txn = data.Transaction(
-                                meta, trn_date, self.FLAG, None, sheet.row(ii)[9].value+' '+sheet.row(ii)[10].value, data.EMPTY_SET, {trn_date}, [
-                                    data.Posting(self.account_cash, amt, None, None, None,
-                                                    None),
-                                    data.Posting(self.account_fees, -amt, None, None, None,
-                                                    None),
-                                ])
-                        result.append(txn)
+                        acc = self.account_repo if desc == 'по сделке РЕПО' else self.account_fees
+                        fees.add(ctx.file.name, ii, trn_date, self.account_cash, acc, amt.number, amt.currency,
+                                 sheet.row(ii)[9].value+' '+sheet.row(ii)[10].value, links={trn_date})
                     if sheet.row(ii)[9].value[:17] == 'Расчеты по сделке' and desc.find('РЕПО ч.')!=-1:
-                        txn = data.Transaction(
-                                meta, trn_date, self.FLAG, None, sheet.row(ii)[9].value+' '+sheet.row(ii)[10].value, data.EMPTY_SET, {trn_date}, [
-                                    data.Posting(self.account_cash, amt, None, None, None,
-                                                    None),
-                                    data.Posting(self.account_repo, -amt, None, None, None,
-                                                    None),
-                                ])
-                        result.append(txn)
+                        cash.add(ctx.file.name, ii, trn_date, self.account_cash, self.account_repo, amt.number, amt.currency,
+                                 sheet.row(ii)[9].value+' '+sheet.row(ii)[10].value, links={trn_date})
                     if sheet.row(ii)[9].value[:17] == 'Расчеты по сделке' and desc in self.cur:
-                        opertime = xldate_as_datetime(sheet.row(ii)[6].value, 0)
-                        try:
-                            price = currconvamt[(opertime, desc)]
-                            if price.currency == amt.currency:
-                                raise ValueError
-                            currconv.remove((opertime, desc))
+                        opertime = dates.xldate_as_datetime(sheet.row(ii)[6].value)
+                        price = currconv.match(opertime, desc, None, amt)
+                        if price is not None:
                             rate = amount.Amount(abs(amt.number/price.number), amt.currency)
                             #print("R:", rate)
                             txn = data.Transaction(
@@ -421,9 +414,6 @@ class Importer(importer.ImporterProtocol):
                                         data.Posting(self.account_cash, price, None, rate, None, None),
                                     ])
                             result.append(txn)
-                        except (ValueError, KeyError):
-                            currconv.append((opertime, desc))
-                            currconvamt[(opertime, desc)] = amt
 
                     
                     if sheet.row(ii)[9].value == 'Перевод':
@@ -435,23 +425,11 @@ class Importer(importer.ImporterProtocol):
                         else:
                             acc = self.account_external
                         
-                        txn = data.Transaction(
-                            meta, trn_date, self.FLAG, None, sheet.row(ii)[9].value+' '+desc, data.EMPTY_SET, {trn_date}, [
-                                data.Posting(self.account_cash, amt, None, None, None,
-                                                None),
-                                data.Posting(acc, -amt, None, None, None,
-                                                None),
-                            ])
-                        result.append(txn)
+                        cash.add(ctx.file.name, ii, trn_date, self.account_cash, acc, amt.number, amt.currency,
+                                 sheet.row(ii)[9].value+' '+desc, links={trn_date})
                     elif sheet.row(ii)[9].value == 'НДФЛ':
-                        txn = data.Transaction(
-                            meta, trn_date, self.FLAG, None, sheet.row(ii)[9].value+' '+desc, data.EMPTY_SET, {trn_date}, [
-                                data.Posting(self.account_cash, amt, None, None, None,
-                                                None),
-                                data.Posting(self.account_external, -amt, None, None, None,
-                                                None),
-                            ])
-                        result.append(txn)
+                        cash.add(ctx.file.name, ii, trn_date, self.account_cash, self.account_external, amt.number, amt.currency,
+                                 sheet.row(ii)[9].value+' '+desc, links={trn_date})
 
                     # next line for Фондовый рынок
                     ii += 1
@@ -464,16 +442,19 @@ class Importer(importer.ImporterProtocol):
                 #print(ncur, cur)
                 
                 while sheet.row(ii)[10].value != 'Итого:':
-                    meta = data.new_metadata(file.name, ii)
+                    meta = directives.new_metadata(ctx.file.name, ii)
                     if sheet.row(ii)[2].value !='': # keep last date that was in 2d column
-                        trn_date = xldate_as_datetime(sheet.row(ii)[2].value, 0).date()
+                        trn_date = dates.xldate_as_date(sheet.row(ii)[2].value)
+                    if ctx.wm.skip(trn_date, row=sheet.row_values(ii)):
+                        ii += 1
+                        continue # imported already
                     #print(trn_date, sheet.row(ii)[9].value)
                     for c in cur:
                         if sheet.row(ii)[c[1]].value !='':
                             trn_cur = c[0]
                             trn_amt = sheet.row(ii)[c[1]].value
                             break
-                    amt = amount.Amount(D(str(trn_amt)), trn_cur)
+                    amt = amount.Amount(decimals.money(trn_amt, trn_cur), trn_cur)
                     desc = sheet.row(ii)[10].value
                     if sheet.row(ii)[9].value == 'Комиссия':
                         # if desc == 'по сделке РЕПО':
@@ -485,22 +466,13 @@ class Importer(importer.ImporterProtocol):
                         #                         None),
                         #     ])
                         # else:
-                        txn = data.Transaction(
-                            meta, trn_date, self.FLAG, None, sheet.row(ii)[9].value+' '+sheet.row(ii)[10].value, data.EMPTY_SET, {trn_date}, [
-                                data.Posting(self.account_currencyexchange, amt, None, None, None,
-                                                None),
-                                data.Posting(self.account_fees, -amt, None, None, None,
-                                                None),
-                            ])
-                        result.append(txn)
+                        fees.add(ctx.file.name, ii, trn_date, self.account_currencyexchange, self.account_fees, amt.number, amt.currency,
+                                 sheet.row(ii)[9].value+' '+sheet.row(ii)[10].value, links={trn_date})
                     if sheet.row(ii)[9].value == 'Расчеты по сделке' and desc in self.cur:
-                        opertime = xldate_as_datetime(sheet.row(ii)[6].value, 0)
+                        opertime = dates.xldate_as_datetime(sheet.row(ii)[6].value)
                         #print(sheet.row(ii)[9].value, ' ', desc, opertime)
-                        try:
-                            price = currconvamt[(opertime, desc)]
-                            if price.currency == amt.currency:
-                                raise ValueError
-                            currconv.remove((opertime, desc))
+                        price = currconv.match(opertime, desc, None, amt)
+                        if price is not None:
                             rate = amount.Amount(abs(amt.number/price.number), amt.currency)
                             txn = data.Transaction(
                                     meta, trn_date, self.FLAG, None, 'Расчеты по сделке ' + desc, data.EMPTY_SET, data.EMPTY_SET, 
@@ -510,10 +482,6 @@ class Importer(importer.ImporterProtocol):
                                     ])
                             #print(txn)
                             result.append(txn)
-                        except (ValueError, KeyError):
-                            #print(sheet.row(ii)[9].value, ' ', desc, opertime)
-                            currconv.append((opertime, desc))
-                            currconvamt[(opertime, desc)] = amt
                     if sheet.row(ii)[9].value == 'Перевод':
                         if desc == 'Между рынками':
                             ii += 1
@@ -521,20 +489,15 @@ class Importer(importer.ImporterProtocol):
                         else:
                             acc = self.account_external
                         
-                        txn = data.Transaction(
-                            meta, trn_date, self.FLAG, None, sheet.row(ii)[9].value+' '+desc, data.EMPTY_SET, {trn_date}, [
-                                data.Posting(self.account_currencyexchange, amt, None, None, None,
-                                                None),
-                                data.Posting(acc, -amt, None, None, None,
-                                                None),
-                            ])
-                        result.append(txn)
+                        cash.add(ctx.file.name, ii, trn_date, self.account_currencyexchange, acc, amt.number, amt.currency,
+                                 sheet.row(ii)[9].value+' '+desc, links={trn_date})
 
                     ii +=1
 
             # Next line
             ii += 1
-        return result
+        ctx.compactable += fees.build(self.FLAG)
+        return result + cash.build(self.FLAG)
 
     def proc_header(self, header):
         ''' process header of the table
@@ -557,7 +520,8 @@ class Importer(importer.ImporterProtocol):
         '''
         result = []
         acc = ''
-        dedup = []
+        # transfers between markets are reported twice - by each market
+        dedup = legs.LegMatcher()
         # find beggining of next block
         ii = index + 1
         while ii<sheet.nrows-1:
@@ -594,14 +558,14 @@ class Importer(importer.ImporterProtocol):
                     ii += 4
                     break
 
-                trn_date = datetime.datetime.strptime(sheet.row(ii)[1].value, '%d.%m.%y').date()
+                trn_date = dates.ru_date_short(sheet.row(ii)[1].value)
                 try:
                     acc = self.exchanges[sheet.row(ii)[12].value]
                 except KeyError:
                     acc = acc_choice
-                meta = data.new_metadata(file.name, ii)
+                meta = directives.new_metadata(file.name, ii)
                 if sheet.row(ii)[2].value == 'Приход ДС':
-                    amt = amount.Amount(D(str(sheet.row(ii)[6].value)), trn_currency)
+                    amt = amount.Amount(decimals.cell2d(sheet.row(ii)[6].value), trn_currency)
                     txn = data.Transaction(
                         meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
                             data.Posting(acc, amt, None, None, None,
@@ -611,7 +575,7 @@ class Importer(importer.ImporterProtocol):
                         ])
                     result.append(txn)
                 elif sheet.row(ii)[2].value == 'Вывод ДС':
-                    amt = amount.Amount(D(str(sheet.row(ii)[7].value)), trn_currency)
+                    amt = amount.Amount(decimals.cell2d(sheet.row(ii)[7].value), trn_currency)
                     txn = data.Transaction(
                         meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
                             data.Posting(acc, -amt, None, None, None,
@@ -634,19 +598,15 @@ class Importer(importer.ImporterProtocol):
 
                     if sheet.row(ii)[6].value:
                         x = sheet.row(ii)[6].value
-                        amt = amount.Amount(D(str(sheet.row(ii)[6].value)), trn_currency)
+                        amt = amount.Amount(decimals.cell2d(sheet.row(ii)[6].value), trn_currency)
                     else:
                         x = -sheet.row(ii)[7].value
-                        amt = amount.Amount(-D(str(sheet.row(ii)[7].value)), trn_currency)
+                        amt = amount.Amount(-decimals.cell2d(sheet.row(ii)[7].value), trn_currency)
                     
-                    dd = [acc1, acc2, x] if x>0 else [acc2, acc1, -x]
-                    try:
-                        dedup.index(dd)
-                        dedup.remove(dd)
+                    direction = (acc1, acc2) if x>0 else (acc2, acc1)
+                    if dedup.match(None, direction, abs(x), ii) is not None:
                         ii += 1
                         continue
-                    except ValueError:
-                        dedup.append(dd)
 
                     txn = data.Transaction(
                         meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
@@ -658,7 +618,7 @@ class Importer(importer.ImporterProtocol):
                     result.append(txn)
                 elif sheet.row(ii)[2].value == 'Дивиденды':
                     # unfortunately we don't have ticker info for dividends
-                    amt = amount.Amount(D(str(sheet.row(ii)[6].value)), trn_currency)
+                    amt = amount.Amount(decimals.cell2d(sheet.row(ii)[6].value), trn_currency)
                     txn = data.Transaction(
                         meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
                             data.Posting(acc, amt, None, None, None,
@@ -671,7 +631,7 @@ class Importer(importer.ImporterProtocol):
                                                 'Вознаграждение компании', 'Quik','Оплата за вывод денежных средств', 
                                                 'Комиссия за займы "овернайт ЦБ"', 'Урегулирование сделок по Айсберг-заявкам']:
                     # unfortunately we don't have ticker info for fees
-                    amt = amount.Amount(D(str(sheet.row(ii)[7].value)), trn_currency)
+                    amt = amount.Amount(decimals.cell2d(sheet.row(ii)[7].value), trn_currency)
                     txn = data.Transaction(
                         meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
                             data.Posting(acc, -amt, None, None, None,
@@ -683,7 +643,7 @@ class Importer(importer.ImporterProtocol):
                 elif sheet.row(ii)[2].value in ['Займы "овернайт"', 'Проценты по займам "овернайт"', 'Проценты по займам "овернайт ЦБ"',
                                                 'НКД от операций', 'НДФЛ', 'Подоходный налог']:
                     if sheet.row(ii)[7].value:
-                        amt = amount.Amount(D(str(sheet.row(ii)[7].value)), trn_currency) 
+                        amt = amount.Amount(decimals.cell2d(sheet.row(ii)[7].value), trn_currency) 
                         txn = data.Transaction(
                             meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
                             data.Posting(acc, -amt, None, None, None,
@@ -693,7 +653,7 @@ class Importer(importer.ImporterProtocol):
                         ])
                         result.append(txn)
                     if sheet.row(ii)[6].value:
-                        amt = amount.Amount(-D(str(sheet.row(ii)[6].value)), trn_currency)
+                        amt = amount.Amount(-decimals.cell2d(sheet.row(ii)[6].value), trn_currency)
                         txn = data.Transaction(
                             meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
                                 data.Posting(acc, -amt, None, None, None,
@@ -734,23 +694,23 @@ class Importer(importer.ImporterProtocol):
                 while sheet.row(ii)[1].value != '':
                     # read ticker
                     ticker = fix_ticker(sheet.row(ii)[1].value)
-                    account_inst = account.join(self.account_root, ticker)
+                    account_inst = self.accounts.instrument(ticker)
                     isin = sheet.row(ii)[7].value
                     title = sheet.row(ii)[8].value
                     ii += 1
                     #start to read transactions - pass to first transaction
                     while sheet.row(ii)[1].value[:5] != r'Итого':
-                        trn_date = datetime.datetime.strptime(sheet.row(ii)[1].value, '%d.%m.%y').date()
+                        trn_date = dates.ru_date_short(sheet.row(ii)[1].value)
                         trn_num = sheet.row(ii)[2].value #transaction id by broker
                         trn_currency = 'RUB' if sheet.row(ii)[11].value == 'Рубль' else sheet.row(ii)[11].value
                         # are we selling our buying? cols 4,5 - buying, cols 7,8 - selling
                         if sheet.row(ii)[4].value != '':
                             # we bought the ticker
                             # instantiate amount bought, 'currency' - ticker itself
-                            meta = data.new_metadata(file.name, ii)
-                            units_inst = amount.Amount(D(sheet.row(ii)[4].value), ticker) # amount of ticker bought
-                            price = amount.Amount(-1*D(str(sheet.row(ii)[6].value)), trn_currency) # payment for transaction
-                            cost = position.Cost(D(str(sheet.row(ii)[5].value)), trn_currency, None, None) # cost of single unit
+                            meta = directives.new_metadata(file.name, ii)
+                            units_inst = amount.Amount(decimals.cell2d(sheet.row(ii)[4].value), ticker) # amount of ticker bought
+                            price = amount.Amount(-1*decimals.cell2d(sheet.row(ii)[6].value), trn_currency) # payment for transaction
+                            cost = position.Cost(decimals.cell2d(sheet.row(ii)[5].value), trn_currency, None, None) # cost of single unit
                             #cost = amount.Amount(D(str(sheet.row(ii)[5].value)), trn_currency) # cost of single unit
                             #pos = position.Position(units_inst, cost)
                             txn = data.Transaction(
@@ -763,11 +723,11 @@ class Importer(importer.ImporterProtocol):
                             entries.append(txn)
                         elif sheet.row(ii)[7].value != '':
                             # we sold ticker
-                            meta = data.new_metadata(file.name, ii)
-                            units_inst = amount.Amount(-1*D(sheet.row(ii)[7].value), ticker) # amount of ticker sold
-                            price = amount.Amount(D(str(sheet.row(ii)[9].value)), trn_currency) # payment for transaction
-                            cost = amount.Amount(D(str(sheet.row(ii)[8].value)), trn_currency) # cost of single unit
-                            account_gains = self.account_gains.format(ticker)
+                            meta = directives.new_metadata(file.name, ii)
+                            units_inst = amount.Amount(-1*decimals.cell2d(sheet.row(ii)[7].value), ticker) # amount of ticker sold
+                            price = amount.Amount(decimals.cell2d(sheet.row(ii)[9].value), trn_currency) # payment for transaction
+                            cost = amount.Amount(decimals.cell2d(sheet.row(ii)[8].value), trn_currency) # cost of single unit
+                            account_gains = self.accounts.gains(ticker)
                             txn = data.Transaction(
                                     meta, trn_date, self.FLAG, None, title, data.EMPTY_SET, {trn_num}, [
                                         data.Posting(acc, price, None, None, None,
@@ -794,22 +754,22 @@ class Importer(importer.ImporterProtocol):
                     ticker = sheet.row(ii)[1].value
                     ii += 1
                     while sheet.row(ii)[1].value[:5] != r'Итого':
-                        meta = data.new_metadata(file.name, ii)
-                        trn_date = datetime.datetime.strptime(sheet.row(ii)[1].value, '%d.%m.%y').date()
+                        meta = directives.new_metadata(file.name, ii)
+                        trn_date = dates.ru_date_short(sheet.row(ii)[1].value)
                         trn_num = sheet.row(ii)[2].value #transaction id by broker
                         # check if we buy or sell
                         if sheet.row(ii)[4].value:
                             # we buy
-                            conv_rate = amount.Amount(D(str(sheet.row(ii)[4].value)), 
+                            conv_rate = amount.Amount(decimals.cell2d(sheet.row(ii)[4].value), 
                                                       bought_currency)
-                            amount_bought = amount.Amount(D(sheet.row(ii)[5].value), sold_currency) # amount of ticker sold
-                            price = amount.Amount(-1*D(str(sheet.row(ii)[6].value)), bought_currency) # payment for transaction,                            
+                            amount_bought = amount.Amount(decimals.cell2d(sheet.row(ii)[5].value), sold_currency) # amount of ticker sold
+                            price = amount.Amount(-1*decimals.cell2d(sheet.row(ii)[6].value), bought_currency) # payment for transaction,                            
                         else:
                             #we sell
-                            conv_rate = amount.Amount(D(str(sheet.row(ii)[7].value)), 
+                            conv_rate = amount.Amount(decimals.cell2d(sheet.row(ii)[7].value), 
                                                     bought_currency)
-                            amount_bought = amount.Amount(-1*D(sheet.row(ii)[8].value), sold_currency) # amount of ticker sold
-                            price = amount.Amount(D(str(sheet.row(ii)[9].value)), bought_currency) # payment for transaction
+                            amount_bought = amount.Amount(-1*decimals.cell2d(sheet.row(ii)[8].value), sold_currency) # amount of ticker sold
+                            price = amount.Amount(decimals.cell2d(sheet.row(ii)[9].value), bought_currency) # payment for transaction
                         txn = data.Transaction(
                                     meta, trn_date, self.FLAG, None, ticker, data.EMPTY_SET, {trn_num}, [
                                         #data.Posting(acc, amount_bought, conv_rate, None, None, None),
@@ -826,23 +786,23 @@ class Importer(importer.ImporterProtocol):
                 while sheet.row(ii)[1].value != '':
                     # read ticker
                     ticker = fix_ticker(sheet.row(ii)[1].value)
-                    account_inst = account.join(self.account_root, ticker)
+                    account_inst = self.accounts.instrument(ticker)
                     isin = sheet.row(ii)[7].value
                     title = sheet.row(ii)[8].value
                     ii += 1
                     #start to read transactions - pass to first transaction
                     while sheet.row(ii)[1].value[:5] != r'Итого':
-                        trn_date = datetime.datetime.strptime(sheet.row(ii)[1].value, '%d.%m.%y').date()
+                        trn_date = dates.ru_date_short(sheet.row(ii)[1].value)
                         trn_num = sheet.row(ii)[2].value #transaction id by broker
                         trn_currency = 'RUB' if sheet.row(ii)[13].value == 'Рубль' else sheet.row(ii)[13].value
                         # are we selling our buying? cols 4,5 - buying, cols 7,8 - selling
                         if sheet.row(ii)[4].value != '':
                             # we bought the ticker
                             # instantiate amount bought, 'currency' - ticker itself
-                            meta = data.new_metadata(file.name, ii)
-                            units_inst = amount.Amount(D(sheet.row(ii)[4].value), ticker) # amount of ticker bought
-                            price = amount.Amount(-1*D(str(sheet.row(ii)[6].value)), trn_currency) # payment for transaction
-                            cost = position.Cost(D(str(sheet.row(ii)[5].value))*10, trn_currency, None, None) # cost of single unit
+                            meta = directives.new_metadata(file.name, ii)
+                            units_inst = amount.Amount(decimals.cell2d(sheet.row(ii)[4].value), ticker) # amount of ticker bought
+                            price = amount.Amount(-1*decimals.cell2d(sheet.row(ii)[6].value), trn_currency) # payment for transaction
+                            cost = position.Cost(decimals.cell2d(sheet.row(ii)[5].value)*10, trn_currency, None, None) # cost of single unit
                             txn = data.Transaction(
                                     meta, trn_date, self.FLAG, None, title, data.EMPTY_SET, {trn_num}, [
                                         data.Posting(acc, price, None, None, None, None),
@@ -853,11 +813,11 @@ class Importer(importer.ImporterProtocol):
                             entries.append(txn)
                         elif sheet.row(ii)[8].value != '':
                             # we sold ticker
-                            meta = data.new_metadata(file.name, ii)
-                            units_inst = amount.Amount(-1*D(sheet.row(ii)[8].value), ticker) # amount of ticker sold
-                            price = amount.Amount(D(str(sheet.row(ii)[10].value)), trn_currency) # payment for transaction
-                            cost = amount.Amount(D(str(sheet.row(ii)[9].value))*10, trn_currency) # cost of single unit
-                            account_gains = self.account_gains.format(ticker)
+                            meta = directives.new_metadata(file.name, ii)
+                            units_inst = amount.Amount(-1*decimals.cell2d(sheet.row(ii)[8].value), ticker) # amount of ticker sold
+                            price = amount.Amount(decimals.cell2d(sheet.row(ii)[10].value), trn_currency) # payment for transaction
+                            cost = amount.Amount(decimals.cell2d(sheet.row(ii)[9].value)*10, trn_currency) # cost of single unit
+                            account_gains = self.accounts.gains(ticker)
                             txn = data.Transaction(
                                     meta, trn_date, self.FLAG, None, title, data.EMPTY_SET, {trn_num}, [
                                         data.Posting(acc, price, None, None, None,
@@ -1,14 +1,11 @@
 '''Importer for BCS Express broker - broker reports from XLS files
    Description of broker report format: https://broker.ru/f/support/daily-trading-report.pdf
 '''
-import xlrd
 import datetime
 import re
 import logging
 from os import path
 
-from dateutil.parser import parse
-
 from beancount.core.amount import D
 from beancount.core import data
 from beancount.core import flags
@@ -16,9 +13,18 @@ from beancount.core import account
 from beancount.core import amount
 from beancount.core import position
 from beancount.ingest import importer
-from xlrd.biffh import XLRDError
 
-NOCOST = position.CostSpec(None, None, None, None, None, None)
+from ..rufinlib import context
+from ..rufinlib import dates
+from ..rufinlib import decimals
+from ..rufinlib import dedup
+from ..rufinlib import directives
+from ..rufinlib import legs
+from ..rufinlib import tables
+from ..rufinlib import watermark
+from ..rufinlib import xls
+
+NOCOST = directives.NOCOST
 
 def fix_ticker(ticker):
     if ticker == 'CHMF_02':
@@ -43,27 +49,25 @@ def fix_ticker(ticker):
         return 'AGRO'
     if ticker == 'HK_486':
         return 'RUSALADR'
-    return ticker
+    return directives.name(ticker)
 
 def fix_currency(ticker):
-    return 'RUB' if ticker == 'Рубль' else ticker
+    return 'RUB' if ticker == 'Рубль' else directives.name(ticker)
 
 def check_bcsexpress(xlsfile, genid):
     ''' Verify if file from BCS Express broker
     '''
-    workbook = xlrd.open_workbook(xlsfile)
-    try:
-        sheet = workbook.sheet_by_name('TDSheet')
-    except XLRDError:
-        return False # No correct sheet in file
-    broker_name = sheet.row_values(0, start_colx=1, end_colx=None)
-    if not re.match(r'ООО "Компания БКС"', broker_name[4]):
-        return False
-    # Check general agreement id
-    genagr = sheet.row_values(4, start_colx=1, end_colx=None)
-    if not re.match(genid, genagr[4]):
-        return False
-    return True
+    with xls.open_workbook(xlsfile) as workbook, xls.load_sheet(workbook, 'TDSheet') as sheet:
+        if sheet is None:
+            return False # No correct sheet in file
+        broker_name = sheet.row_values(0, start_colx=1, end_colx=None)
+        if not re.match(r'ООО "Компания БКС"', broker_name[4]):
+            return False
+        # Check general agreement id
+        genagr = sheet.row_values(4, start_colx=1, end_colx=None)
+        if not re.match(genid, genagr[4]):
+            return False
+        return True
 
 class Importer(importer.ImporterProtocol):
     '''An importer for BCS Express XLS files'''
@@ -77,7 +81,8 @@ class Importer(importer.ImporterProtocol):
                  account_fees, 
                  account_gains,
                  account_external,
-                 balance = True):
+                 balance = True,
+                 watermark = None):
         self.general_agreement_id = general_agreement_id
         self.account_root = account_root
         self.account_cash = account_cash
@@ -86,8 +91,10 @@ class Importer(importer.ImporterProtocol):
         self.account_interest = account_interest
         self.account_fees = account_fees
         self.account_gains = account_gains
+        self.accounts = directives.Accounts(account_root, account_gains)
         self.account_external = account_external
         self.balance = balance
+        self.watermark = watermark # file with watermarks - skip already imported operations
 
         self.exchanges = {
                             'ММВБ':self.account_cash,
@@ -113,35 +120,33 @@ class Importer(importer.ImporterProtocol):
     def file_date(self, file):
         ''' Extract the statement date from the file
         '''
-        workbook = xlrd.open_workbook(file.name)
-        sheet = workbook.sheet_by_name('TDSheet')
-        rows = sheet.get_rows()
-        for row in rows:
-            if re.match('Дата составления отчета:', row[1].value):
-                return datetime.datetime.strptime(row[4].value, '%d.%m.%Y').date()
+        with xls.open_workbook(file.name) as workbook, xls.load_sheet(workbook, 'TDSheet') as sheet:
+            for row in sheet.get_rows():
+                if re.match('Дата составления отчета:', row[1].value):
+                    return dates.ru_date(row[4].value)
         # Couldn't extract date - use file creation date instead
         return None
  
-    def get_balance(self, sheet, file):
+    def get_balance(self, sheet, ctx):
         ''' Will parse broker report for end of period balances - cash and assets
-            In: XLS sheet, file
+            In: XLS sheet, extraction context
             Out: list of transactions
         '''
         result =[]
         acc = ''
         for ii in range(sheet.nrows):
-            meta = data.new_metadata(file.name, ii)
+            meta = directives.new_metadata(ctx.file.name, ii)
             
             if sheet.row(ii)[1].value[:6] == '1.1.1.':
                 acc = self.account_cash
             if sheet.row(ii)[1].value[:6] == '1.1.2.':
                 acc = self.account_currencyexchange
-            if (self.stmt_begin < datetime.date(2018, 11, 1) and 
+            if (ctx.stmt_begin < datetime.date(2018, 11, 1) and 
                     re.match(r'^Остаток денежных средств на конец периода \(', sheet.row(ii)[1].value)):
                 balance_currency = fix_currency(re.search(r'\(.*\)', sheet.row(ii)[1].value)[0][1:-1])
-                result.append( data.Balance(meta, self.stmt_end + datetime.timedelta(days=1),
+                result.append( data.Balance(meta, ctx.stmt_end + datetime.timedelta(days=1),
                                             acc,
-                                            amount.Amount(D(str(sheet.row(ii)[7].value)), balance_currency),
+                                            amount.Amount(decimals.cell2d(sheet.row(ii)[7].value), balance_currency),
                                             None, None))
             if ((re.match(r'^Портфель по ценным бумагам и денежным средствам \(', sheet.row(ii)[1].value) or
                     re.match(r'^Портфель по ценным бумагам, денежным средствам и ДМ \(', sheet.row(ii)[1].value))
@@ -149,21 +154,21 @@ class Importer(importer.ImporterProtocol):
                 sec_currency = re.search(r'\(.*\)', sheet.row(ii)[1].value)[0][1:-1]
                 ii += 2
                 while sheet.row(ii)[1].value == sec_currency:
-                    if self.stmt_begin < datetime.date(2018, 11, 1):
+                    if ctx.stmt_begin < datetime.date(2018, 11, 1):
                         ii +=1
                         continue
-                    meta = data.new_metadata(file.name, ii)
-                    result.append( data.Balance(meta, self.stmt_end + datetime.timedelta(days=1),
+                    meta = directives.new_metadata(ctx.file.name, ii)
+                    result.append( data.Balance(meta, ctx.stmt_end + datetime.timedelta(days=1),
                                             self.exchanges[sheet.row(ii)[14].value],
-                                            amount.Amount(D(str(sheet.row(ii)[13].value)), fix_currency(sec_currency)),
+                                            amount.Amount(decimals.cell2d(sheet.row(ii)[13].value), fix_currency(sec_currency)),
                                             None, None))
                     ii += 1
                 while sheet.row(ii)[1].value != 'Итого:':
                     ticker = fix_ticker(sheet.row(ii)[1].value)
-                    account_inst = account.join(self.account_root, ticker)
-                    result.append( data.Balance(meta, self.stmt_end + datetime.timedelta(days=1),
+                    account_inst = self.accounts.instrument(ticker)
+                    result.append( data.Balance(meta, ctx.stmt_end + datetime.timedelta(days=1),
                                             account_inst,
-                                            amount.Amount(D(str(sheet.row(ii)[10].value)), ticker),
+                                            amount.Amount(decimals.cell2d(sheet.row(ii)[10].value), ticker),
                                             None, None))
                     ii += 1
             if (re.match(r'^Портфель по ценным бумагам', sheet.row(ii)[1].value) and 
@@ -174,22 +179,23 @@ class Importer(importer.ImporterProtocol):
                         ii += 1
                         continue
                     ticker = fix_ticker(sheet.row(ii)[1].value)
-                    account_inst = account.join(self.account_root, ticker)
-                    result.append( data.Balance(meta, self.stmt_end + datetime.timedelta(days=1),
+                    account_inst = self.accounts.instrument(ticker)
+                    result.append( data.Balance(meta, ctx.stmt_end + datetime.timedelta(days=1),
                                             account_inst,
-                                            amount.Amount(D(str(sheet.row(ii)[10].value)), ticker),
+                                            amount.Amount(decimals.cell2d(sheet.row(ii)[10].value), ticker),
                                             None, None))
                     ii += 1
         return result
 
-    def get_cashflow(self, book, sheet, index, file):
+    def get_cashflow(self, book, sheet, index, ctx):
         ''' Will parse broker report for all cash operations (deposits, drawback, fees, dividends)
             In: XLS sheet, index of section title(1.1.)
             Out: list of transactions -- empty if there is none
         '''
-        result = []
+        cash = tables.CashTable()
         acc = ''
-        dedup = []
+        # transfers between markets are reported twice - by each market
+        dedup = legs.LegMatcher()
         # find beggining of next block
         ii = index + 1
         while ii<sheet.nrows-1:
@@ -227,32 +233,21 @@ class Importer(importer.ImporterProtocol):
                     ii += 4
                     break
 
-                trn_date = datetime.datetime.strptime(sheet.row(ii)[1].value, '%d.%m.%y').date()
+                trn_date = dates.ru_date_short(sheet.row(ii)[1].value)
                 try:
                     acc = self.exchanges[sheet.row(ii)[12].value]
                 except KeyError:
                     acc = acc_choice
-                meta = data.new_metadata(file.name, ii)
-                if sheet.row(ii)[2].value == 'Приход ДС':
-                    amt = amount.Amount(D(str(sheet.row(ii)[6].value)), trn_currency)
-                    txn = data.Transaction(
-                        meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
-                            data.Posting(acc, amt, None, None, None,
-                                            None),
-                            data.Posting(self.account_external, -amt, None, None, None,
-                                            None),
-                        ])
-                    result.append(txn)
+                if ctx.wm.skip(trn_date, row=sheet.row_values(ii)):
+                    pass # imported already
+                elif sheet.row(ii)[2].value == 'Приход ДС':
+                    amt = amount.Amount(decimals.cell2d(sheet.row(ii)[6].value), trn_currency)
+                    cash.add(ctx.file.name, ii, trn_date, acc, self.account_external, amt.number, amt.currency,
+                             sheet.row(ii)[2].value, links={trn_date})
                 elif sheet.row(ii)[2].value == 'Вывод ДС':
-                    amt = amount.Amount(D(str(sheet.row(ii)[7].value)), trn_currency)
-                    txn = data.Transaction(
-                        meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
-                            data.Posting(acc, -amt, None, None, None,
-                                            None),
-                            data.Posting(self.account_external, amt, None, None, None,
-                                            None),
-                        ])
-                    result.append(txn)
+                    amt = amount.Amount(decimals.cell2d(sheet.row(ii)[7].value), trn_currency)
+                    cash.add(ctx.file.name, ii, trn_date, acc, self.account_external, -amt.number, amt.currency,
+                             sheet.row(ii)[2].value, links={trn_date})
                 elif sheet.row(ii)[2].value == 'Переводы между площадками':
                     try:
                         acc1 = self.exchanges[sheet.row(ii)[11].value]
@@ -267,74 +262,40 @@ class Importer(importer.ImporterProtocol):
 
                     if sheet.row(ii)[6].value:
                         x = sheet.row(ii)[6].value
-                        amt = amount.Amount(D(str(sheet.row(ii)[6].value)), trn_currency)
+                        amt = amount.Amount(decimals.cell2d(sheet.row(ii)[6].value), trn_currency)
                     else:
                         x = -sheet.row(ii)[7].value
-                        amt = amount.Amount(-D(str(sheet.row(ii)[7].value)), trn_currency)
+                        amt = amount.Amount(-decimals.cell2d(sheet.row(ii)[7].value), trn_currency)
                     
-                    dd = [acc1, acc2, x] if x>0 else [acc2, acc1, -x]
-                    try:
-                        dedup.index(dd)
-                        dedup.remove(dd)
+                    direction = (acc1, acc2) if x>0 else (acc2, acc1)
+                    if dedup.match(None, direction, abs(x), ii) is not None:
                         ii += 1
                         continue
-                    except ValueError:
-                        dedup.append(dd)
 
-                    txn = data.Transaction(
-                        meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
-                            data.Posting(acc1, amt, None, None, None,
-                                            None),
-                            data.Posting(acc2, -amt, None, None, None,
-                                            None),
-                        ])
-                    result.append(txn)
+                    cash.add(ctx.file.name, ii, trn_date, acc1, acc2, amt.number, amt.currency,
+                             sheet.row(ii)[2].value, links={trn_date})
                 elif sheet.row(ii)[2].value in ['Дивиденды', 'Возмещение дивидендов по сделке']:
                     # unfortunately we don't have ticker info for dividends
-                    amt = amount.Amount(D(str(sheet.row(ii)[6].value)), trn_currency)
-                    txn = data.Transaction(
-                        meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
-                            data.Posting(acc, amt, None, None, None,
-                                            None),
-                            data.Posting(self.account_dividends, -amt, None, None, None,
-                                            None),
-                        ])
-                    result.append(txn)
+                    amt = amount.Amount(decimals.cell2d(sheet.row(ii)[6].value), trn_currency)
+                    cash.add(ctx.file.name, ii, trn_date, acc, self.account_dividends, amt.number, amt.currency,
+                             sheet.row(ii)[2].value, links={trn_date})
                 elif sheet.row(ii)[2].value in ['Урегулирование сделок','Вознаграждение за обслуживание счета депо', 'Хранение ЦБ',
                                                 'Вознаграждение компании', 'Quik','Оплата за вывод денежных средств', 
                                                 'Комиссия за займы "овернайт ЦБ"', 'Урегулирование сделок по Айсберг-заявкам']:
                     # unfortunately we don't have ticker info for fees
-                    amt = amount.Amount(D(str(sheet.row(ii)[7].value)), trn_currency)
-                    txn = data.Transaction(
-                        meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
-                            data.Posting(acc, -amt, None, None, None,
-                                            None),
-                            data.Posting(self.account_fees, amt, None, None, None,
-                                            None),
-                        ])
-                    result.append(txn)
+                    amt = amount.Amount(decimals.cell2d(sheet.row(ii)[7].value), trn_currency)
+                    cash.add(ctx.file.name, ii, trn_date, acc, self.account_fees, -amt.number, amt.currency,
+                             sheet.row(ii)[2].value, links={trn_date})
                 elif sheet.row(ii)[2].value in ['Займы "овернайт"', 'Проценты по займам "овернайт"', 'Проценты по займам "овернайт ЦБ"',
                                                 'НКД от операций', 'НДФЛ', 'Подоходный налог']:
                     if sheet.row(ii)[7].value:
-                        amt = amount.Amount(D(str(sheet.row(ii)[7].value)), trn_currency) 
-                        txn = data.Transaction(
-                            meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
-                            data.Posting(acc, -amt, None, None, None,
-                                            None),
-                            data.Posting(self.account_interest, amt, None, None, None,
-                                            None),
-                        ])
-                        result.append(txn)
+                        amt = amount.Amount(decimals.cell2d(sheet.row(ii)[7].value), trn_currency) 
+                        cash.add(ctx.file.name, ii, trn_date, acc, self.account_interest, -amt.number, amt.currency,
+                                 sheet.row(ii)[2].value, links={trn_date})
                     if sheet.row(ii)[6].value:
-                        amt = amount.Amount(-D(str(sheet.row(ii)[6].value)), trn_currency)
-                        txn = data.Transaction(
-                            meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
-                                data.Posting(acc, -amt, None, None, None,
-                                                None),
-                                data.Posting(self.account_interest, amt, None, None, None,
-                                                None),
-                            ])
-                        result.append(txn)
+                        amt = amount.Amount(-decimals.cell2d(sheet.row(ii)[6].value), trn_currency)
+                        cash.add(ctx.file.name, ii, trn_date, acc, self.account_interest, -amt.number, amt.currency,
+                                 sheet.row(ii)[2].value, links={trn_date})
 
                 ii += 1
                 if sheet.row(ii)[1].value[:5] == 'Итого':
@@ -343,34 +304,39 @@ class Importer(importer.ImporterProtocol):
             # it's next section - lets find if this is fees
             if sheet.row(ii)[1].value in ['1.2. Займы "Овернайт":', '1.3. Удержанные сборы/штрафы (итоговые суммы):', 
                                         '1.2. Займы "Овернайт"/"Овернайт ГО":', '1.2. Займы:']:
-                return result
-        return result
+                return cash.build(self.FLAG)
+        return cash.build(self.FLAG)
 
-    def extract(self, file):
+    def extract(self, file, existing_entries=None):
         ''' Open XLS file and create directives
+            Deals with ids which are in the ledger (existing_entries) are dropped
         '''
         entries = []
         index = 0
-        workbook = xlrd.open_workbook(file.name, formatting_info=True)
-        sheet = workbook.sheet_by_name('TDSheet')
-        # extract broker report dates - row 2 col 5
-        per = sheet.row(2)[5].value
-        self.stmt_begin = datetime.datetime.strptime(per[2:12], '%d.%m.%Y').date()
-        self.stmt_end = datetime.datetime.strptime(per[16:], '%d.%m.%Y').date()
+        ctx = context.ExtractContext(file, wm=watermark.Watermark(self.watermark, self.account_root))
+        # only TDSheet is loaded - and unloaded as soon as it's parsed
+        with xls.open_workbook(file.name, formatting_info=True) as workbook, \
+                xls.load_sheet(workbook, 'TDSheet') as sheet:
+            # extract broker report dates - row 2 col 5
+            per = sheet.row(2)[5].value
+            ctx.stmt_begin = dates.ru_date(per[2:12])
+            ctx.stmt_end = dates.ru_date(per[16:])
 
-        for index in range(sheet.nrows):
-            if sheet.row(index)[1].value == r'1. Движение денежных средств': #'1.1. Движение денежных средств по совершенным сделкам:':
-                cashflow = self.get_cashflow(workbook, sheet, index, file)
-                entries += cashflow
-            # Find section 2.1 - transactions completed in report's period
-            if sheet.row(index)[1].value == r'2.1. Сделки:': 
-                entries += self.get_transactions(workbook, sheet, index, file)
-        
-        if self.balance:
-            entries += self.get_balance(sheet, file)
-        return entries
+            for index in range(sheet.nrows):
+                if sheet.row(index)[1].value == r'1. Движение денежных средств': #'1.1. Движение денежных средств по совершенным сделкам:':
+                    cashflow = self.get_cashflow(workbook, sheet, index, ctx)
+                    entries += cashflow
+                # Find section 2.1 - transactions completed in report's period
+                if sheet.row(index)[1].value == r'2.1. Сделки:': 
+                    entries += self.get_transactions(workbook, sheet, index, ctx)
+            
+            if self.balance:
+                entries += self.get_balance(sheet, ctx)
+        ctx.wm.save()
+        return dedup.filter_known(entries, existing_entries,
+                                  self.account_root, self.account_cash, self.account_currencyexchange)
 
-    def get_transactions(self, book, sheet, index, file):
+    def get_transactions(self, book, sheet, index, ctx):
         # Cash and papers are described in different subsections index += 1
         entries = []
         acc = ''
@@ -391,23 +357,26 @@ class Importer(importer.ImporterProtocol):
                 while sheet.row(ii)[1].value != '':
                     # read ticker
                     ticker = fix_ticker(sheet.row(ii)[1].value)
-                    account_inst = account.join(self.account_root, ticker)
+                    account_inst = self.accounts.instrument(ticker)
                     isin = sheet.row(ii)[7].value
                     title = sheet.row(ii)[8].value
                     ii += 1
                     #start to read transactions - pass to first transaction
                     while sheet.row(ii)[1].value[:5] != r'Итого':
-                        trn_date = datetime.datetime.strptime(sheet.row(ii)[1].value, '%d.%m.%y').date()
+                        trn_date = dates.ru_date_short(sheet.row(ii)[1].value)
                         trn_num = sheet.row(ii)[2].value #transaction id by broker
+                        if ctx.wm.skip(trn_date, trn_num):
+                            ii += 1
+                            continue # imported already
                         trn_currency = 'RUB' if sheet.row(ii)[11].value == 'Рубль' else sheet.row(ii)[11].value
                         # are we selling our buying? cols 4,5 - buying, cols 7,8 - selling
                         if sheet.row(ii)[4].value != '':
                             # we bought the ticker
                             # instantiate amount bought, 'currency' - ticker itself
-                            meta = data.new_metadata(file.name, ii)
-                            units_inst = amount.Amount(D(sheet.row(ii)[4].value), ticker) # amount of ticker bought
-                            price = amount.Amount(-1*D(str(sheet.row(ii)[6].value)), trn_currency) # payment for transaction
-                            cost = position.Cost(D(str(sheet.row(ii)[5].value)), trn_currency, None, None) # cost of single unit
+                            meta = directives.new_metadata(ctx.file.name, ii)
+                            units_inst = amount.Amount(decimals.cell2d(sheet.row(ii)[4].value), ticker) # amount of ticker bought
+                            price = amount.Amount(-1*decimals.cell2d(sheet.row(ii)[6].value), trn_currency) # payment for transaction
+                            cost = position.Cost(decimals.cell2d(sheet.row(ii)[5].value), trn_currency, None, None) # cost of single unit
                             #cost = amount.Amount(D(str(sheet.row(ii)[5].value)), trn_currency) # cost of single unit
                             #pos = position.Position(units_inst, cost)
                             txn = data.Transaction(
@@ -420,11 +389,11 @@ class Importer(importer.ImporterProtocol):
                             entries.append(txn)
                         elif sheet.row(ii)[7].value != '':
                             # we sold ticker
-                            meta = data.new_metadata(file.name, ii)
-                            units_inst = amount.Amount(-1*D(sheet.row(ii)[7].value), ticker) # amount of ticker sold
-                            price = amount.Amount(D(str(sheet.row(ii)[9].value)), trn_currency) # payment for transaction
-                            cost = amount.Amount(D(str(sheet.row(ii)[8].value)), trn_currency) # cost of single unit
-                            account_gains = self.account_gains.format(ticker)
+                            meta = directives.new_metadata(ctx.file.name, ii)
+                            units_inst = amount.Amount(-1*decimals.cell2d(sheet.row(ii)[7].value), ticker) # amount of ticker sold
+                            price = amount.Amount(decimals.cell2d(sheet.row(ii)[9].value), trn_currency) # payment for transaction
+                            cost = amount.Amount(decimals.cell2d(sheet.row(ii)[8].value), trn_currency) # cost of single unit
+                            account_gains = self.accounts.gains(ticker)
                             txn = data.Transaction(
                                     meta, trn_date, self.FLAG, None, title, data.EMPTY_SET, {trn_num}, [
                                         data.Posting(acc, price, None, None, None,
@@ -451,22 +420,25 @@ class Importer(importer.ImporterProtocol):
                     ticker = sheet.row(ii)[1].value
                     ii += 1
                     while sheet.row(ii)[1].value[:5] != r'Итого':
-                        meta = data.new_metadata(file.name, ii)
-                        trn_date = datetime.datetime.strptime(sheet.row(ii)[1].value, '%d.%m.%y').date()
+                        meta = directives.new_metadata(ctx.file.name, ii)
+                        trn_date = dates.ru_date_short(sheet.row(ii)[1].value)
                         trn_num = sheet.row(ii)[2].value #transaction id by broker
+                        if ctx.wm.skip(trn_date, trn_num):
+                            ii += 1
+                            continue # imported already
                         # check if we buy or sell
                         if sheet.row(ii)[4].value:
                             # we buy
-                            conv_rate = amount.Amount(D(str(sheet.row(ii)[4].value)), 
+                            conv_rate = amount.Amount(decimals.cell2d(sheet.row(ii)[4].value), 
                                                       bought_currency)
-                            amount_bought = amount.Amount(D(sheet.row(ii)[5].value), sold_currency) # amount of ticker sold
-                            price = amount.Amount(-1*D(str(sheet.row(ii)[6].value)), bought_currency) # payment for transaction,                            
+                            amount_bought = amount.Amount(decimals.cell2d(sheet.row(ii)[5].value), sold_currency) # amount of ticker sold
+                            price = amount.Amount(-1*decimals.cell2d(sheet.row(ii)[6].value), bought_currency) # payment for transaction,                            
                         else:
                             #we sell
-                            conv_rate = amount.Amount(D(str(sheet.row(ii)[7].value)), 
+                            conv_rate = amount.Amount(decimals.cell2d(sheet.row(ii)[7].value), 
                                                     bought_currency)
-                            amount_bought = amount.Amount(-1*D(sheet.row(ii)[8].value), sold_currency) # amount of ticker sold
-                            price = amount.Amount(D(str(sheet.row(ii)[9].value)), bought_currency) # payment for transaction
+                            amount_bought = amount.Amount(-1*decimals.cell2d(sheet.row(ii)[8].value), sold_currency) # amount of ticker sold
+                            price = amount.Amount(decimals.cell2d(sheet.row(ii)[9].value), bought_currency) # payment for transaction
                         txn = data.Transaction(
                                     meta, trn_date, self.FLAG, None, ticker, data.EMPTY_SET, {trn_num}, [
                                         #data.Posting(acc, amount_bought, conv_rate, None, None, None),
@@ -483,23 +455,26 @@ class Importer(importer.ImporterProtocol):
                 while sheet.row(ii)[1].value != '':
                     # read ticker
                     ticker = fix_ticker(sheet.row(ii)[1].value)
-                    account_inst = account.join(self.account_root, ticker)
+                    account_inst = self.accounts.instrument(ticker)
                     isin = sheet.row(ii)[7].value
                     title = sheet.row(ii)[8].value
                     ii += 1
                     #start to read transactions - pass to first transaction
                     while sheet.row(ii)[1].value[:5] != r'Итого':
-                        trn_date = datetime.datetime.strptime(sheet.row(ii)[1].value, '%d.%m.%y').date()
+                        trn_date = dates.ru_date_short(sheet.row(ii)[1].value)
                         trn_num = sheet.row(ii)[2].value #transaction id by broker
+                        if ctx.wm.skip(trn_date, trn_num):
+                            ii += 1
+                            continue # imported already
                         trn_currency = 'RUB' if sheet.row(ii)[13].value == 'Рубль' else sheet.row(ii)[13].value
                         # are we selling our buying? cols 4,5 - buying, cols 7,8 - selling
                         if sheet.row(ii)[4].value != '':
                             # we bought the ticker
                             # instantiate amount bought, 'currency' - ticker itself
-                            meta = data.new_metadata(file.name, ii)
-                            units_inst = amount.Amount(D(sheet.row(ii)[4].value), ticker) # amount of ticker bought
-                            price = amount.Amount(-1*D(str(sheet.row(ii)[6].value)), trn_currency) # payment for transaction
-                            cost = position.Cost(D(str(sheet.row(ii)[5].value))*10, trn_currency, None, None) # cost of single unit
+                            meta = directives.new_metadata(ctx.file.name, ii)
+                            units_inst = amount.Amount(decimals.cell2d(sheet.row(ii)[4].value), ticker) # amount of ticker bought
+                            price = amount.Amount(-1*decimals.cell2d(sheet.row(ii)[6].value), trn_currency) # payment for transaction
+                            cost = position.Cost(decimals.cell2d(sheet.row(ii)[5].value)*10, trn_currency, None, None) # cost of single unit
                             txn = data.Transaction(
                                     meta, trn_date, self.FLAG, None, title, data.EMPTY_SET, {trn_num}, [
                                         data.Posting(acc, price, None, None, None, None),
@@ -510,11 +485,11 @@ class Importer(importer.ImporterProtocol):
                             entries.append(txn)
                         elif sheet.row(ii)[8].value != '':
                             # we sold ticker
-                            meta = data.new_metadata(file.name, ii)
-                            units_inst = amount.Amount(-1*D(sheet.row(ii)[8].value), ticker) # amount of ticker sold
-                            price = amount.Amount(D(str(sheet.row(ii)[10].value)), trn_currency) # payment for transaction
-                            cost = amount.Amount(D(str(sheet.row(ii)[9].value))*10, trn_currency) # cost of single unit
-                            account_gains = self.account_gains.format(ticker)
+                            meta = directives.new_metadata(ctx.file.name, ii)
+                            units_inst = amount.Amount(-1*decimals.cell2d(sheet.row(ii)[8].value), ticker) # amount of ticker sold
+                            price = amount.Amount(decimals.cell2d(sheet.row(ii)[10].value), trn_currency) # payment for transaction
+                            cost = amount.Amount(decimals.cell2d(sheet.row(ii)[9].value)*10, trn_currency) # cost of single unit
+                            account_gains = self.accounts.gains(ticker)
                             txn = data.Transaction(
                                     meta, trn_date, self.FLAG, None, title, data.EMPTY_SET, {trn_num}, [
                                         data.Posting(acc, price, None, None, None,
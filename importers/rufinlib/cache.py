@@ -0,0 +1,189 @@
+''' Content-addressed cache of extracted directives
+    Importer wrapped into CachedImporter parses a file only if there are no directives
+    for it in the cache. Cache key is made of:
+        - hash of file content and file's base name (some reports have period only in the name)
+        - importer class and its configuration (parameters given to importer)
+        - version of the code: beancount version and hash of importers' sources
+    Importers with watermark aren't cached: what they extract depends on the watermark
+    and extraction saves the new (pending) watermark, which a cache hit would skip.
+    Directives are stored pickled, one file per key. Least recently used files are
+    removed when cache grows over max_size.
+
+    config.py:
+        CONFIG = [cache.CachedImporter(vtb.Importer(...)), ...]
+'''
+import os
+import glob
+import pickle
+import inspect
+import hashlib
+import datetime
+import tempfile
+from functools import lru_cache
+
+import beancount
+from beancount.ingest import importer
+
+from . import dedup
+
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'rufinlib')
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+SUFFIX = '.pickle'
+# types of importer's attributes which are its configuration
+CONFIG_TYPES = (str, int, float, bool, type(None), datetime.date)
+# accounts of importer used to find duplicates by deal ids
+DEDUP_ACCOUNTS = ('account_root', 'account_cash', 'account_currencyexchange')
+
+
+def file_hash(filename):
+    ''' sha256 of file content
+    '''
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def code_version():
+    ''' Version of the code which extracts directives: beancount version and hash of
+        all importers' sources
+    '''
+    h = hashlib.sha256(beancount.__version__.encode())
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for name in sorted(glob.glob(os.path.join(root, '*', '*.py'))):
+        with open(name, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def importer_config(imp):
+    ''' Configuration of importer - its attributes of simple types (sorted repr)
+    '''
+    config = []
+    for name, value in sorted(vars(imp).items()):
+        if name.startswith('_'):
+            continue
+        if isinstance(value, CONFIG_TYPES) or (
+                isinstance(value, (tuple, list)) and all(isinstance(x, CONFIG_TYPES) for x in value)):
+            config.append((name, value))
+    return repr(config)
+
+
+class CachedImporter(importer.ImporterProtocol):
+    ''' Importer which takes directives from cache or from wrapped importer (and caches them)
+    '''
+
+    def __init__(self, imp, cache_dir=DEFAULT_DIR, max_size=DEFAULT_MAX_SIZE):
+        self.importer = imp
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        cls = type(imp)
+        # configuration is taken before extraction - importers keep state of extraction in attributes
+        self.config = '{}.{}:{}'.format(cls.__module__, cls.__qualname__, importer_config(imp))
+        self.accounts = [getattr(imp, name) for name in DEDUP_ACCOUNTS if getattr(imp, name, None)]
+        self.hits = self.misses = 0
+
+    def name(self):
+        return self.importer.name()
+
+    def identify(self, file):
+        return self.importer.identify(file)
+
+    def file_account(self, file):
+        return self.importer.file_account(file)
+
+    def file_name(self, file):
+        return self.importer.file_name(file)
+
+    def file_date(self, file):
+        return self.importer.file_date(file)
+
+    def cacheable(self):
+        ''' Directives of importers which take data from other files or API or skip rows
+            by watermark don't depend only on file
+        '''
+        return not any(getattr(self.importer, name, None) for name in ('combine', 'token', 'watermark'))
+
+    def key(self, filename):
+        h = hashlib.sha256()
+        h.update(file_hash(filename).encode())
+        h.update(os.path.basename(filename).encode())
+        h.update(self.config.encode())
+        h.update(code_version().encode())
+        return h.hexdigest()
+
+    def extract(self, file, existing_entries=None):
+        ''' Extract directives from cache or by wrapped importer.
+            Duplicates (by deal ids) are dropped after loading from cache - cache doesn't depend on ledger.
+        '''
+        if not self.cacheable():
+            return self.call_extract(file, existing_entries)
+
+        path = os.path.join(self.cache_dir, self.key(file.name) + SUFFIX)
+        entries = self.load(path, file.name)
+        if entries is None:
+            self.misses += 1
+            entries = self.call_extract(file, None)
+            self.store(path, file.name, entries)
+        else:
+            self.hits += 1
+        return dedup.filter_known(entries, existing_entries, *self.accounts)
+
+    def call_extract(self, file, existing_entries):
+        if 'existing_entries' in inspect.signature(self.importer.extract).parameters:
+            return self.importer.extract(file, existing_entries=existing_entries)
+        return self.importer.extract(file)
+
+    def load(self, path, filename):
+        ''' Load directives from cache - None if there is none
+        '''
+        try:
+            with open(path, 'rb') as f:
+                cached_name, entries = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(path) # recently used
+        if cached_name != filename:
+            # file was moved - fix file name in metadata
+            entries = [entry._replace(meta=dict(entry.meta, filename=filename))
+                       if entry.meta and entry.meta.get('filename') == cached_name else entry
+                       for entry in entries]
+        return entries
+
+    def store(self, path, filename, entries):
+        ''' Store directives in cache and evict least recently used ones if cache is too big
+        '''
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((filename, entries), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.evict()
+
+    def evict(self):
+        ''' Remove least recently used files until cache fits into max_size
+        '''
+        files = []
+        total = 0
+        for name in glob.glob(os.path.join(self.cache_dir, '*' + SUFFIX)):
+            try:
+                st = os.stat(name)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+        files.sort()
+        for _, size, name in files:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(name)
+            except OSError:
+                continue
+            total -= size
@@ -0,0 +1,74 @@
+import os
+import shutil
+import unittest
+import datetime
+import tempfile
+
+from beancount.core import data
+from beancount.ingest import importer
+from beancount.ingest import cache as ingest_cache
+
+from . import cache
+
+
+class CountingImporter(importer.ImporterProtocol):
+
+    def __init__(self, account_root):
+        self.account_root = account_root
+        self.calls = 0
+
+    def extract(self, file):
+        self.calls += 1
+        meta = data.new_metadata(file.name, 1)
+        return [data.Note(meta, datetime.date(2021, 1, 1), self.account_root, file.contents())]
+
+
+class TestCachedImporter(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.dir, 'cache')
+        self.filename = os.path.join(self.dir, 'report.txt')
+        with open(self.filename, 'w') as f:
+            f.write('first')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def extract(self, imp):
+        return imp.extract(ingest_cache._FileMemo(self.filename))
+
+    def test_hit_and_miss(self):
+        inner = CountingImporter('Assets:Broker')
+        imp = cache.CachedImporter(inner, cache_dir=self.cache_dir)
+        first = self.extract(imp)
+        self.assertEqual(self.extract(imp), first)
+        self.assertEqual(inner.calls, 1)
+        # changed content
+        with open(self.filename, 'w') as f:
+            f.write('second')
+        self.assertEqual(self.extract(imp)[0].comment, 'second')
+        self.assertEqual(inner.calls, 2)
+        # changed configuration
+        inner = CountingImporter('Assets:Other')
+        self.assertEqual(self.extract(cache.CachedImporter(inner, cache_dir=self.cache_dir))[0].account,
+                         'Assets:Other')
+        self.assertEqual(inner.calls, 1)
+
+    def test_eviction(self):
+        imp = cache.CachedImporter(CountingImporter('Assets:Broker'), cache_dir=self.cache_dir, max_size=0)
+        self.extract(imp)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_watermark(self):
+        inner = CountingImporter('Assets:Broker')
+        inner.watermark = os.path.join(self.dir, 'watermarks.json')
+        imp = cache.CachedImporter(inner, cache_dir=self.cache_dir)
+        self.extract(imp)
+        self.extract(imp)
+        self.assertEqual(inner.calls, 2) # extracted each time - watermark decides what is new
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
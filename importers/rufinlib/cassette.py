@@ -0,0 +1,103 @@
+''' Record and replay of broker API calls
+    Cassette wraps API client: in record mode calls go to the API and responses are stored,
+    in replay mode the stored responses are returned without any connection to the API.
+    Import may be repeated (e.g. to tweak accounts) instantly and reproducibly, offline.
+
+    Call is identified by method path (e.g. "users.get_accounts") and its arguments.
+    Times (period of operations) aren't part of the key - replay returns the recorded period.
+    Cassette file is pickle of responses (responses of APIs are dataclasses).
+    Data the import takes from elsewhere (e.g. local cache of instruments) is recorded by
+    name along with responses, so replay doesn't depend on local files.
+'''
+import os
+import pickle
+import datetime
+import threading
+
+RECORD = 'record'
+REPLAY = 'replay'
+MODES = (RECORD, REPLAY)
+
+
+def call_key(path: str, kwargs: dict) -> tuple:
+    return (path, tuple(sorted((name, repr(value)) for name, value in kwargs.items()
+                               if not isinstance(value, datetime.date))))
+
+
+class Cassette:
+    ''' Responses of API calls stored in file
+        mode: RECORD or REPLAY - default is replay if the file exists, record otherwise
+    '''
+
+    def __init__(self, filename, mode=None):
+        if mode is None:
+            mode = REPLAY if os.path.exists(filename) else RECORD
+        if mode not in MODES:
+            raise ValueError('Unknown cassette mode: {}'.format(mode))
+        self.filename = filename
+        self.mode = mode
+        self.responses = {}
+        self.lock = threading.Lock()
+        if mode == REPLAY:
+            with open(filename, 'rb') as f:
+                self.responses = pickle.load(f)
+
+    @property
+    def replaying(self):
+        return self.mode == REPLAY
+
+    def wrap(self, client):
+        ''' Client with the same methods recorded or replayed (client is None in replay mode)
+        '''
+        return Proxy(self, client, ())
+
+    def call(self, path: str, method, kwargs: dict):
+        key = call_key(path, kwargs)
+        if self.replaying:
+            try:
+                return self.responses[key]
+            except KeyError:
+                raise KeyError('Call is not recorded in cassette {}: {}'.format(self.filename, key)) from None
+        response = method(**kwargs)
+        with self.lock:
+            self.responses[key] = response
+        return response
+
+    def record(self, name: str, value):
+        ''' Store data used by the import along with responses
+        '''
+        with self.lock:
+            self.responses[name, None] = value
+
+    def recorded(self, name: str):
+        ''' Data stored by record
+        '''
+        try:
+            return self.responses[name, None]
+        except KeyError:
+            raise KeyError('{} is not recorded in cassette {}'.format(name, self.filename)) from None
+
+    def save(self):
+        ''' Store recorded responses
+        '''
+        if self.replaying:
+            return
+        with self.lock, open(self.filename, 'wb') as f:
+            pickle.dump(self.responses, f)
+
+
+class Proxy:
+    ''' Attribute of client (service or method) - calls of methods go through cassette
+    '''
+
+    def __init__(self, cassette, target, path):
+        self._cassette = cassette
+        self._target = target
+        self._path = path
+
+    def __getattr__(self, name):
+        target = None if self._target is None else getattr(self._target, name)
+        return Proxy(self._cassette, target, self._path + (name,))
+
+    def __call__(self, **kwargs):
+        return self._cassette.call('.'.join(self._path), self._target, kwargs)
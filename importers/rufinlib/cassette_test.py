@@ -0,0 +1,52 @@
+import os
+import types
+import datetime
+import tempfile
+import unittest
+from unittest import mock
+
+from . import cassette
+
+
+class TestCassette(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.pickle')
+        os.close(fd)
+        os.unlink(self.filename)
+        self.get_operations = mock.Mock(side_effect=lambda **kwargs: ['op of ' + kwargs['account_id']])
+        self.client = types.SimpleNamespace(operations=types.SimpleNamespace(get_operations=self.get_operations))
+
+    def tearDown(self):
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
+
+    def test_record_replay(self):
+        recorder = cassette.Cassette(self.filename)
+        self.assertFalse(recorder.replaying)
+        client = recorder.wrap(self.client)
+        self.assertEqual(client.operations.get_operations(account_id='1', to=datetime.datetime(2021, 3, 1)),
+                         ['op of 1'])
+        recorder.record('instruments', {'FIGI': {'ticker': 'SBER'}})
+        recorder.save()
+
+        player = cassette.Cassette(self.filename)
+        self.assertTrue(player.replaying)
+        client = player.wrap(None)
+        # period isn't part of the key
+        self.assertEqual(client.operations.get_operations(account_id='1', to=datetime.datetime(2021, 4, 1)),
+                         ['op of 1'])
+        self.assertEqual(self.get_operations.call_count, 1)
+        with self.assertRaises(KeyError):
+            client.operations.get_operations(account_id='2')
+        self.assertEqual(player.recorded('instruments'), {'FIGI': {'ticker': 'SBER'}})
+        with self.assertRaises(KeyError):
+            player.recorded('positions')
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            cassette.Cassette(self.filename, 'once')
+
+
+if __name__ == '__main__':
+    unittest.main()
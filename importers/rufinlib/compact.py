@@ -0,0 +1,63 @@
+''' Compaction of small repeated operations
+    Fees, overnight and repo operations come by thousands a year. With compaction they are
+    aggregated into one summary transaction per period (day or month) and postings (accounts
+    and currencies). Broker ids of aggregated operations are kept in 'ids' metadata of the
+    summary, so they are still found in the ledger (see dedup) and by the user.
+'''
+from beancount.core import data
+
+from . import dedup
+from . import directives
+
+PERIODS = {
+    'daily': lambda date: date,
+    'monthly': lambda date: (date.year, date.month),
+}
+
+
+def group_key(entry, period):
+    ''' Operations of the same period, flag, accounts and currencies go to the same summary
+    '''
+    return (PERIODS[period](entry.date), entry.flag,
+            tuple((p.account, p.units.currency if p.units else None) for p in entry.postings))
+
+
+def summary(group):
+    ''' Summary transaction of the operations: sums of postings at the last date of operations
+        Postings without units (interpolated by beancount) are left without units.
+    '''
+    first = group[0]
+    postings = []
+    for i, posting in enumerate(first.postings):
+        units = None
+        if posting.units is not None:
+            units = directives.amount(sum(entry.postings[i].units.number for entry in group),
+                                      posting.units.currency)
+        postings.append(directives.posting(posting.account, units))
+    ids = set()
+    for entry in group:
+        ids |= dedup.entry_ids(entry)
+    meta = directives.new_metadata(first.meta['filename'], first.meta['lineno'])
+    if ids:
+        meta[dedup.IDS] = ' '.join(sorted(ids))
+    narration = '{} (+{})'.format(first.narration, len(group) - 1)
+    return data.Transaction(meta, max(entry.date for entry in group), first.flag, None, narration,
+                            data.EMPTY_SET, data.EMPTY_SET, postings)
+
+
+def compact(entries, period):
+    ''' Aggregate transactions into summaries by period: 'daily' or 'monthly'
+        Transactions with cost or price aren't aggregated, single operation of period is kept as is.
+    '''
+    if not period:
+        return entries
+    result = []
+    groups = {}
+    for entry in entries:
+        if any(p.cost or p.price for p in entry.postings):
+            result.append(entry)
+            continue
+        groups.setdefault(group_key(entry, period), []).append(entry)
+    for group in groups.values():
+        result.append(group[0] if len(group) == 1 else summary(group))
+    return result
@@ -0,0 +1,46 @@
+import unittest
+import datetime
+
+from beancount.core import data
+from beancount.core import amount
+from beancount.core.amount import D
+
+from . import compact
+from . import dedup
+
+
+def fee(day, number, deal_id, currency='RUB'):
+    amt = amount.Amount(D(number), currency)
+    return data.Transaction(data.new_metadata('test', day), datetime.date(2021, 1, day), '*', None, 'fee',
+                            {deal_id}, data.EMPTY_SET, [
+                                data.Posting('Assets:Broker:Cash', -amt, None, None, None, None),
+                                data.Posting('Expenses:Fees', amt, None, None, None, None),
+                            ])
+
+
+class TestCompact(unittest.TestCase):
+
+    def setUp(self):
+        self.fees = [fee(1, '1', '100'), fee(1, '2', '101'), fee(2, '3', '102'), fee(2, '4', '103', 'USD')]
+
+    def test_daily(self):
+        result = compact.compact(self.fees, 'daily')
+        self.assertEqual(len(result), 3)
+        self.assertEqual(result[0].postings[1].units, amount.Amount(D('3'), 'RUB'))
+        self.assertEqual(result[0].meta[dedup.IDS], '100 101')
+        self.assertEqual(result[1], self.fees[2]) # single operation is kept as is
+
+    def test_monthly(self):
+        result = compact.compact(self.fees, 'monthly')
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result[0].date, datetime.date(2021, 1, 2))
+        self.assertEqual(result[0].postings[0].units, amount.Amount(D('-6'), 'RUB'))
+        self.assertEqual(compact.compact(self.fees, None), self.fees)
+
+    def test_ids_in_ledger(self):
+        ledger = compact.compact(self.fees[:2], 'daily')
+        self.assertEqual(dedup.filter_known(self.fees, ledger, 'Assets:Broker'), self.fees[2:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,16 @@
+''' Per-call state of extraction
+    Importer instances hold configuration only and are never changed by extract(), so one
+    configured importer may extract several files at the same time (thread pool, server).
+    Everything found while parsing a file - statement period, watermark, XML namespace,
+    assets of the account - goes to context created by extract() and passed to parsers.
+'''
+import types
+
+
+class ExtractContext(types.SimpleNamespace):
+    ''' State of extraction of one file: file and statement period plus any state
+        the importer needs (given as keyword arguments or set while parsing)
+    '''
+
+    def __init__(self, file, stmt_begin=None, stmt_end=None, **kwargs):
+        super().__init__(file=file, stmt_begin=stmt_begin, stmt_end=stmt_end, **kwargs)
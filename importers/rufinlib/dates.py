@@ -0,0 +1,74 @@
+''' Fast date parsing for broker reports
+    Reports repeat the same dates in every row, so all parsers are memoized.
+    Fixed formats are parsed by slicing, dateutil is used only as fallback for unknown formats.
+'''
+import datetime
+from functools import lru_cache
+
+from dateutil.parser import parse
+from xlrd import xldate
+
+CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def ru_date(text):
+    ''' Parse Russian date 'dd.mm.yyyy' (extra characters after date are ignored)
+    '''
+    return datetime.date(int(text[6:10]), int(text[3:5]), int(text[0:2]))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def ru_date_short(text):
+    ''' Parse Russian date with short year 'dd.mm.yy' - same century rules as strptime('%y')
+    '''
+    year = int(text[6:8])
+    year += 2000 if year < 69 else 1900
+    return datetime.date(year, int(text[3:5]), int(text[0:2]))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def iso_date(text):
+    ''' Parse ISO date 'yyyy-mm-dd' - time part (if any) is ignored
+    '''
+    return datetime.date(int(text[0:4]), int(text[5:7]), int(text[8:10]))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def to_date(text):
+    ''' Parse date in any format met in reports: ISO, dd.mm.yyyy, dd.mm.yy or anything dateutil understands
+    '''
+    try:
+        if text[4:5] == '-' and text[7:8] == '-':
+            return iso_date(text)
+        if text[2:3] == '.' and text[5:6] == '.':
+            if text[8:10].isdigit():
+                return ru_date(text)
+            return ru_date_short(text)
+    except ValueError:
+        pass
+    return parse(text).date()
+
+
+def utc_time(value):
+    ''' Time zone aware datetime of date or datetime: date is its midnight, naive datetime is UTC
+    '''
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def xldate_as_datetime(value, datemode=0):
+    ''' Convert Excel serial date to datetime - xlrd's conversion, memoized
+    '''
+    return xldate.xldate_as_datetime(value, datemode)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def xldate_as_date(value, datemode=0):
+    ''' Convert Excel serial date to date
+    '''
+    return xldate_as_datetime(value, datemode).date()
@@ -0,0 +1,47 @@
+import unittest
+import datetime
+
+from . import dates
+
+
+class TestDates(unittest.TestCase):
+
+    def test_ru_date(self):
+        self.assertEqual(dates.ru_date('31.03.2021 10:00'), datetime.date(2021, 3, 31))
+
+    def test_ru_date_short(self):
+        # years below 69 are 20xx - same as strptime('%y')
+        self.assertEqual(dates.ru_date_short('01.02.68'), datetime.date(2068, 2, 1))
+        self.assertEqual(dates.ru_date_short('01.02.69'), datetime.date(1969, 2, 1))
+        self.assertEqual(dates.ru_date_short('31.12.21'), datetime.datetime.strptime('31.12.21', '%d.%m.%y').date())
+
+    def test_iso_date(self):
+        self.assertEqual(dates.iso_date('2021-03-31'), datetime.date(2021, 3, 31))
+        self.assertEqual(dates.iso_date('2021-03-31T23:59:59'), datetime.date(2021, 3, 31))
+        # date as it's written, time zone isn't applied
+        self.assertEqual(dates.iso_date('2021-03-31T23:00:00+00:00'), datetime.date(2021, 3, 31))
+        self.assertEqual(dates.iso_date('2021-03-31 01:00:00+03:00'), datetime.date(2021, 3, 31))
+
+    def test_to_date(self):
+        self.assertEqual(dates.to_date('2021-03-31T10:00:00'), datetime.date(2021, 3, 31))
+        self.assertEqual(dates.to_date('31.03.2021'), datetime.date(2021, 3, 31))
+        self.assertEqual(dates.to_date('31.03.21'), datetime.date(2021, 3, 31))
+        self.assertEqual(dates.to_date('March 31, 2021'), datetime.date(2021, 3, 31))
+
+    def test_utc_time(self):
+        utc = datetime.timezone.utc
+        self.assertEqual(dates.utc_time(datetime.date(2021, 3, 31)), datetime.datetime(2021, 3, 31, tzinfo=utc))
+        self.assertEqual(dates.utc_time(datetime.datetime(2021, 3, 31, 10)), datetime.datetime(2021, 3, 31, 10, tzinfo=utc))
+        msk = datetime.timezone(datetime.timedelta(hours=3))
+        self.assertEqual(dates.utc_time(datetime.datetime(2021, 3, 31, tzinfo=msk)).tzinfo, msk)
+
+    def test_xldate(self):
+        self.assertEqual(dates.xldate_as_datetime(44286.5), datetime.datetime(2021, 3, 31, 12))
+        # Excel counts 29.02.1900 as a day - serial dates around it
+        self.assertEqual(dates.xldate_as_date(59), datetime.date(1900, 2, 28))
+        self.assertEqual(dates.xldate_as_date(61), datetime.date(1900, 3, 1))
+        self.assertEqual(dates.xldate_as_date(0, 1), datetime.date(1904, 1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
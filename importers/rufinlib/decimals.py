@@ -0,0 +1,99 @@
+''' Conversion of broker report values to Decimal
+    Values come as xlrd/openpyxl floats and ints, XML strings and Tinkoff API MoneyValue/Quotation.
+    Floats are converted through their shortest repr (what the report shows), API values
+    through integer arithmetic, so no floating point rounding gets into amounts.
+    Cash amounts (money, mv2money) are rounded to the decimal places of their currency.
+'''
+from decimal import Decimal, ROUND_HALF_EVEN
+from functools import lru_cache
+
+CACHE_SIZE = 8192
+
+NANO_DIGITS = 9 # MoneyValue/Quotation keep fractional part in nano units
+NANO = 10**NANO_DIGITS
+
+# number of decimal places in amounts of money, other currencies have 2
+CURRENCY_PLACES = {'JPY': 0}
+DEFAULT_PLACES = 2
+
+ZERO = Decimal()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def float2d(value):
+    ''' Convert float to Decimal with the digits the float was written with
+    '''
+    if value.is_integer():
+        return Decimal(int(value))
+    return Decimal(repr(value))
+
+
+def str2d(value):
+    ''' Convert string to Decimal - thousands separators (commas, spaces) are ignored,
+        empty string is zero (same as beancount's D())
+    '''
+    value = value.replace(',', '').replace(' ', '')
+    if not value:
+        return ZERO
+    return Decimal(value)
+
+
+def cell2d(value):
+    ''' Convert value of spreadsheet cell or XML attribute to Decimal
+    '''
+    if type(value) is float:
+        return float2d(value)
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, int):
+        return Decimal(value)
+    if value is None:
+        return ZERO
+    return str2d(value)
+
+
+def nano2d(units, nano):
+    ''' Convert integer units and nano units to Decimal without trailing zeros
+    '''
+    number = units * NANO + nano
+    exp = -NANO_DIGITS
+    while exp < 0 and number % 10 == 0:
+        number //= 10
+        exp += 1
+    return Decimal(number).scaleb(exp)
+
+
+def mv2d(mv):
+    ''' Convert Tinkoff MoneyValue or Quotation to Decimal
+    '''
+    return nano2d(mv.units, mv.nano)
+
+
+def mv2str(mv):
+    ''' Convert Tinkoff MoneyValue or Quotation to string
+    '''
+    return str(nano2d(mv.units, mv.nano))
+
+
+@lru_cache(maxsize=None)
+def _quantum(places):
+    return Decimal(1).scaleb(-places)
+
+
+def quantize(number, currency):
+    ''' Round amount of money to the number of decimal places used for the currency
+    '''
+    return number.quantize(_quantum(CURRENCY_PLACES.get(currency, DEFAULT_PLACES)), ROUND_HALF_EVEN)
+
+
+def money(value, currency):
+    ''' Convert cash amount (spreadsheet cell, XML attribute or JSON string) to Decimal
+        rounded for the currency
+    '''
+    return quantize(cell2d(value), currency)
+
+
+def mv2money(mv):
+    ''' Convert Tinkoff MoneyValue of cash amount to Decimal rounded for its currency
+    '''
+    return quantize(mv2d(mv), mv.currency.upper())
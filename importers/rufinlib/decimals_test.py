@@ -0,0 +1,56 @@
+import types
+import unittest
+from decimal import Decimal
+
+from . import decimals
+
+
+def money(units, nano, currency='rub'):
+    return types.SimpleNamespace(units=units, nano=nano, currency=currency)
+
+
+class TestDecimals(unittest.TestCase):
+
+    def test_float2d(self):
+        self.assertEqual(str(decimals.float2d(0.1 + 0.2)), '0.30000000000000004') # digits of the float
+        self.assertEqual(str(decimals.float2d(1234.5)), '1234.5')
+        self.assertEqual(str(decimals.float2d(100.0)), '100')
+        self.assertEqual(str(decimals.float2d(1e-05)), '0.00001')
+        self.assertEqual(str(decimals.float2d(-0.07)), '-0.07')
+
+    def test_cell2d(self):
+        self.assertEqual(str(decimals.cell2d(0.1)), '0.1')
+        self.assertEqual(decimals.cell2d(7), Decimal(7))
+        self.assertEqual(decimals.cell2d('1 234.5'), Decimal('1234.5'))
+        self.assertEqual(decimals.cell2d('1,234.50'), Decimal('1234.50'))
+        self.assertEqual(decimals.cell2d(''), Decimal(0))
+        self.assertEqual(decimals.cell2d(None), Decimal(0))
+
+    def test_nano2d(self):
+        self.assertEqual(str(decimals.nano2d(114, 250000000)), '114.25')
+        self.assertEqual(str(decimals.nano2d(10, 0)), '10')
+        self.assertEqual(str(decimals.nano2d(0, 1)), '1E-9')
+        # negative amounts have both parts negative
+        self.assertEqual(str(decimals.nano2d(-1, -500000000)), '-1.5')
+        self.assertEqual(str(decimals.nano2d(0, -10000000)), '-0.01')
+
+    def test_mv2d(self):
+        self.assertEqual(decimals.mv2d(money(-12, -340000000)), Decimal('-12.34'))
+        self.assertEqual(decimals.mv2str(money(0, 100000000)), '0.1')
+        self.assertEqual(decimals.mv2d(money(0, 100000000)) + decimals.mv2d(money(0, 200000000)), Decimal('0.3'))
+
+    def test_quantize(self):
+        self.assertEqual(str(decimals.quantize(Decimal('1.005'), 'RUB')), '1.00') # half to even
+        self.assertEqual(str(decimals.quantize(Decimal('1.015'), 'USD')), '1.02')
+        self.assertEqual(str(decimals.quantize(Decimal('1234.5'), 'JPY')), '1234')
+        self.assertEqual(str(decimals.quantize(Decimal('1235.5'), 'JPY')), '1236')
+
+    def test_money(self):
+        self.assertEqual(str(decimals.money(0.1 + 0.2, 'RUB')), '0.30')
+        self.assertEqual(str(decimals.money('1 234.5', 'JPY')), '1234')
+        self.assertEqual(str(decimals.mv2money(money(-12, -345000000, 'usd'))), '-12.34')
+        self.assertEqual(str(decimals.mv2money(money(100, 0, 'jpy'))), '100')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+''' Duplicate detection by broker deal ids
+    Importers put broker's ids of deals and operations into tags and links of transactions.
+    Ids of transactions already in the ledger are collected into a hash index, so extracted
+    transaction with known id is dropped at once. Entries without ids are left for beancount's
+    similarity matching. Summaries of compacted operations keep their ids in 'ids' metadata.
+'''
+from beancount.core import data
+
+IDS = 'ids' # metadata with space separated ids of compacted operations
+
+# indices of the ledger by accounts - ledger is the same for all files of one run
+_indices = {}
+
+
+def entry_ids(entry):
+    ''' Broker ids of transaction - string tags and links (and ids of compacted operations).
+        Several ids may be written as one tag joined by ' #'. Dates used as links are not ids.
+    '''
+    ids = set()
+    for tag in (entry.tags or data.EMPTY_SET) | (entry.links or data.EMPTY_SET):
+        if isinstance(tag, str):
+            ids.update(tag.split(' #'))
+    if entry.meta and IDS in entry.meta:
+        ids.update(entry.meta[IDS].split())
+    return ids
+
+
+def in_accounts(entry, accounts):
+    ''' Check if transaction has postings to the accounts or their subaccounts
+    '''
+    for posting in entry.postings:
+        for acc in accounts:
+            if posting.account == acc or posting.account.startswith(acc + ':'):
+                return True
+    return False
+
+
+class DealIndex:
+    ''' Ids of ledger's transactions which have postings to the accounts
+    '''
+
+    def __init__(self, entries, accounts):
+        self.entries = entries # keep ledger alive - index is reused while it's the same list
+        self.accounts = accounts
+        self.ids = set()
+        for entry in entries:
+            if isinstance(entry, data.Transaction) and (entry.tags or entry.links or IDS in entry.meta):
+                if in_accounts(entry, accounts):
+                    self.ids |= entry_ids(entry)
+
+    def __contains__(self, deal_id):
+        return deal_id in self.ids
+
+    def known(self, entry):
+        ''' Check if transaction has any id which is already in the ledger
+        '''
+        return not self.ids.isdisjoint(entry_ids(entry))
+
+
+def get_index(existing_entries, accounts):
+    ''' Index of ledger's ids for the accounts - built once per ledger and accounts
+    '''
+    accounts = tuple(accounts)
+    index = _indices.get(accounts)
+    if index is None or index.entries is not existing_entries:
+        index = _indices[accounts] = DealIndex(existing_entries, accounts)
+    return index
+
+
+def filter_known(entries, existing_entries, *accounts):
+    ''' Drop extracted transactions with ids already in the ledger (existing_entries)
+        accounts: roots of importer's accounts - only ledger transactions touching them are indexed
+    '''
+    if not existing_entries:
+        return entries
+    index = get_index(existing_entries, accounts)
+    if not index.ids:
+        return entries
+    return [entry for entry in entries
+            if not (isinstance(entry, data.Transaction) and index.known(entry))]
+
+
+def iter_filter_known(entries, existing_entries, *accounts):
+    ''' Same as filter_known for stream of entries - they are yielded as soon as they come
+    '''
+    index = get_index(existing_entries, accounts) if existing_entries else None
+    for entry in entries:
+        if index and index.ids and isinstance(entry, data.Transaction) and index.known(entry):
+            continue
+        yield entry
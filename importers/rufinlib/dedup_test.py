@@ -0,0 +1,46 @@
+import unittest
+import datetime
+
+from beancount.core import data
+from beancount.core import amount
+from beancount.core.amount import D
+
+from . import dedup
+
+
+def txn(account, tags=data.EMPTY_SET, links=data.EMPTY_SET):
+    amt = amount.Amount(D('10'), 'RUB')
+    return data.Transaction(data.new_metadata('test', 1), datetime.date(2021, 1, 1), '*', None, 'test',
+                            tags, links, [
+                                data.Posting(account, amt, None, None, None, None),
+                                data.Posting('Expenses:Fees', -amt, None, None, None, None),
+                            ])
+
+
+class TestDedup(unittest.TestCase):
+
+    def test_filter_known(self):
+        ledger = [txn('Assets:Broker:Cash', tags={'100', '101'}),
+                  txn('Assets:Other', links={'200'})]
+        new = [txn('Assets:Broker:Cash', links={'100'}),
+               txn('Assets:Broker:Cash', tags={'101 #102'}),
+               txn('Assets:Broker:Cash', tags={'200'}),
+               txn('Assets:Broker:Cash', links={datetime.date(2021, 1, 1)}),
+               txn('Assets:Broker:Cash')]
+        result = dedup.filter_known(new, ledger, 'Assets:Broker')
+        self.assertEqual(result, new[2:])
+
+    def test_iter_filter_known(self):
+        ledger = [txn('Assets:Broker:Cash', tags={'100'})]
+        new = [txn('Assets:Broker:Cash', links={'100'}), txn('Assets:Broker:Cash', tags={'101'})]
+        result = dedup.iter_filter_known(iter(new), ledger, 'Assets:Broker')
+        self.assertEqual(next(result), new[1])
+        self.assertEqual(list(dedup.iter_filter_known(new, None, 'Assets:Broker')), new)
+
+    def test_no_ledger(self):
+        new = [txn('Assets:Broker', tags={'100'})]
+        self.assertEqual(dedup.filter_known(new, None, 'Assets:Broker'), new)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+''' Shared parts for building directives
+    Reports repeat the same accounts, tickers and currencies in every row, but each cell
+    (XML attribute, JSON value) gives a new string object. Names are interned here, so all
+    directives share one object per name, and per-ticker accounts are joined only once.
+    Immutable parts (empty cost spec, empty tag sets) are shared by all importers.
+'''
+import sys
+
+from beancount.core import data
+from beancount.core import account
+from beancount.core import position
+from beancount.core.amount import Amount
+
+NOCOST = position.CostSpec(None, None, None, None, None, None)
+EMPTY_SET = data.EMPTY_SET
+
+
+def name(text):
+    ''' Interned account, ticker or currency name
+    '''
+    return sys.intern(text)
+
+
+def amount(number, currency):
+    ''' Amount with interned currency
+    '''
+    return Amount(number, name(currency))
+
+
+def posting(acc, units, cost=None, price=None):
+    ''' Posting without flag and metadata
+    '''
+    return data.Posting(acc, units, cost, price, None, None)
+
+
+def new_metadata(filename, lineno):
+    ''' Metadata of directive (same as data.new_metadata) with interned file name
+    '''
+    return {'filename': name(filename), 'lineno': lineno}
+
+
+class Accounts:
+    ''' Accounts of instruments and gains of importer - joined once per ticker
+    '''
+
+    def __init__(self, account_root, account_gains):
+        self.root = name(account_root)
+        self.gains_pattern = account_gains
+        self.instruments = {}
+        self.gains_accounts = {}
+
+    def instrument(self, ticker):
+        ''' Account of the instrument: <account_root>:<ticker>
+        '''
+        try:
+            return self.instruments[ticker]
+        except KeyError:
+            acc = self.instruments[ticker] = name(account.join(self.root, ticker))
+            return acc
+
+    def gains(self, ticker):
+        ''' Account of gains for the instrument: account_gains with ticker put in {}
+        '''
+        try:
+            return self.gains_accounts[ticker]
+        except KeyError:
+            acc = self.gains_accounts[ticker] = name(self.gains_pattern.format(ticker))
+            return acc
@@ -0,0 +1,24 @@
+import unittest
+from decimal import Decimal
+
+from . import directives
+
+
+class TestDirectives(unittest.TestCase):
+
+    def test_accounts(self):
+        accounts = directives.Accounts('Assets:Broker', 'Income:{}:Gains')
+        ticker = ''.join(['SB', 'ER']) # not a constant - new object
+        self.assertEqual(accounts.instrument(ticker), 'Assets:Broker:SBER')
+        self.assertIs(accounts.instrument(ticker), accounts.instrument('SBER'))
+        self.assertEqual(accounts.gains(ticker), 'Income:SBER:Gains')
+        self.assertIs(accounts.gains(ticker), accounts.gains('SBER'))
+
+    def test_amount_currency_interned(self):
+        a1 = directives.amount(Decimal(1), ''.join(['US', 'D']))
+        a2 = directives.amount(Decimal(2), ''.join(['U', 'SD']))
+        self.assertIs(a1.currency, a2.currency)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+''' Aggregation of trade fills
+    Order may be executed in many fills (trades) and each fill becomes a posting - a separate
+    lot for beancount booking. Fills may be merged:
+        'price' - fills at the same price are merged into one posting
+        'vwap' - all fills in a currency are collapsed into one lot at volume-weighted price,
+                 quantities and prices of fills are kept in 'fills' metadata of the posting
+'''
+import collections
+
+MODES = (None, 'price', 'vwap')
+
+Fill = collections.namedtuple('Fill', 'quantity price currency total meta')
+
+
+def fill(quantity, price, currency, meta=None):
+    return Fill(quantity, price, currency, quantity * price, meta)
+
+
+def breakdown(fills):
+    ''' Metadata with quantities and prices of fills: "10 @ 100.5, 5 @ 100.6"
+    '''
+    return {'fills': ', '.join('{} @ {}'.format(f.quantity, f.price) for f in fills)}
+
+
+def merge(fills, mode):
+    ''' Merge fills given as (quantity, price, currency) by mode - see above
+        Out: list of Fill in order of first fills. Total is exact sum of quantity * price of fills.
+    '''
+    if mode not in MODES:
+        raise ValueError('Unknown mode of merging fills: {}'.format(mode))
+    fills = [fill(quantity, price, currency) for quantity, price, currency in fills]
+    if mode is None or len(fills) < 2:
+        return fills
+    groups = {}
+    for f in fills:
+        key = (f.price, f.currency) if mode == 'price' else f.currency
+        groups.setdefault(key, []).append(f)
+    result = []
+    for group in groups.values():
+        if len(group) == 1:
+            result.append(group[0])
+            continue
+        quantity = sum(f.quantity for f in group)
+        total = sum(f.total for f in group)
+        if mode == 'price':
+            result.append(Fill(quantity, group[0].price, group[0].currency, total, None))
+        else:
+            result.append(Fill(quantity, total / quantity, group[0].currency, total, breakdown(group)))
+    return result
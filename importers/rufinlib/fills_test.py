@@ -0,0 +1,34 @@
+import unittest
+from decimal import Decimal
+
+from . import fills
+
+
+class TestFills(unittest.TestCase):
+
+    def setUp(self):
+        self.fills = [(Decimal('10'), Decimal('100.5'), 'RUB'), (Decimal('5'), Decimal('100.6'), 'RUB'),
+                      (Decimal('3'), Decimal('100.5'), 'RUB')]
+
+    def test_no_merge(self):
+        self.assertEqual(len(fills.merge(self.fills, None)), 3)
+
+    def test_price(self):
+        result = fills.merge(self.fills, 'price')
+        self.assertEqual([(f.quantity, f.price) for f in result],
+                         [(Decimal('13'), Decimal('100.5')), (Decimal('5'), Decimal('100.6'))])
+        self.assertIsNone(result[0].meta)
+
+    def test_vwap(self):
+        fill, = fills.merge(self.fills, 'vwap')
+        self.assertEqual(fill.quantity, Decimal('18'))
+        self.assertEqual(fill.total, Decimal('1809.5'))
+        self.assertEqual(fill.meta, {'fills': '10 @ 100.5, 5 @ 100.6, 3 @ 100.5'})
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            fills.merge(self.fills, 'fifo')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+''' Selective reading of big JSON files
+    Downloads keep many accounts (or the whole universe of instruments) in one JSON object,
+    while importer needs one account or a few instruments. File is mapped to memory and
+    values of other keys are skipped by scanning for brackets and strings - only values
+    of requested keys are parsed.
+'''
+import re
+import json
+import mmap
+
+WS = re.compile(rb'[ \t\n\r]*')
+STRING = re.compile(rb'"(?:[^"\\]|\\.)*"', re.S)
+TOKEN = re.compile(rb'"(?:[^"\\]|\\.)*"|[\[\]{}]', re.S) # strings and brackets
+SCALAR = re.compile(rb'[^,\]}\s]*') # number, true, false, null
+
+
+def skip_ws(buf, pos):
+    return WS.match(buf, pos).end()
+
+
+def value_end(buf, pos):
+    ''' End of JSON value starting at pos
+    '''
+    c = buf[pos:pos+1]
+    if c == b'"':
+        return STRING.match(buf, pos).end()
+    if c not in (b'{', b'['):
+        return SCALAR.match(buf, pos).end()
+    depth = 0
+    for m in TOKEN.finditer(buf, pos):
+        token = m.group()
+        if token in (b'{', b'['):
+            depth += 1
+        elif token in (b'}', b']'):
+            depth -= 1
+            if depth == 0:
+                return m.end()
+    raise ValueError('Unterminated JSON value at {}'.format(pos))
+
+
+def items(buf, pos=0):
+    ''' Keys of JSON object starting at pos with positions of their values: (key, start, end)
+    '''
+    pos = skip_ws(buf, pos)
+    if buf[pos:pos+1] != b'{':
+        raise ValueError('JSON object expected at {}'.format(pos))
+    pos = skip_ws(buf, pos + 1)
+    if buf[pos:pos+1] == b'}':
+        return
+    while True:
+        m = STRING.match(buf, pos)
+        if m is None:
+            raise ValueError('JSON key expected at {}'.format(pos))
+        key = json.loads(m.group())
+        pos = skip_ws(buf, m.end())
+        if buf[pos:pos+1] != b':':
+            raise ValueError('":" expected at {}'.format(pos))
+        start = skip_ws(buf, pos + 1)
+        end = value_end(buf, start)
+        yield key, start, end
+        pos = skip_ws(buf, end)
+        c = buf[pos:pos+1]
+        if c == b'}':
+            return
+        if c != b',':
+            raise ValueError('"," or "}" expected at {}'.format(pos))
+        pos = skip_ws(buf, pos + 1)
+
+
+def scan(filename, handler):
+    ''' Call handler with memory mapped content of the file (empty bytes for empty file)
+    '''
+    with open(filename, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return handler(b'') # empty file can't be mapped
+        with buf:
+            return handler(buf)
+
+
+def load(filename, keys=None, path=()):
+    ''' Values of keys (all if keys is None) of object in JSON file
+        path: keys of nested objects to get to the object - empty dict if there is no such object
+    '''
+    if keys is not None and not keys:
+        return {}
+
+    def handler(buf):
+        pos = 0
+        for name in path:
+            for key, start, _ in items(buf, pos):
+                if key == name:
+                    pos = start
+                    break
+            else:
+                return {}
+        result = {}
+        for key, start, end in items(buf, pos):
+            if keys is None or key in keys:
+                result[key] = json.loads(buf[start:end])
+                if keys is not None and len(result) == len(keys):
+                    break # all values are found - rest of the file isn't scanned
+        return result
+    return scan(filename, handler)
+
+
+def load_key(filename, key, default=None):
+    ''' Value of one key of top-level object in JSON file
+    '''
+    return load(filename, {key}).get(key, default)
+
+
+def keys(filename):
+    ''' Keys of top-level object in JSON file - values aren't parsed
+    '''
+    return scan(filename, lambda buf: [key for key, _, _ in items(buf)])
@@ -0,0 +1,48 @@
+import os
+import json
+import tempfile
+import unittest
+
+from . import jsonstream
+
+
+class TestJsonStream(unittest.TestCase):
+
+    def setUp(self):
+        data = {
+            '1': {'operations': [{'figi': 'A', 'payment': '-10.5'}], 'note': 'brackets } ] in "string" \\'},
+            '2': [1, 2.5e3, True, None, {'x': []}],
+            'instruments': {'A': {'ticker': 'AAA'}, 'B': {'ticker': 'BBB'}, 'C': {}},
+            'count': -3
+        }
+        fd, self.filename = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+        self.data = data
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def test_keys(self):
+        self.assertEqual(jsonstream.keys(self.filename), ['1', '2', 'instruments', 'count'])
+
+    def test_load(self):
+        self.assertEqual(jsonstream.load(self.filename), self.data)
+        self.assertEqual(jsonstream.load_key(self.filename, '1'), self.data['1'])
+        self.assertEqual(jsonstream.load_key(self.filename, 'count'), -3)
+        self.assertIsNone(jsonstream.load_key(self.filename, '3'))
+
+    def test_path(self):
+        self.assertEqual(jsonstream.load(self.filename, {'A', 'C', 'D'}, path=('instruments',)),
+                         {'A': {'ticker': 'AAA'}, 'C': {}})
+        self.assertEqual(jsonstream.load(self.filename, {'A'}, path=('missing',)), {})
+
+    def test_empty_file(self):
+        with open(self.filename, 'w'):
+            pass
+        with self.assertRaises(ValueError):
+            jsonstream.keys(self.filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
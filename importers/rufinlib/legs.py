@@ -0,0 +1,74 @@
+''' Matching of paired legs of broker operations (currency conversions, transfers between markets)
+    Brokers report both legs of such operation as separate lines, legs are matched by
+    (time, instrument, amount) key with optional tolerance for time and amount.
+'''
+import math
+
+
+class LegMatcher:
+    ''' Hash index of unmatched legs.
+        Every leg is registered under (time, instrument, amount) key. If tolerance is set
+        for time or amount then value is put into bucket of tolerance size and neighbour
+        buckets are checked as well - so the lookup is O(1) regardless of number of pending legs.
+    '''
+
+    def __init__(self, time_tolerance=None, amount_tolerance=None, accept=None):
+        ''' time_tolerance: timedelta (or int for ordinals) - max difference of leg times
+            amount_tolerance: max difference of leg amounts
+            accept: optional function(pending_leg, new_leg) -> bool to reject matches
+        '''
+        self.time_tolerance = time_tolerance
+        self.amount_tolerance = amount_tolerance
+        self.accept = accept
+        self.legs = {}
+
+    def _bucket(self, value, tolerance):
+        if value is None or not tolerance:
+            return value
+        if hasattr(value, 'toordinal'):
+            # dates and datetimes - count tolerance intervals from minimal value
+            return (value - type(value).min) // tolerance
+        return math.floor(value / tolerance)
+
+    def _keys(self, time, instrument, amt):
+        tb = self._bucket(time, self.time_tolerance)
+        ab = self._bucket(amt, self.amount_tolerance)
+        tt = (tb,) if tb is None or not self.time_tolerance else (tb, tb - 1, tb + 1)
+        aa = (ab,) if ab is None or not self.amount_tolerance else (ab, ab - 1, ab + 1)
+        return [(t, instrument, a) for t in tt for a in aa]
+
+    def _close(self, a, b, tolerance):
+        if a is None or b is None or not tolerance:
+            return a == b
+        return abs(a - b) <= tolerance
+
+    def match(self, time, instrument, amt, leg):
+        ''' Find pending leg for (time, instrument, amount) key.
+            Return matched leg (and forget it) or register new leg and return None,
+            so leg itself should not be None
+        '''
+        keys = self._keys(time, instrument, amt)
+        for key in keys:
+            pending = self.legs.get(key)
+            if not pending:
+                continue
+            for i, (p_time, p_amt, p_leg) in enumerate(pending):
+                if not (self._close(p_time, time, self.time_tolerance) and
+                        self._close(p_amt, amt, self.amount_tolerance)):
+                    continue
+                if self.accept and not self.accept(p_leg, leg):
+                    continue
+                del pending[i]
+                if not pending:
+                    del self.legs[key]
+                return p_leg
+        self.legs.setdefault(keys[0], []).append((time, amt, leg))
+        return None
+
+    def pending(self):
+        ''' List of legs without pair
+        '''
+        return [leg for legs in self.legs.values() for _, _, leg in legs]
+
+    def __len__(self):
+        return sum(len(legs) for legs in self.legs.values())
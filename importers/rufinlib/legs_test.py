@@ -0,0 +1,33 @@
+import unittest
+import datetime
+from decimal import Decimal
+
+from . import legs
+
+
+class TestLegMatcher(unittest.TestCase):
+
+    def test_exact_pair(self):
+        m = legs.LegMatcher()
+        self.assertIsNone(m.match(None, ('a', 'b'), 5.0, 1))
+        self.assertEqual(m.match(None, ('a', 'b'), 5.0, 2), 1)
+        self.assertEqual(len(m), 0)
+
+    def test_accept(self):
+        m = legs.LegMatcher(accept=lambda pending, leg: pending != leg)
+        self.assertIsNone(m.match(1, 'USD', None, 'RUB'))
+        self.assertIsNone(m.match(1, 'USD', None, 'RUB'))
+        self.assertEqual(m.match(1, 'USD', None, 'USD'), 'RUB')
+        self.assertEqual(m.pending(), ['RUB'])
+
+    def test_tolerance(self):
+        m = legs.LegMatcher(time_tolerance=datetime.timedelta(seconds=2),
+                            amount_tolerance=Decimal('0.01'))
+        t = datetime.datetime(2021, 1, 1, 12, 0, 0)
+        self.assertIsNone(m.match(t, 'USD', Decimal('100.00'), 'a'))
+        self.assertIsNone(m.match(t, 'USD', Decimal('100.02'), 'b'))
+        self.assertEqual(m.match(t + datetime.timedelta(seconds=1), 'USD', Decimal('99.99'), 'c'), 'a')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+''' Adaptive rate limiter for broker APIs
+    Calls are let through by token bucket: rate calls per second with bursts up to burst calls.
+    The rate adapts to the API limits: each successful call increases it a little (up to
+    max_rate), rate-limit error halves it and stops all calls until the limit is reset.
+    Failed calls (rate limit or unavailable server) are retried with exponential backoff.
+
+    Errors are recognized by their gRPC status code (code attribute of error - as in
+    tinkoff.invest RequestError) and the limit reset by metadata.ratelimit_reset (seconds).
+    Limiter may be shared by threads (call_sync) or coroutines (call).
+'''
+import time
+import random
+import asyncio
+import threading
+
+RATE = 5.0 # calls per second
+BURST = 10
+MIN_RATE = 0.5
+MAX_RATE = 20.0
+STEP = 0.1 # increase of rate after successful call
+RETRIES = 5
+BACKOFF = 0.5 # seconds, doubled for each retry
+MAX_BACKOFF = 30.0
+LIMIT_CODES = {'RESOURCE_EXHAUSTED'}
+RETRY_CODES = LIMIT_CODES | {'UNAVAILABLE'}
+
+
+def error_code(error):
+    ''' Name of gRPC status code of error (None if it isn't an API error)
+    '''
+    code = getattr(error, 'code', None)
+    return getattr(code, 'name', code)
+
+
+class RateLimiter:
+    ''' Token bucket with adaptive rate and retries of failed calls
+    '''
+
+    def __init__(self, rate=RATE, burst=BURST, min_rate=MIN_RATE, max_rate=MAX_RATE, retries=RETRIES,
+                 clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.retries = retries
+        self.clock = clock
+        self.tokens = burst
+        self.last = clock()
+        self.blocked_until = 0 # no calls until the API limit is reset
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        ''' Take a token - out: seconds to wait before the call
+        '''
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            return max(wait, self.blocked_until - now)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + STEP)
+
+    def limited(self, reset=None):
+        ''' API rate limit is exceeded: halve the rate, wait for reset of the limit
+        '''
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+            if reset:
+                self.blocked_until = max(self.blocked_until, self.clock() + reset)
+
+    def retry_delay(self, error, attempt):
+        ''' Seconds to wait before retry of failed call - None if it shouldn't be retried
+        '''
+        code = error_code(error)
+        if code not in RETRY_CODES or attempt >= self.retries:
+            return None
+        if code in LIMIT_CODES:
+            self.limited(getattr(getattr(error, 'metadata', None), 'ratelimit_reset', None))
+        # jitter - retries of parallel calls are spread
+        return min(MAX_BACKOFF, BACKOFF * 2 ** attempt) * random.uniform(0.5, 1)
+
+    def call_sync(self, method, **kwargs):
+        ''' Call API method when the limiter lets it through, retry if it's failed
+        '''
+        attempt = 0
+        while True:
+            time.sleep(self.reserve())
+            try:
+                result = method(**kwargs)
+            except Exception as error:
+                delay = self.retry_delay(error, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.succeeded()
+            return result
+
+    async def call(self, method, **kwargs):
+        ''' Same as call_sync for async method
+        '''
+        attempt = 0
+        while True:
+            await asyncio.sleep(self.reserve())
+            try:
+                result = await method(**kwargs)
+            except Exception as error:
+                delay = self.retry_delay(error, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.succeeded()
+            return result
+
+
+class NoLimit:
+    ''' Limiter which lets all calls through at once (e.g. replay of recorded calls)
+    '''
+
+    def call_sync(self, method, **kwargs):
+        return method(**kwargs)
+
+    async def call(self, method, **kwargs):
+        return await method(**kwargs)
@@ -0,0 +1,58 @@
+import enum
+import types
+import unittest
+from unittest import mock
+
+from . import ratelimit
+
+
+class StatusCode(enum.Enum):
+    RESOURCE_EXHAUSTED = 8
+    INVALID_ARGUMENT = 3
+
+
+class RequestError(Exception):
+
+    def __init__(self, code, reset=None):
+        super().__init__(code)
+        self.code = code
+        self.metadata = types.SimpleNamespace(ratelimit_reset=reset)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 100.0
+        self.limiter = ratelimit.RateLimiter(rate=10, burst=2, clock=lambda: self.now)
+
+    def test_bucket(self):
+        self.assertEqual([self.limiter.reserve() for _ in range(4)], [0, 0, 0.1, 0.2])
+        self.now += 1 # bucket is refilled up to burst
+        self.assertEqual(self.limiter.reserve(), 0)
+
+    def test_adapt(self):
+        self.limiter.limited(reset=3)
+        self.assertEqual(self.limiter.rate, 5)
+        self.assertEqual(self.limiter.reserve(), 3)
+        self.limiter.succeeded()
+        self.assertAlmostEqual(self.limiter.rate, 5.1)
+
+    @mock.patch.object(ratelimit, 'BACKOFF', 0)
+    def test_retry(self):
+        calls = []
+
+        def method(**kwargs):
+            calls.append(kwargs)
+            if len(calls) < 3:
+                raise RequestError(StatusCode.RESOURCE_EXHAUSTED)
+            return 'ok'
+
+        limiter = ratelimit.RateLimiter(rate=1000, burst=10)
+        self.assertEqual(limiter.call_sync(method, account_id='1'), 'ok')
+        self.assertEqual(len(calls), 3)
+        with self.assertRaises(RequestError):
+            limiter.call_sync(mock.Mock(side_effect=RequestError(StatusCode.INVALID_ARGUMENT)))
+
+
+if __name__ == '__main__':
+    unittest.main()
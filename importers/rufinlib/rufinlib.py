@@ -2,12 +2,15 @@ from decimal import Decimal
 import os
 import csv
 import re
+from functools import lru_cache
 
+@lru_cache(maxsize=None)
 def load_isin(filename=None):
     ''' Load file with ISIN database used to find out tickers of assets.
         It is possible to download up-to-date ISIN database
         from: https://www.moex.com/msn/stock-instruments
         TODO: fix loader to process original file (now I delete blank lines)
+        Database is loaded once per file name and shared by all importers - don't modify it
     '''
     isindb = {}
 
@@ -0,0 +1,107 @@
+''' Columnar intermediate representation of broker operations
+    Parsers append rows of plain values (dates, accounts, Decimals, strings) to tables -
+    one list per column - and directives are built for the whole table at once by build().
+
+    CashTable - cash flows between two accounts: deposits, withdrawals, fees, dividends,
+                taxes, transfers (posting to account and opposite posting to other account)
+    TradeTable - trades of instruments for cash with fee (no cost or price of units)
+'''
+from beancount.core import data
+
+from . import directives
+
+
+class Table:
+    ''' Base of tables: list per column, rows are appended by parsers
+    '''
+    COLUMNS = ()
+
+    def __init__(self):
+        for col in self.COLUMNS:
+            setattr(self, col, [])
+
+    def __len__(self):
+        return len(getattr(self, self.COLUMNS[0]))
+
+    def columns(self):
+        return [getattr(self, col) for col in self.COLUMNS]
+
+    def rows(self):
+        return zip(*self.columns())
+
+
+class CashTable(Table):
+    ''' Cash flows: amount (number, currency) goes to account and the opposite amount to other
+    '''
+    COLUMNS = ('date', 'account', 'other', 'number', 'currency', 'narration', 'tags', 'links',
+               'filename', 'lineno')
+
+    def add(self, filename, lineno, date, account, other, number, currency, narration,
+            tags=directives.EMPTY_SET, links=directives.EMPTY_SET):
+        self.date.append(date)
+        self.account.append(account)
+        self.other.append(other)
+        self.number.append(number)
+        self.currency.append(currency)
+        self.narration.append(narration)
+        self.tags.append(tags)
+        self.links.append(links)
+        self.filename.append(filename)
+        self.lineno.append(lineno)
+
+    def build(self, flag):
+        ''' Transactions with two postings for all rows
+        '''
+        result = []
+        for date, acc, other, number, currency, narration, tags, links, filename, lineno in self.rows():
+            amt = directives.amount(number, currency)
+            result.append(data.Transaction(
+                directives.new_metadata(filename, lineno), date, flag, None, narration, tags, links, [
+                    directives.posting(acc, amt),
+                    directives.posting(other, -amt),
+                ]))
+        return result
+
+
+class TradeTable(Table):
+    ''' Trades: units of instrument (ticker) go to instrument account for payment (number, currency)
+        from cash account, fee goes to fee account. Sales (negative units) book gains to gains account.
+    '''
+    COLUMNS = ('date', 'account', 'instrument', 'units', 'ticker', 'number', 'currency',
+               'fee', 'fee_account', 'gains', 'narration', 'tags', 'links', 'filename', 'lineno')
+
+    def add(self, filename, lineno, date, account, instrument, units, ticker, number, currency,
+            fee, fee_account, gains, narration, tags=directives.EMPTY_SET, links=directives.EMPTY_SET):
+        self.date.append(date)
+        self.account.append(account)
+        self.instrument.append(instrument)
+        self.units.append(units)
+        self.ticker.append(ticker)
+        self.number.append(number)
+        self.currency.append(currency)
+        self.fee.append(fee)
+        self.fee_account.append(fee_account)
+        self.gains.append(gains)
+        self.narration.append(narration)
+        self.tags.append(tags)
+        self.links.append(links)
+        self.filename.append(filename)
+        self.lineno.append(lineno)
+
+    def build(self, flag):
+        ''' Transactions with cash, fee, instrument (and gains for sales) postings for all rows
+        '''
+        result = []
+        for (date, acc, instrument, units, ticker, number, currency, fee, fee_account, gains,
+                narration, tags, links, filename, lineno) in self.rows():
+            postings = [
+                directives.posting(acc, directives.amount(number, currency)),
+                directives.posting(fee_account, directives.amount(fee, currency)),
+                directives.posting(instrument, directives.amount(units, ticker), directives.NOCOST),
+            ]
+            if units < 0:
+                postings.append(directives.posting(gains, None))
+            result.append(data.Transaction(
+                directives.new_metadata(filename, lineno), date, flag, None, narration, tags, links,
+                postings))
+        return result
@@ -0,0 +1,33 @@
+import unittest
+import datetime
+from decimal import Decimal
+
+from . import tables
+
+
+class TestTables(unittest.TestCase):
+
+    def test_cash_build(self):
+        cash = tables.CashTable()
+        d = datetime.date(2021, 1, 1)
+        cash.add('report.xls', 10, d, 'Assets:Cash', 'Expenses:Fees', Decimal('-5'), 'RUB', 'fee', links={d})
+        cash.add('report.xls', 11, d, 'Assets:Cash', 'Equity:External', Decimal('100'), 'USD', 'deposit')
+        self.assertEqual(len(cash), 2)
+        txn = cash.build('*')[0]
+        self.assertEqual(txn.meta['lineno'], 10)
+        self.assertEqual(txn.links, {d})
+        self.assertEqual([(p.account, p.units.number) for p in txn.postings],
+                         [('Assets:Cash', Decimal('-5')), ('Expenses:Fees', Decimal('5'))])
+
+    def test_trade_build(self):
+        trades = tables.TradeTable()
+        d = datetime.date(2021, 1, 1)
+        trades.add('deals.xlsx', 1, d, 'Assets:Cash', 'Assets:Broker:SBER', Decimal('-10'), 'SBER',
+                   Decimal('2500'), 'RUB', Decimal('1.5'), 'Expenses:Fees', 'Income:SBER:Gains', '123')
+        txn = trades.build('*')[0]
+        self.assertEqual([p.account for p in txn.postings],
+                         ['Assets:Cash', 'Expenses:Fees', 'Assets:Broker:SBER', 'Income:SBER:Gains'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+''' Per-account watermarks for incremental extraction
+    Statements are re-downloaded cumulatively, so most of their rows were imported already.
+    Watermark of the account is the last date of imported operations and ids of operations
+    of that date. Rows at or below the watermark are skipped before any directive is built.
+
+    Watermarks of all accounts are kept in one JSON file:
+        {"Assets:Broker": {"date": "2021-03-31", "ids": ["123456", ...]}, ...}
+
+    Extraction doesn't move the watermark: importers save new watermarks to pending file
+    (<file>.pending) and they are applied by explicit commit once the entries are in the ledger:
+        python -m importers.rufinlib.watermark <file>
+    Dry run (bean-extract to stdout), discarded import or re-run leave the watermark as is.
+'''
+import os
+import sys
+import json
+import datetime
+import tempfile
+import threading
+
+from . import dates
+
+_save_lock = threading.Lock()
+
+
+def load(filename):
+    ''' Load watermarks of all accounts from JSON file - empty if there is no file yet
+    '''
+    try:
+        with open(filename, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def pending(filename):
+    ''' File with watermarks saved by extraction and not committed yet
+    '''
+    return filename + '.pending'
+
+
+def write(filename, state):
+    ''' Write watermarks to temporary file and replace - file is never left half written
+    '''
+    folder = os.path.dirname(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def commit(filename):
+    ''' Apply pending watermarks (entries are in the ledger) - accounts without pending
+        watermark are kept. Return list of committed accounts.
+    '''
+    with _save_lock:
+        new = load(pending(filename))
+        if new:
+            write(filename, load(filename) | new)
+        if os.path.exists(pending(filename)):
+            os.unlink(pending(filename))
+    return list(new)
+
+
+class Watermark:
+    ''' Watermark of one account: checks rows against it and tracks the new one.
+        Without file name nothing is skipped and nothing is saved.
+    '''
+
+    def __init__(self, filename, account):
+        self.filename = filename
+        self.account = account
+        state = load(filename).get(account) if filename else None
+        if state:
+            self.date = dates.iso_date(state['date'])
+            self.ids = frozenset(state['ids'])
+        else:
+            self.date = None
+            self.ids = frozenset()
+        # new watermark
+        self.last_date = self.date
+        self.last_ids = set(self.ids)
+        # occurrences of rows without id - same row may be met several times a day
+        self.occurrences = {}
+        # rows dated after today (settlements to come) don't move the watermark
+        self.today = datetime.date.today()
+
+    @property
+    def start(self):
+        ''' Time to start download from - the watermark date (None if there is no watermark)
+        '''
+        if self.date is None:
+            return None
+        return datetime.datetime.combine(self.date, datetime.time())
+
+    def key(self, date, deal_id=None, row=None):
+        ''' Key of the row: deal id if broker gives it, otherwise content of the row
+            with number of its occurrence at this date
+        '''
+        if deal_id:
+            return str(deal_id)
+        content = '|'.join('' if x is None else str(x) for x in row)
+        n = self.occurrences[date, content] = self.occurrences.get((date, content), 0) + 1
+        return content if n == 1 else '{}#{}'.format(content, n)
+
+    def skip(self, date, deal_id=None, row=None):
+        ''' Check if the row was imported already (at or below the watermark) - if not,
+            take it into account for the new watermark
+            date: date (or datetime) of the row, deal_id: id of the deal, row: row content if no id
+        '''
+        if isinstance(date, datetime.datetime):
+            date = date.date()
+        if self.filename is None:
+            return False
+        key = self.key(date, deal_id, row)
+        if self.date is not None and (date < self.date or date == self.date and key in self.ids):
+            return True
+        if date > self.today:
+            return False # watermark there would hide rows of the next statements settled before
+        if self.last_date is None or date > self.last_date:
+            self.last_date = date
+            self.last_ids = {key}
+        elif date == self.last_date:
+            self.last_ids.add(key)
+        return False
+
+    def save(self):
+        ''' Store the new watermark as pending - it takes effect after commit(filename).
+            Other accounts' watermarks in the file are kept, as well as later pending
+            watermark of the account (several statements of the account in one import).
+        '''
+        if self.filename is None or self.last_date is None:
+            return
+        # accounts may be saved from parallel threads - read and write of the file go together
+        with _save_lock:
+            state = load(pending(self.filename))
+            date, ids = self.last_date.isoformat(), set(self.last_ids)
+            old = state.get(self.account)
+            if old and old['date'] > date:
+                return
+            if old and old['date'] == date:
+                ids.update(old['ids'])
+            state[self.account] = {'date': date, 'ids': sorted(ids)}
+            write(pending(self.filename), state)
+
+
+def main():
+    if len(sys.argv) != 2:
+        print('Usage: python -m importers.rufinlib.watermark <watermarks file>')
+        sys.exit(2)
+    for account in commit(sys.argv[1]):
+        print('Committed watermark of', account)
+
+
+if __name__ == '__main__':
+    main()
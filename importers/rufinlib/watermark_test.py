@@ -0,0 +1,84 @@
+import os
+import unittest
+import datetime
+import tempfile
+
+from . import watermark
+
+
+class TestWatermark(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        os.unlink(self.filename)
+
+    def tearDown(self):
+        for name in (self.filename, watermark.pending(self.filename)):
+            if os.path.exists(name):
+                os.unlink(name)
+
+    def test_no_file(self):
+        wm = watermark.Watermark(None, 'Assets:Broker')
+        self.assertFalse(wm.skip(datetime.date(2021, 1, 1), '1'))
+        self.assertFalse(wm.skip(datetime.date(2021, 1, 1), '1'))
+        wm.save()
+        self.assertIsNone(wm.start)
+
+    def test_skip_imported(self):
+        d1, d2, d3 = datetime.date(2021, 1, 1), datetime.date(2021, 1, 2), datetime.date(2021, 1, 3)
+        wm = watermark.Watermark(self.filename, 'Assets:Broker')
+        self.assertFalse(wm.skip(d1, '1'))
+        self.assertFalse(wm.skip(d2, '2'))
+        self.assertFalse(wm.skip(d2, row=('fee', 10)))
+        wm.save()
+        # not committed - extraction again gives the same rows
+        self.assertFalse(watermark.Watermark(self.filename, 'Assets:Broker').skip(d1, '1'))
+        self.assertEqual(watermark.commit(self.filename), ['Assets:Broker'])
+        self.assertFalse(os.path.exists(watermark.pending(self.filename)))
+
+        wm = watermark.Watermark(self.filename, 'Assets:Broker')
+        self.assertEqual(wm.start, datetime.datetime(2021, 1, 2))
+        self.assertTrue(wm.skip(d1, '1'))
+        self.assertTrue(wm.skip(d2, '2'))
+        self.assertTrue(wm.skip(d2, row=('fee', 10)))
+        # same row once more at the same date is a new operation
+        self.assertFalse(wm.skip(d2, row=('fee', 10)))
+        self.assertFalse(wm.skip(d2, '4'))
+        self.assertFalse(wm.skip(d3, '5'))
+        wm.save()
+        watermark.commit(self.filename)
+
+        self.assertEqual(watermark.load(self.filename)['Assets:Broker'], {'date': '2021-01-03', 'ids': ['5']})
+        # other accounts are not affected
+        self.assertFalse(watermark.Watermark(self.filename, 'Assets:Other').skip(d1, '1'))
+
+    def test_pending(self):
+        d1, d2 = datetime.date(2021, 1, 1), datetime.date(2021, 1, 2)
+        self.assertEqual(watermark.commit(self.filename), []) # nothing to commit
+        newer = watermark.Watermark(self.filename, 'Assets:Broker')
+        newer.skip(d2, '2')
+        older = watermark.Watermark(self.filename, 'Assets:Broker')
+        older.skip(d1, '1')
+        same = watermark.Watermark(self.filename, 'Assets:Broker')
+        same.skip(d2, '3')
+        newer.save()
+        older.save() # statements extracted out of order don't move watermark back
+        same.save()
+        watermark.commit(self.filename)
+        self.assertEqual(watermark.load(self.filename), {'Assets:Broker': {'date': '2021-01-02', 'ids': ['2', '3']}})
+
+    def test_future(self):
+        d1, d2, d3 = datetime.date(2021, 1, 1), datetime.date(2021, 1, 2), datetime.date(2021, 1, 20)
+        wm = watermark.Watermark(self.filename, 'Assets:Broker')
+        wm.today = d2
+        self.assertFalse(wm.skip(d1, '1'))
+        # settlement to come is extracted but doesn't move the watermark
+        self.assertFalse(wm.skip(d3, '2'))
+        wm.save()
+        watermark.commit(self.filename)
+        self.assertEqual(watermark.load(self.filename)['Assets:Broker'], {'date': '2021-01-01', 'ids': ['1']})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+''' On-demand loading of XLS workbooks
+    xlrd parses all sheets on open by default. Here workbooks are opened with on_demand=True,
+    so only sheets asked for are parsed, and each sheet is unloaded as soon as it's processed -
+    peak memory is about the size of the largest sheet used.
+'''
+import os
+from contextlib import contextmanager
+
+import xlrd
+from xlrd.biffh import XLRDError
+
+
+@contextmanager
+def open_workbook(filename, **kwargs):
+    ''' Open workbook without loading sheets, release file when done
+    '''
+    with open(os.devnull, 'w') as logfile:
+        workbook = xlrd.open_workbook(filename, on_demand=True, logfile=logfile, **kwargs)
+        try:
+            yield workbook
+        finally:
+            workbook.release_resources()
+
+
+@contextmanager
+def load_sheet(workbook, name):
+    ''' Load sheet by name or index and unload it on exit
+        yields None if there is no such sheet in workbook
+    '''
+    try:
+        if isinstance(name, int):
+            sheet = workbook.sheet_by_index(name)
+        else:
+            sheet = workbook.sheet_by_name(name)
+    except (XLRDError, IndexError):
+        yield None
+        return
+    try:
+        yield sheet
+    finally:
+        workbook.unload_sheet(name)
@@ -0,0 +1,255 @@
+''' Streaming reader of XLSX files
+    Worksheet XML is parsed by expat straight from the zip archive and rows are yielded
+    as they are parsed - memory doesn't depend on the size of the sheet.
+    Shared strings are resolved and date formatted cells are returned as datetime (like openpyxl).
+'''
+import re
+import datetime
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+from operator import itemgetter
+from xml.parsers import expat
+
+from . import dates
+
+CHUNK_SIZE = 64 * 1024
+
+NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+NS_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+NS_PKG_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+# built-in number formats with dates and times
+DATE_FORMAT_IDS = set(range(14, 23)) | set(range(27, 37)) | set(range(45, 48)) | set(range(50, 59))
+# parts of format code which are not date tokens: quoted text, escapes, [colors] and [conditions]
+FORMAT_LITERALS_RE = re.compile(r'"[^"]*"|\\.|\[[^\]]*\]')
+DATE_TOKENS_RE = re.compile(r'[dmyhs]', re.IGNORECASE)
+
+
+def col_index(ref):
+    ''' Convert cell reference ('AB12') to zero based column index
+    '''
+    idx = 0
+    for ch in ref:
+        if ch.isdigit():
+            break
+        idx = idx * 26 + ord(ch) - 64
+    return idx - 1
+
+
+def is_date_format(code):
+    ''' Check if number format code formats dates or times
+    '''
+    if code.lower() == 'general':
+        return False
+    return DATE_TOKENS_RE.search(FORMAT_LITERALS_RE.sub('', code)) is not None
+
+
+def fields(header, columns):
+    ''' Accessor of the columns (by names in header row) - returns their values from row in order of columns
+    '''
+    index = {col: i for i, col in enumerate(header)}
+    missing = [col for col in columns if col not in index]
+    if missing:
+        raise ValueError('Columns are not found in header: {}'.format(', '.join(missing)))
+    return itemgetter(*[index[col] for col in columns])
+
+
+class XlsxReader:
+    ''' Reader of XLSX workbook: list of sheets and streaming of rows of each sheet
+    '''
+
+    def __init__(self, filename):
+        self.zip = zipfile.ZipFile(filename)
+        try:
+            self.sheets, self.active, self.datemode = self._load_workbook()
+            self.strings = self._load_shared_strings()
+            self.date_styles = self._load_styles()
+        except Exception:
+            self.zip.close()
+            raise
+
+    def close(self):
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def sheet_names(self):
+        return list(self.sheets)
+
+    def _load_workbook(self):
+        ''' Find worksheets' names and their parts in archive
+        '''
+        rels = ET.fromstring(self.zip.read('xl/_rels/workbook.xml.rels'))
+        targets = {}
+        for rel in rels.iter(NS_PKG_REL + 'Relationship'):
+            target = rel.attrib['Target']
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join('xl', target))
+            targets[rel.attrib['Id']] = target
+
+        wb = ET.fromstring(self.zip.read('xl/workbook.xml'))
+        sheets = {}
+        for sheet in wb.iter(NS_MAIN + 'sheet'):
+            sheets[sheet.attrib['name']] = targets[sheet.attrib[NS_REL + 'id']]
+        active = 0
+        view = wb.find(NS_MAIN + 'bookViews/' + NS_MAIN + 'workbookView')
+        if view is not None:
+            active = int(view.attrib.get('activeTab', 0))
+        datemode = 0
+        pr = wb.find(NS_MAIN + 'workbookPr')
+        if pr is not None and pr.attrib.get('date1904') in ('1', 'true'):
+            datemode = 1
+        return sheets, active, datemode
+
+    def _load_shared_strings(self):
+        ''' Load table of shared strings (phonetic runs are skipped)
+        '''
+        strings = []
+        try:
+            f = self.zip.open('xl/sharedStrings.xml')
+        except KeyError:
+            return strings
+        text = []
+        state = {'t': False, 'phonetic': False}
+
+        def start(name, attrs):
+            if name == 'si':
+                text.clear()
+            elif name == 't':
+                state['t'] = not state['phonetic']
+            elif name == 'rPh':
+                state['phonetic'] = True
+
+        def end(name):
+            if name == 'si':
+                strings.append(''.join(text))
+            elif name == 't':
+                state['t'] = False
+            elif name == 'rPh':
+                state['phonetic'] = False
+
+        def chars(data):
+            if state['t']:
+                text.append(data)
+
+        parser = self._parser(start, end, chars)
+        with f:
+            parser.ParseFile(f)
+        return strings
+
+    def _load_styles(self):
+        ''' Find indices of cell formats which show dates
+        '''
+        try:
+            styles = ET.fromstring(self.zip.read('xl/styles.xml'))
+        except KeyError:
+            return frozenset()
+        date_formats = set(DATE_FORMAT_IDS)
+        for fmt in styles.iter(NS_MAIN + 'numFmt'):
+            if is_date_format(fmt.attrib.get('formatCode', '')):
+                date_formats.add(int(fmt.attrib['numFmtId']))
+        result = set()
+        xfs = styles.find(NS_MAIN + 'cellXfs')
+        if xfs is not None:
+            for i, xf in enumerate(xfs.iter(NS_MAIN + 'xf')):
+                if int(xf.attrib.get('numFmtId', 0)) in date_formats:
+                    result.add(i)
+        return frozenset(result)
+
+    def _parser(self, start, end, chars):
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = chars
+        return parser
+
+    def _value(self, text, ctype, style):
+        ''' Convert text of the cell to python value
+        '''
+        if ctype == 's':
+            return self.strings[int(text)]
+        if ctype in ('str', 'inlineStr', 'e'):
+            return text
+        if ctype == 'b':
+            return text == '1'
+        if not text:
+            return None
+        if ctype == 'd':
+            return datetime.datetime.fromisoformat(text) # ISO date cell - datetime like numeric ones
+        if style in self.date_styles:
+            return dates.xldate_as_datetime(float(text), self.datemode)
+        if '.' in text or 'E' in text or 'e' in text:
+            return float(text)
+        return int(text)
+
+    def rows(self, name=None, width=None):
+        ''' Yield rows of the sheet (active sheet by default) as lists of values.
+            Empty rows are yielded for missing rows, every row is padded with None
+            up to width (by default - width of the first row)
+        '''
+        if name is None:
+            name = list(self.sheets)[self.active]
+        ready = []
+        text = []
+        row = []
+        cell = {'col': 0, 'type': None, 'style': None, 'text': False}
+        state = {'row': 0, 'width': width}
+
+        def start(tag, attrs):
+            if tag == 'c':
+                ref = attrs.get('r')
+                cell['col'] = col_index(ref) if ref else len(row)
+                cell['type'] = attrs.get('t')
+                cell['style'] = int(attrs.get('s', 0))
+                text.clear()
+            elif tag == 'v' or tag == 't':
+                cell['text'] = True
+            elif tag == 'row':
+                nrow = int(attrs.get('r', state['row'] + 1))
+                while state['row'] < nrow - 1:
+                    # missing rows
+                    state['row'] += 1
+                    ready.append([None] * (state['width'] or 0))
+                state['row'] = nrow
+                row.clear()
+
+        def end(tag):
+            if tag == 'v' or tag == 't':
+                cell['text'] = False
+            elif tag == 'c':
+                col = cell['col']
+                if col >= len(row):
+                    row.extend([None] * (col - len(row) + 1))
+                row[col] = self._value(''.join(text), cell['type'], cell['style'])
+            elif tag == 'row':
+                if state['width'] is None:
+                    state['width'] = len(row)
+                if len(row) < state['width']:
+                    row.extend([None] * (state['width'] - len(row)))
+                ready.append(list(row))
+
+        def chars(data):
+            if cell['text']:
+                text.append(data)
+
+        parser = self._parser(start, end, chars)
+        with self.zip.open(self.sheets[name]) as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                parser.Parse(chunk, False)
+                if ready:
+                    yield from ready
+                    ready.clear()
+            parser.Parse(b'', True)
+        yield from ready
@@ -0,0 +1,109 @@
+import os
+import datetime
+import tempfile
+import unittest
+import zipfile
+
+from . import xlsx
+
+MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+
+# minimal workbook: two sheets, the second one is active
+PARTS = {
+    'xl/workbook.xml':
+        '<workbook xmlns="{}" xmlns:r="{}"><bookViews><workbookView activeTab="1"/></bookViews><sheets>'
+        '<sheet name="Сделки" sheetId="1" r:id="rId1"/>'
+        '<sheet name="Движение ДС" sheetId="2" r:id="rId2"/>'
+        '</sheets></workbook>'.format(MAIN, REL),
+    'xl/_rels/workbook.xml.rels':
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" Target="/xl/worksheets/sheet2.xml"/>'
+        '</Relationships>',
+    'xl/sharedStrings.xml':
+        '<sst xmlns="{}">'
+        '<si><t>Операция</t></si>'
+        '<si><t>Валюта</t></si>'
+        '<si><r><t>Дата </t></r><r><t>расчётов</t></r><rPh><t>ignored</t></rPh></si>'
+        '<si><t>Покупка</t></si>'
+        '</sst>'.format(MAIN),
+    # style 1 - built-in date format, style 2 - custom date format, style 3 - custom number format
+    'xl/styles.xml':
+        '<styleSheet xmlns="{}"><numFmts>'
+        '<numFmt numFmtId="164" formatCode="dd/mm/yyyy\\ hh:mm"/>'
+        '<numFmt numFmtId="165" formatCode="#,##0.00&quot;р.&quot;"/>'
+        '</numFmts><cellXfs>'
+        '<xf numFmtId="0"/><xf numFmtId="14"/><xf numFmtId="164"/><xf numFmtId="165"/>'
+        '</cellXfs></styleSheet>'.format(MAIN),
+    'xl/worksheets/sheet1.xml':
+        '<worksheet xmlns="{}"><sheetData>'
+        '<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c>'
+        '<c r="D1" t="s"><v>2</v></c></row>'
+        '<row r="2"><c r="A2" t="s"><v>3</v></c><c r="B2" t="inlineStr"><is><t>RUB</t></is></c>'
+        '<c r="C2" s="3"><v>1234.5</v></c><c r="D2" s="1"><v>44197</v></c></row>'
+        '<row r="4"><c r="B4" t="b"><v>1</v></c><c r="D4" s="2"><v>44197.5</v></c></row>'
+        '<row r="5"><c r="AB5"><v>7</v></c></row>'
+        '</sheetData></worksheet>'.format(MAIN),
+    'xl/worksheets/sheet2.xml':
+        '<worksheet xmlns="{}"><sheetData>'
+        '<row><c t="str"><v>formula</v></c><c t="d"><v>2021-03-01</v></c></row>'
+        '</sheetData></worksheet>'.format(MAIN),
+}
+
+
+class TestXlsx(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.xlsx')
+        os.close(fd)
+        with zipfile.ZipFile(self.filename, 'w') as z:
+            for name, content in PARTS.items():
+                z.writestr(name, content)
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def test_col_index(self):
+        self.assertEqual(xlsx.col_index('A1'), 0)
+        self.assertEqual(xlsx.col_index('Z10'), 25)
+        self.assertEqual(xlsx.col_index('AB5'), 27)
+
+    def test_is_date_format(self):
+        self.assertTrue(xlsx.is_date_format('dd/mm/yyyy'))
+        self.assertFalse(xlsx.is_date_format('General'))
+        self.assertFalse(xlsx.is_date_format('#,##0.00"руб."')) # letters in quoted text
+        self.assertFalse(xlsx.is_date_format('[Red]0.00'))
+
+    def test_sheets(self):
+        with xlsx.XlsxReader(self.filename) as workbook:
+            self.assertEqual(workbook.sheet_names, ['Сделки', 'Движение ДС'])
+            self.assertEqual(workbook.active, 1)
+            self.assertEqual(workbook.date_styles, {1, 2})
+
+    def test_rows(self):
+        with xlsx.XlsxReader(self.filename) as workbook:
+            rows = list(workbook.rows('Сделки'))
+        self.assertEqual(rows, [
+            ['Операция', 'Валюта', None, 'Дата расчётов'], # shared strings, gap in columns
+            ['Покупка', 'RUB', 1234.5, datetime.datetime(2021, 1, 1)], # inline string, dates
+            [None, None, None, None], # missing row
+            [None, True, None, datetime.datetime(2021, 1, 1, 12)],
+            [None] * 27 + [7], # row is longer than header
+        ])
+
+    def test_active_sheet(self):
+        with xlsx.XlsxReader(self.filename) as workbook:
+            self.assertEqual(list(workbook.rows()), [['formula', datetime.datetime(2021, 3, 1)]])
+
+    def test_fields(self):
+        with xlsx.XlsxReader(self.filename) as workbook:
+            rows = workbook.rows('Сделки', width=4)
+            fields = xlsx.fields(next(rows), ['Дата расчётов', 'Операция'])
+            self.assertEqual(fields(next(rows)), (datetime.datetime(2021, 1, 1), 'Покупка'))
+        with self.assertRaises(ValueError):
+            xlsx.fields(['Операция'], ['Операция', 'Сумма'])
+
+
+if __name__ == '__main__':
+    unittest.main()
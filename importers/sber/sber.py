@@ -4,6 +4,7 @@
 '''
 #import xlrd
 import datetime
+import dataclasses
 import re
 import os
 #import csv
@@ -16,16 +17,57 @@ from beancount.core import account
 from beancount.core import amount
 from beancount.core import position
 from beancount.ingest import importer
+from beancount.ingest import cache
 # from xlrd.biffh import XLRDError
 # from xlrd.xldate import xldate_as_datetime
 
-from openpyxl import Workbook, workbook
-from openpyxl import load_workbook
-
-import warnings
-warnings.simplefilter("ignore")
-
-NOCOST = position.CostSpec(None, None, None, None, None, None)
+from ..rufinlib import context
+from ..rufinlib import dates
+from ..rufinlib import decimals
+from ..rufinlib import directives
+from ..rufinlib import legs
+from ..rufinlib import tables
+from ..rufinlib import watermark
+from ..rufinlib import xlsx
+
+NOCOST = directives.NOCOST
+# columns of 'Сделки' sheet used by importer
+TRN_COLUMNS = ['Операция', 'Валюта', 'Код финансового инструмента', 'Номер сделки', 'Количество',
+               'Сумма зачисления/списания', 'Комиссия торговой системы', 'Комиссия банка', 'Тип сделки',
+               'Дата расчётов', 'Дата расчётов по 2-й части сделки РЕПО',
+               'Сумма зачисления/списания 2-й части сделки РЕПО']
+# columns of 'Движение ДС' sheet used by importer
+CFLOW_COLUMNS = ['Операция', 'Содержание операции', 'Дата исполнения поручения', 'Валюта операции', 'Сумма']
+# kinds of exports and prefixes of their file names
+EXPORT_KINDS = [('trn', 'Сделки_'), ('cflow', 'Зачисления-и-Списания_')]
+
+
+@dataclasses.dataclass(frozen=True)
+class GroupOwner:
+    ''' Converter for beancount's memo of the group's first file: member of the export group
+        which extracts the whole group - the first one processed in the run
+    '''
+    group: tuple
+    member: str = dataclasses.field(compare=False)
+
+    def __call__(self, _):
+        return self.member
+
+
+def export_period(filename):
+    ''' Get kind and period of export from file name: <prefix><begin>__<end>.xlsx
+        return: (kind, begin, end) or None if it's not Sberbank's export
+    '''
+    name = os.path.basename(filename)
+    for kind, prefix in EXPORT_KINDS:
+        if name.startswith(prefix):
+            pos1 = len(prefix) # start of period
+            pos2 = pos1 + 12 # end of period
+            try:
+                return kind, dates.iso_date(name[pos1:pos1+10]), dates.iso_date(name[pos2:pos2+10])
+            except ValueError:
+                return None
+    return None
 
 class Importer(importer.ImporterProtocol):
     '''An importer for Sberbanks XLS files'''
@@ -40,7 +82,9 @@ class Importer(importer.ImporterProtocol):
                  account_gains,
                  account_external,
                  account_repo = None,
-                 balance = True):
+                 balance = True,
+                 combine = False,
+                 watermark = None):
         self.general_agreement_id = general_agreement_id
         self.account_root = account_root
         self.account_cash = account_cash
@@ -49,8 +93,11 @@ class Importer(importer.ImporterProtocol):
         self.account_interest = account_interest
         self.account_fees = account_fees
         self.account_gains = account_gains
+        self.accounts = directives.Accounts(account_root, account_gains)
         self.account_external = account_external
         self.balance = balance
+        self.combine = combine # extract exports of the same period(s) together
+        self.watermark = watermark # file with watermarks - skip already imported operations
         self.account_repo = account_repo if account_repo else account_fees
 
         # self.isindb = {}
@@ -71,18 +118,28 @@ class Importer(importer.ImporterProtocol):
             return 'ENPG'
         return ticker
 
-    def check_sber(self, xlsfile, genid):
+    def check_sber(self, xlsfile, genid, agreements=None):
         ''' * Verify if file from Sberbank broker
+            agreements: agreement ids of exports checked in this extraction (see agreement_id)
         '''
-        #workbook = xlrd.open_workbook(xlsfile, logfile=open(os.devnull, 'w'))
-        workbook = load_workbook(xlsfile, read_only=True)
-        sheet = workbook.active
-        val = sheet['A2'].value
-        workbook.close()
-        # Check general agreement id
-        if val != genid:
-            return False
-        return True
+        return self.agreement_id(xlsfile, agreements) == genid
+
+    def agreement_id(self, xlsfile, agreements=None):
+        ''' General agreement id of the export (cell A2)
+            agreements: dict to remember it in by file and its modification time
+        '''
+        key = (os.path.abspath(xlsfile), os.path.getmtime(xlsfile))
+        if agreements is not None and key in agreements:
+            return agreements[key]
+        val = None
+        with xlsx.XlsxReader(xlsfile) as workbook:
+            for i, row in enumerate(workbook.rows()):
+                if i == 1:
+                    val = row[0] # cell A2
+                    break
+        if agreements is not None:
+            agreements[key] = val
+        return val
 
     def identify(self, file):
         ''' * Match if the filename is file from Sberbank
@@ -113,33 +170,98 @@ class Importer(importer.ImporterProtocol):
     def extract(self, file):
         ''' Open XLS file and create directives
         '''
+        # trades and cash movements come in different files - each has its own watermark
+        wm = {kind: watermark.Watermark(self.watermark, '{} {}'.format(self.account_root, kind))
+                for kind, _ in EXPORT_KINDS}
+        if self.combine:
+            group = self.export_group(context.ExtractContext(file, agreements={}))
+            # group is extracted by its member processed first - memo of the first file keeps it
+            # for the run, so any subset of the group given to bean-extract extracts it once
+            member = os.path.abspath(file.name)
+            if cache.get_file(group[0]).convert(GroupOwner(tuple(group), member)) != member:
+                return [] # extracted together with another file of the group
+            entries = self.extract_group(group, wm)
+            for kind_wm in wm.values():
+                kind_wm.save()
+            return entries
+
         entries = []
         
         # extract report period
-        per =  os.path.basename(file.name)
-        pos1 = per.index('_') + 1 # start of period
-        pos2 = pos1 + 12 # end of period
-        self.stmt_begin = datetime.datetime.strptime(per[pos1:pos1+10], '%Y-%m-%d').date()
-        self.stmt_end = datetime.datetime.strptime(per[pos2:pos2+10], '%Y-%m-%d').date()
+        kind, stmt_begin, stmt_end = export_period(file.name)
+        ctx = context.ExtractContext(file, stmt_begin, stmt_end, wm=wm)
         
-        workbook = load_workbook(file.name, read_only=True)
+        with xlsx.XlsxReader(file.name) as workbook:
+            if False: #use broker report to extract balances
+                entries += self.get_balance(workbook, ctx)
 
-        if False: #use broker report to extract balances
-            entries += self.get_balance(workbook, file)
+            if re.match(r"Сделки_", os.path.basename(file.name)):
+                entries += self.get_trn(workbook, ctx)
 
-        if re.match(r"Сделки_", os.path.basename(file.name)):
-            entries += self.get_trn(workbook, file)
-        
-        if re.match(r"Зачисления-и-Списания_", os.path.basename(file.name)):
-            entries += self.get_cflow(workbook, file)
+            if re.match(r"Зачисления-и-Списания_", os.path.basename(file.name)):
+                entries += self.get_cflow(workbook, ctx)
 
-        workbook.close()
+        wm[kind].save()
+        return entries
 
+    def export_group(self, ctx):
+        ''' Find exports of the account in the directory of ctx.file which cover continuous
+            period together with the file: trades and cash movements of the same period and
+            of consecutive (or overlapping) periods
+            ctx.agreements: agreement ids of exports checked in this extraction
+            return: list of absolute file names sorted by period, trades before cash movements
+        '''
+        filename = os.path.abspath(ctx.file.name)
+        directory = os.path.dirname(filename)
+        exports = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            per = export_period(path)
+            if per is None or os.path.splitext(name)[1] != ".xlsx":
+                continue
+            if path != filename and not self.check_sber(path, self.general_agreement_id, ctx.agreements):
+                continue
+            kind, begin, end = per
+            exports.append((begin, kind != 'trn', end, path))
+        exports.sort()
+
+        group = []
+        group_end = None
+        for begin, _, end, path in exports:
+            if group_end and begin > group_end + datetime.timedelta(days=1):
+                # gap between periods - start new group
+                if filename in group:
+                    break
+                group = []
+                group_end = None
+            group.append(path)
+            group_end = max(group_end, end) if group_end else end
+        return group
+
+    def extract_group(self, group, wm):
+        ''' Extract group of exports as one source: deals and cash movements met in several
+            files (overlapping periods) are taken only once
+            wm: watermarks of the account by kind of export
+        '''
+        entries = []
+        periods = [export_period(path) for path in group]
+        stmt_begin = min(per[1] for per in periods)
+        stmt_end = max(per[2] for per in periods)
+
+        deals = set()
+        movements = set()
+        for path, (kind, begin, end) in zip(group, periods):
+            ctx = context.ExtractContext(cache.get_file(path), stmt_begin, stmt_end, wm=wm)
+            with xlsx.XlsxReader(path) as workbook:
+                if kind == 'trn':
+                    entries += self.get_trn(workbook, ctx, deals)
+                else:
+                    entries += self.get_cflow(workbook, ctx, movements)
         return entries
 
-    def get_balance(self, workbook, file):
+    def get_balance(self, workbook, ctx):
         ''' * Parse broker report for end of period balances - cash and assets
-            In: XLS sheet, file
+            In: XLS sheet, extraction context
             Out: list of transactions
         '''
         try:
@@ -167,23 +289,23 @@ class Importer(importer.ImporterProtocol):
             elif sheet.row(ii)[2].value == 'Акции' or sheet.row(ii)[2].value == 'Прочее':
                 asset_type = 2 # Stocks and ADRs
             if sheet.row(ii)[6].value:
-                meta = data.new_metadata(file.name, ii)
+                meta = directives.new_metadata(ctx.file.name, ii)
                 if asset_type == 1:
                     # line with currencies
                     ticker = sheet.row(ii)[6].value
                     acc = self.exchanges[sheet.row(ii)[market].value]
                     result.append(data.Balance(meta, 
-                                    self.stmt_end + datetime.timedelta(days=1),
+                                    ctx.stmt_end + datetime.timedelta(days=1),
                                     acc,
-                                    amount.Amount(D(str(sheet.row(ii)[15].value)), ticker),
+                                    amount.Amount(decimals.cell2d(sheet.row(ii)[15].value), ticker),
                                     None, None))
                 elif asset_type == 2:
                     # line with stocks
                     ticker = self.isindb[sheet.row(ii+1)[6].value]
-                    account_inst = account.join(self.account_root, ticker)
-                    amt = amount.Amount(D(str(sheet.row(ii)[15].value)), ticker)
+                    account_inst = self.accounts.instrument(ticker)
+                    amt = amount.Amount(decimals.cell2d(sheet.row(ii)[15].value), ticker)
                     result.append(data.Balance(meta, 
-                                    self.stmt_end + datetime.timedelta(days=1),
+                                    ctx.stmt_end + datetime.timedelta(days=1),
                                     account_inst,
                                     amt,
                                     None, None))
@@ -193,34 +315,36 @@ class Importer(importer.ImporterProtocol):
 
         return result
 
-    def get_trn(self, workbook, file):
+    def get_trn(self, workbook, ctx, seen=None):
         ''' Parse Сделки for all assets transactions
+            seen: set of deal numbers which are already extracted (updated)
         '''
-        sheet = workbook['Сделки']
-        hh = self.proc_header(sheet)
+        rows = workbook.rows('Сделки')
+        fields = self.proc_header(next(rows), TRN_COLUMNS)
         result = []
+        trades = tables.TradeTable()
     
-        for i, row in enumerate(sheet.values):
-            # skip header
-            if i == 0:
-                continue
-            
-            meta = data.new_metadata(file.name, i)
-            sign = -1 if row[hh['Операция']] == 'Продажа' else 1
-            ticker_cur = row[hh['Валюта']]
-            ticker = self.fix_ticker(row[hh['Код финансового инструмента']])
-            desc = row[hh['Номер сделки']]
-            amt = amount.Amount(sign*D(str(row[hh['Количество']])), ticker)
-            trn_cost = amount.Amount(-1*sign*D(str(row[hh['Сумма зачисления/списания']])), ticker_cur)
-            commision = amount.Amount(D(str(
-                                    row[hh['Комиссия торговой системы']] + row[hh['Комиссия банка']]
-                                                        )), ticker_cur)
-
-            if row[hh['Тип сделки']] == 'РЕПО':
-                trn_date_2 = row[hh['Дата расчётов по 2-й части сделки РЕПО']].date()
-                delta = amount.Amount(D(str(
-                    row[hh['Сумма зачисления/списания']] - row[hh['Сумма зачисления/списания 2-й части сделки РЕПО']])), 
-                    ticker_cur)
+        for i, row in enumerate(rows, 1):
+            if not any(row):
+                continue # empty line
+            (oper, ticker_cur, code, desc, qty, total, fee_ts, fee_bank, deal_type,
+                settle_date, settle_date_2, total_2) = fields(row)
+            if seen is not None:
+                if desc in seen:
+                    continue
+                seen.add(desc)
+            # repo is keyed on its first leg - second one is settled weeks later
+            if ctx.wm['trn'].skip(settle_date, desc):
+                continue # imported already
+            sign = -1 if oper == 'Продажа' else 1
+            ticker = self.fix_ticker(code)
+            fee = decimals.money(fee_ts, ticker_cur) + decimals.money(fee_bank, ticker_cur)
+
+            if deal_type == 'РЕПО':
+                meta = directives.new_metadata(ctx.file.name, i)
+                trn_date_2 = settle_date_2.date()
+                delta = amount.Amount(decimals.money(total, ticker_cur) - decimals.money(total_2, ticker_cur), ticker_cur)
+                commision = amount.Amount(fee, ticker_cur)
                 
                 txn = data.Transaction(
                                         meta, trn_date_2, self.FLAG, None, desc, data.EMPTY_SET, data.EMPTY_SET, 
@@ -229,74 +353,55 @@ class Importer(importer.ImporterProtocol):
                                             data.Posting(self.account_fees, commision, None, None, None, None),
                                             data.Posting(self.account_repo, None, None, None, None, None)
                                         ])
+                result.append(txn)
             else:
-                trn_date = row[hh['Дата расчётов']].date()
-                account_inst = account.join(self.account_root, ticker)
-            
-                txn = self.create_tx(meta, sign, trn_date, ticker, desc, amt, trn_cost, commision, account_inst, self.account_gains)
+                trades.add(ctx.file.name, i, settle_date.date(), self.account_cash, self.accounts.instrument(ticker),
+                           sign*decimals.cell2d(qty), ticker, -1*sign*decimals.money(total, ticker_cur), ticker_cur,
+                           fee, self.account_fees, self.accounts.gains(ticker), desc)
 
-            result.append(txn)
-        return result
-        
-    def create_tx(self, meta, sign, trn_date, ticker, desc, amt, trn_cost, commision, account_inst, account_gains):
-        pp = [
-                    data.Posting(self.account_cash, trn_cost, None, None, None, None),
-                    data.Posting(self.account_fees, commision, None, None, None, None),
-                    data.Posting(account_inst, amt, NOCOST, None, None, None),
-                    ]
-        if sign == -1:
-            pp.append(data.Posting(account_gains.format(ticker), None, None, None, None, None))
-        txn = data.Transaction(meta, trn_date, self.FLAG, None, desc, data.EMPTY_SET, data.EMPTY_SET, pp)
-                    
-        return txn
+        return result + trades.build(self.FLAG)
 
-    def get_cflow(self, workbook, file):
+    def get_cflow(self, workbook, ctx, seen=None):
         ''' Parse broker export for all cash transactions except commissions - we got them from assets transactions
+            seen: set of cash movements (content, occurrence) which are already extracted (updated)
         '''
 
-        sheet = workbook['Движение ДС']
-        hh = self.proc_header(sheet)
-        result = []
-
-        for i, row in enumerate(sheet.values):
-            # skip header
-            if i == 0:
-                continue
-            
-            oper = row[hh['Операция']]
-            desc = row[hh['Содержание операции']]
+        rows = workbook.rows('Движение ДС')
+        fields = self.proc_header(next(rows), CFLOW_COLUMNS)
+        cash = tables.CashTable()
+        occurrences = {}
+
+        for i, row in enumerate(rows, 1):
+            if not any(row):
+                continue # empty line
+            oper, desc, exec_date, ticker_cur, total = fields(row)
+            if seen is not None:
+                # identical movements may repeat in the file - n-th one is matched with n-th
+                # of overlapping file
+                content = (oper, desc, exec_date, ticker_cur, total)
+                n = occurrences[content] = occurrences.get(content, 0) + 1
+                if (content, n) in seen:
+                    continue
+                seen.add((content, n))
 
             # if oper not in ['Ввод ДС', 'Вывод ДС', 'Списание налогов']:
             #     continue
             if not ((oper in ['Ввод ДС', 'Вывод ДС', 'Списание налогов']) or (desc == 'Оплата депозитарных услуг')):
                 continue
+            if ctx.wm['cflow'].skip(exec_date, row=(oper, desc, ticker_cur, total)):
+                continue # imported already
             sign = -1 if oper in ['Списание налогов', 'Вывод ДС', 'Списание комиссии'] else 1
-            meta = data.new_metadata(file.name, i)
-            trn_date = row[hh['Дата исполнения поручения']].date()
-            ticker_cur = row[hh['Валюта операции']]
-            
-            amt = amount.Amount(sign*D(str(row[hh['Сумма']])), ticker_cur)
-
-            txn = data.Transaction(
-                            meta, trn_date, self.FLAG, None, desc, data.EMPTY_SET, {trn_date}, [
-                                data.Posting(self.account_cash, amt, None, None, None,
-                                                None),
-                                data.Posting(self.account_external, -amt, None, None, None,
-                                                None),
-                            ])
-            result.append(txn)
-        return result
+            trn_date = exec_date.date()
+            cash.add(ctx.file.name, i, trn_date, self.account_cash, self.account_external,
+                     sign*decimals.money(total, ticker_cur), ticker_cur, desc, links={trn_date})
+        return cash.build(self.FLAG)
 
-    def proc_header(self, sheet):
+    def proc_header(self, header, columns):
         ''' process header of the table
-            input: sheet from Sberbank's export of operations
-            return: dictionary of column's headers with their indices
+            input: header row from Sberbank's export of operations, list of column's headers
+            return: function extracting values of the columns from row (in order of columns)
         '''
-        dd = {}
-        row = next(sheet.values)
-        for i, col in enumerate(row):
-            dd[col] = i
-        return dd
+        return xlsx.fields(header, columns)
 
     def get_cashflow(self, book, sheet, index, file):
         ''' Parse broker report for all cash operations (deposits, drawback, fees, dividends)
@@ -305,7 +410,8 @@ class Importer(importer.ImporterProtocol):
         '''
         result = []
         acc = ''
-        dedup = []
+        # transfers between markets are reported twice - by each market
+        dedup = legs.LegMatcher()
         # find beggining of next block
         ii = index + 1
         while ii<sheet.nrows-1:
@@ -342,14 +448,14 @@ class Importer(importer.ImporterProtocol):
                     ii += 4
                     break
 
-                trn_date = datetime.datetime.strptime(sheet.row(ii)[1].value, '%d.%m.%y').date()
+                trn_date = dates.ru_date_short(sheet.row(ii)[1].value)
                 try:
                     acc = self.exchanges[sheet.row(ii)[12].value]
                 except KeyError:
                     acc = acc_choice
-                meta = data.new_metadata(file.name, ii)
+                meta = directives.new_metadata(file.name, ii)
                 if sheet.row(ii)[2].value == 'Приход ДС':
-                    amt = amount.Amount(D(str(sheet.row(ii)[6].value)), trn_currency)
+                    amt = amount.Amount(decimals.cell2d(sheet.row(ii)[6].value), trn_currency)
                     txn = data.Transaction(
                         meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
                             data.Posting(acc, amt, None, None, None,
@@ -359,7 +465,7 @@ class Importer(importer.ImporterProtocol):
                         ])
                     result.append(txn)
                 elif sheet.row(ii)[2].value == 'Вывод ДС':
-                    amt = amount.Amount(D(str(sheet.row(ii)[7].value)), trn_currency)
+                    amt = amount.Amount(decimals.cell2d(sheet.row(ii)[7].value), trn_currency)
                     txn = data.Transaction(
                         meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
                             data.Posting(acc, -amt, None, None, None,
@@ -382,19 +488,15 @@ class Importer(importer.ImporterProtocol):
 
                     if sheet.row(ii)[6].value:
                         x = sheet.row(ii)[6].value
-                        amt = amount.Amount(D(str(sheet.row(ii)[6].value)), trn_currency)
+                        amt = amount.Amount(decimals.cell2d(sheet.row(ii)[6].value), trn_currency)
                     else:
                         x = -sheet.row(ii)[7].value
-                        amt = amount.Amount(-D(str(sheet.row(ii)[7].value)), trn_currency)
+                        amt = amount.Amount(-decimals.cell2d(sheet.row(ii)[7].value), trn_currency)
                     
-                    dd = [acc1, acc2, x] if x>0 else [acc2, acc1, -x]
-                    try:
-                        dedup.index(dd)
-                        dedup.remove(dd)
+                    direction = (acc1, acc2) if x>0 else (acc2, acc1)
+                    if dedup.match(None, direction, abs(x), ii) is not None:
                         ii += 1
                         continue
-                    except ValueError:
-                        dedup.append(dd)
 
                     txn = data.Transaction(
                         meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
@@ -406,7 +508,7 @@ class Importer(importer.ImporterProtocol):
                     result.append(txn)
                 elif sheet.row(ii)[2].value == 'Дивиденды':
                     # unfortunately we don't have ticker info for dividends
-                    amt = amount.Amount(D(str(sheet.row(ii)[6].value)), trn_currency)
+                    amt = amount.Amount(decimals.cell2d(sheet.row(ii)[6].value), trn_currency)
                     txn = data.Transaction(
                         meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
                             data.Posting(acc, amt, None, None, None,
@@ -419,7 +521,7 @@ class Importer(importer.ImporterProtocol):
                                                 'Вознаграждение компании', 'Quik','Оплата за вывод денежных средств', 
                                                 'Комиссия за займы "овернайт ЦБ"', 'Урегулирование сделок по Айсберг-заявкам']:
                     # unfortunately we don't have ticker info for fees
-                    amt = amount.Amount(D(str(sheet.row(ii)[7].value)), trn_currency)
+                    amt = amount.Amount(decimals.cell2d(sheet.row(ii)[7].value), trn_currency)
                     txn = data.Transaction(
                         meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
                             data.Posting(acc, -amt, None, None, None,
@@ -431,7 +533,7 @@ class Importer(importer.ImporterProtocol):
                 elif sheet.row(ii)[2].value in ['Займы "овернайт"', 'Проценты по займам "овернайт"', 'Проценты по займам "овернайт ЦБ"',
                                                 'НКД от операций', 'НДФЛ', 'Подоходный налог']:
                     if sheet.row(ii)[7].value:
-                        amt = amount.Amount(D(str(sheet.row(ii)[7].value)), trn_currency) 
+                        amt = amount.Amount(decimals.cell2d(sheet.row(ii)[7].value), trn_currency) 
                         txn = data.Transaction(
                             meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
                             data.Posting(acc, -amt, None, None, None,
@@ -441,7 +543,7 @@ class Importer(importer.ImporterProtocol):
                         ])
                         result.append(txn)
                     if sheet.row(ii)[6].value:
-                        amt = amount.Amount(-D(str(sheet.row(ii)[6].value)), trn_currency)
+                        amt = amount.Amount(-decimals.cell2d(sheet.row(ii)[6].value), trn_currency)
                         txn = data.Transaction(
                             meta, trn_date, self.FLAG, None, sheet.row(ii)[2].value, data.EMPTY_SET, {trn_date}, [
                                 data.Posting(acc, -amt, None, None, None,
@@ -482,23 +584,23 @@ class Importer(importer.ImporterProtocol):
                 while sheet.row(ii)[1].value != '':
                     # read ticker
                     ticker = fix_ticker(sheet.row(ii)[1].value)
-                    account_inst = account.join(self.account_root, ticker)
+                    account_inst = self.accounts.instrument(ticker)
                     isin = sheet.row(ii)[7].value
                     title = sheet.row(ii)[8].value
                     ii += 1
                     #start to read transactions - pass to first transaction
                     while sheet.row(ii)[1].value[:5] != r'Итого':
-                        trn_date = datetime.datetime.strptime(sheet.row(ii)[1].value, '%d.%m.%y').date()
+                        trn_date = dates.ru_date_short(sheet.row(ii)[1].value)
                         trn_num = sheet.row(ii)[2].value #transaction id by broker
                         trn_currency = 'RUB' if sheet.row(ii)[11].value == 'Рубль' else sheet.row(ii)[11].value
                         # are we selling our buying? cols 4,5 - buying, cols 7,8 - selling
                         if sheet.row(ii)[4].value != '':
                             # we bought the ticker
                             # instantiate amount bought, 'currency' - ticker itself
-                            meta = data.new_metadata(file.name, ii)
-                            units_inst = amount.Amount(D(sheet.row(ii)[4].value), ticker) # amount of ticker bought
-                            price = amount.Amount(-1*D(str(sheet.row(ii)[6].value)), trn_currency) # payment for transaction
-                            cost = position.Cost(D(str(sheet.row(ii)[5].value)), trn_currency, None, None) # cost of single unit
+                            meta = directives.new_metadata(file.name, ii)
+                            units_inst = amount.Amount(decimals.cell2d(sheet.row(ii)[4].value), ticker) # amount of ticker bought
+                            price = amount.Amount(-1*decimals.cell2d(sheet.row(ii)[6].value), trn_currency) # payment for transaction
+                            cost = position.Cost(decimals.cell2d(sheet.row(ii)[5].value), trn_currency, None, None) # cost of single unit
                             #cost = amount.Amount(D(str(sheet.row(ii)[5].value)), trn_currency) # cost of single unit
                             #pos = position.Position(units_inst, cost)
                             txn = data.Transaction(
@@ -511,11 +613,11 @@ class Importer(importer.ImporterProtocol):
                             entries.append(txn)
                         elif sheet.row(ii)[7].value != '':
                             # we sold ticker
-                            meta = data.new_metadata(file.name, ii)
-                            units_inst = amount.Amount(-1*D(sheet.row(ii)[7].value), ticker) # amount of ticker sold
-                            price = amount.Amount(D(str(sheet.row(ii)[9].value)), trn_currency) # payment for transaction
-                            cost = amount.Amount(D(str(sheet.row(ii)[8].value)), trn_currency) # cost of single unit
-                            account_gains = self.account_gains.format(ticker)
+                            meta = directives.new_metadata(file.name, ii)
+                            units_inst = amount.Amount(-1*decimals.cell2d(sheet.row(ii)[7].value), ticker) # amount of ticker sold
+                            price = amount.Amount(decimals.cell2d(sheet.row(ii)[9].value), trn_currency) # payment for transaction
+                            cost = amount.Amount(decimals.cell2d(sheet.row(ii)[8].value), trn_currency) # cost of single unit
+                            account_gains = self.accounts.gains(ticker)
                             txn = data.Transaction(
                                     meta, trn_date, self.FLAG, None, title, data.EMPTY_SET, {trn_num}, [
                                         data.Posting(acc, price, None, None, None,
@@ -542,22 +644,22 @@ class Importer(importer.ImporterProtocol):
                     ticker = sheet.row(ii)[1].value
                     ii += 1
                     while sheet.row(ii)[1].value[:5] != r'Итого':
-                        meta = data.new_metadata(file.name, ii)
-                        trn_date = datetime.datetime.strptime(sheet.row(ii)[1].value, '%d.%m.%y').date()
+                        meta = directives.new_metadata(file.name, ii)
+                        trn_date = dates.ru_date_short(sheet.row(ii)[1].value)
                         trn_num = sheet.row(ii)[2].value #transaction id by broker
                         # check if we buy or sell
                         if sheet.row(ii)[4].value:
                             # we buy
-                            conv_rate = amount.Amount(D(str(sheet.row(ii)[4].value)), 
+                            conv_rate = amount.Amount(decimals.cell2d(sheet.row(ii)[4].value), 
                                                       bought_currency)
-                            amount_bought = amount.Amount(D(sheet.row(ii)[5].value), sold_currency) # amount of ticker sold
-                            price = amount.Amount(-1*D(str(sheet.row(ii)[6].value)), bought_currency) # payment for transaction,                            
+                            amount_bought = amount.Amount(decimals.cell2d(sheet.row(ii)[5].value), sold_currency) # amount of ticker sold
+                            price = amount.Amount(-1*decimals.cell2d(sheet.row(ii)[6].value), bought_currency) # payment for transaction,                            
                         else:
                             #we sell
-                            conv_rate = amount.Amount(D(str(sheet.row(ii)[7].value)), 
+                            conv_rate = amount.Amount(decimals.cell2d(sheet.row(ii)[7].value), 
                                                     bought_currency)
-                            amount_bought = amount.Amount(-1*D(sheet.row(ii)[8].value), sold_currency) # amount of ticker sold
-                            price = amount.Amount(D(str(sheet.row(ii)[9].value)), bought_currency) # payment for transaction
+                            amount_bought = amount.Amount(-1*decimals.cell2d(sheet.row(ii)[8].value), sold_currency) # amount of ticker sold
+                            price = amount.Amount(decimals.cell2d(sheet.row(ii)[9].value), bought_currency) # payment for transaction
                         txn = data.Transaction(
                                     meta, trn_date, self.FLAG, None, ticker, data.EMPTY_SET, {trn_num}, [
                                         #data.Posting(acc, amount_bought, conv_rate, None, None, None),
@@ -574,23 +676,23 @@ class Importer(importer.ImporterProtocol):
                 while sheet.row(ii)[1].value != '':
                     # read ticker
                     ticker = fix_ticker(sheet.row(ii)[1].value)
-                    account_inst = account.join(self.account_root, ticker)
+                    account_inst = self.accounts.instrument(ticker)
                     isin = sheet.row(ii)[7].value
                     title = sheet.row(ii)[8].value
                     ii += 1
                     #start to read transactions - pass to first transaction
                     while sheet.row(ii)[1].value[:5] != r'Итого':
-                        trn_date = datetime.datetime.strptime(sheet.row(ii)[1].value, '%d.%m.%y').date()
+                        trn_date = dates.ru_date_short(sheet.row(ii)[1].value)
                         trn_num = sheet.row(ii)[2].value #transaction id by broker
                         trn_currency = 'RUB' if sheet.row(ii)[13].value == 'Рубль' else sheet.row(ii)[13].value
                         # are we selling our buying? cols 4,5 - buying, cols 7,8 - selling
                         if sheet.row(ii)[4].value != '':
                             # we bought the ticker
                             # instantiate amount bought, 'currency' - ticker itself
-                            meta = data.new_metadata(file.name, ii)
-                            units_inst = amount.Amount(D(sheet.row(ii)[4].value), ticker) # amount of ticker bought
-                            price = amount.Amount(-1*D(str(sheet.row(ii)[6].value)), trn_currency) # payment for transaction
-                            cost = position.Cost(D(str(sheet.row(ii)[5].value))*10, trn_currency, None, None) # cost of single unit
+                            meta = directives.new_metadata(file.name, ii)
+                            units_inst = amount.Amount(decimals.cell2d(sheet.row(ii)[4].value), ticker) # amount of ticker bought
+                            price = amount.Amount(-1*decimals.cell2d(sheet.row(ii)[6].value), trn_currency) # payment for transaction
+                            cost = position.Cost(decimals.cell2d(sheet.row(ii)[5].value)*10, trn_currency, None, None) # cost of single unit
                             txn = data.Transaction(
                                     meta, trn_date, self.FLAG, None, title, data.EMPTY_SET, {trn_num}, [
                                         data.Posting(acc, price, None, None, None, None),
@@ -601,11 +703,11 @@ class Importer(importer.ImporterProtocol):
                             entries.append(txn)
                         elif sheet.row(ii)[8].value != '':
                             # we sold ticker
-                            meta = data.new_metadata(file.name, ii)
-                            units_inst = amount.Amount(-1*D(sheet.row(ii)[8].value), ticker) # amount of ticker sold
-                            price = amount.Amount(D(str(sheet.row(ii)[10].value)), trn_currency) # payment for transaction
-                            cost = amount.Amount(D(str(sheet.row(ii)[9].value))*10, trn_currency) # cost of single unit
-                            account_gains = self.account_gains.format(ticker)
+                            meta = directives.new_metadata(file.name, ii)
+                            units_inst = amount.Amount(-1*decimals.cell2d(sheet.row(ii)[8].value), ticker) # amount of ticker sold
+                            price = amount.Amount(decimals.cell2d(sheet.row(ii)[10].value), trn_currency) # payment for transaction
+                            cost = amount.Amount(decimals.cell2d(sheet.row(ii)[9].value)*10, trn_currency) # cost of single unit
+                            account_gains = self.accounts.gains(ticker)
                             txn = data.Transaction(
                                     meta, trn_date, self.FLAG, None, title, data.EMPTY_SET, {trn_num}, [
                                         data.Posting(acc, price, None, None, None,
@@ -0,0 +1,102 @@
+import os
+import shutil
+import datetime
+import tempfile
+import unittest
+import zipfile
+from xml.sax.saxutils import escape
+
+from beancount.core import data
+from beancount.ingest import cache
+
+from ..rufinlib import watermark
+from . import sber
+
+MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+EPOCH = datetime.date(1899, 12, 30)
+
+REPO = ['Покупка', 'RUB', 'SU26207RMFS9', 'R1', 10, 1000, 0, 1, 'РЕПО',
+        datetime.date(2021, 3, 1), datetime.date(2021, 3, 29), 1010]
+TRADE = ['Покупка', 'RUB', 'SBER', 'D2', 10, 2500, 0.5, 0.5, 'Обычная',
+         datetime.date(2021, 3, 10), None, None]
+
+
+def cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, str):
+        return '<c t="inlineStr"><is><t>{}</t></is></c>'.format(escape(value))
+    if isinstance(value, datetime.date):
+        return '<c s="1"><v>{}</v></c>'.format((value - EPOCH).days)
+    return '<c><v>{}</v></c>'.format(value)
+
+
+def write_export(filename, sheet, rows):
+    ''' Minimal export of Sberbank: one sheet with the header and rows, dates are serial numbers
+    '''
+    parts = {
+        'xl/workbook.xml':
+            '<workbook xmlns="{}" xmlns:r="{}"><sheets><sheet name="{}" sheetId="1" r:id="rId1"/>'
+            '</sheets></workbook>'.format(MAIN, REL, sheet),
+        'xl/_rels/workbook.xml.rels':
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Target="worksheets/sheet1.xml"/></Relationships>',
+        'xl/styles.xml':
+            '<styleSheet xmlns="{}"><cellXfs><xf numFmtId="0"/><xf numFmtId="14"/></cellXfs>'
+            '</styleSheet>'.format(MAIN),
+        'xl/worksheets/sheet1.xml':
+            '<worksheet xmlns="{}"><sheetData>{}</sheetData></worksheet>'.format(
+                MAIN, ''.join('<row>{}</row>'.format(''.join(cell(value) for value in row)) for row in rows)),
+    }
+    with zipfile.ZipFile(filename, 'w') as z:
+        for name, content in parts.items():
+            z.writestr(name, content)
+
+
+class TestExtract(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.watermark = os.path.join(self.dir, 'watermark.json')
+        self.importer = self.make_importer(watermark=self.watermark)
+
+    def make_importer(self, **kwargs):
+        return sber.Importer('4XXXX', 'Assets:Sber', 'Assets:Sber:Cash', 'Assets:Sber:FX',
+                             'Income:Sber:Dividends', 'Income:Sber:Interest', 'Expenses:Sber:Fees',
+                             'Income:Sber:{}:Gains', 'Assets:External', **kwargs)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, rows):
+        filename = os.path.join(self.dir, name)
+        write_export(filename, 'Сделки', [['Договор'] + sber.TRN_COLUMNS] + [['4XXXX'] + row for row in rows])
+        return filename
+
+    def extract(self, filename):
+        entries = self.importer.extract(cache._FileMemo(filename))
+        watermark.commit(self.watermark)
+        return [entry for entry in entries if isinstance(entry, data.Transaction)]
+
+    def test_repo_then_trade(self):
+        repo, = self.extract(self.write('Сделки_2021-03-01__2021-03-05.xlsx', [REPO]))
+        self.assertEqual((repo.date, repo.narration), (datetime.date(2021, 3, 29), 'R1'))
+        # repo is keyed on its first leg - trade settled before the second leg isn't dropped
+        self.assertEqual(watermark.load(self.watermark)['Assets:Sber trn'], {'date': '2021-03-01', 'ids': ['R1']})
+        trade, = self.extract(self.write('Сделки_2021-03-01__2021-03-15.xlsx', [REPO, TRADE]))
+        self.assertEqual(trade.date, datetime.date(2021, 3, 10))
+        self.assertEqual(self.extract(self.write('Сделки_2021-03-01__2021-03-20.xlsx', [REPO, TRADE])), [])
+
+    def test_combine(self):
+        self.importer = self.make_importer(combine=True)
+        first = self.write('Сделки_2021-03-01__2021-03-15.xlsx', [REPO, TRADE])
+        second = self.write('Сделки_2021-03-11__2021-03-20.xlsx', [TRADE])
+        # overlapping exports are extracted together by the file processed first - even if it's not the first one
+        self.assertEqual(sorted(entry.narration for entry in self.extract(second)), ['D2', 'R1'])
+        self.assertEqual(self.extract(first), [])
+        self.assertEqual(len(self.extract(second)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
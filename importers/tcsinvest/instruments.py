@@ -0,0 +1,186 @@
+''' Local cache of Tinkoff Invest instruments (shares, bonds, ETFs and currencies by FIGI)
+    Only instruments referenced by operations and positions are looked up - by their FIGI,
+    all at once before processing, and are kept in the cache. Catalogues of all instruments
+    of the exchange (tens of thousands) aren't downloaded. When the cache is older than TTL
+    (or refresh is asked) instruments in use are looked up again.
+
+    Cache is the tickers.json file of tcsdownload:
+        {"version": 1, "updated": "2021-03-31T10:00:00", "instruments": {"<figi>": {...}, ...}}
+    File of old format (just instruments by FIGI) is read as outdated cache.
+    Importer may read just the instruments it needs (figis) - the rest of the file isn't parsed.
+'''
+import os
+import json
+import datetime
+import tempfile
+import threading
+
+from tinkoff.invest import InstrumentIdType
+
+from ..rufinlib import decimals
+from ..rufinlib import jsonstream
+
+VERSION = 1 # change when format of instrument changes - cache of other version is dropped
+FILENAME = 'tickers.json'
+TTL = datetime.timedelta(days=1)
+# methods to get details of instrument of the type by id (the rest of types - ETF etc. - has no nominal)
+LOOKUPS = {'share': 'share_by', 'bond': 'bond_by', 'currency': 'currency_by'}
+FIGI = InstrumentIdType.INSTRUMENT_ID_TYPE_FIGI
+
+
+def instrument_dict(i, asset: str) -> dict:
+    ''' Cached data of instrument (Share, Bond, Etf, Currency or Instrument) of type asset
+    '''
+    nominal = None if asset == 'etf' else getattr(i, 'nominal', None)
+    return {
+        'name': i.name,
+        'isin': i.isin,
+        'ticker': i.ticker,
+        'lot': i.lot,
+        'currency': i.currency.upper(),
+        'nominal_amount': 0 if nominal is None else decimals.mv2str(nominal),
+        'nominal_currency': '' if nominal is None else nominal.currency.upper(),
+        'type': asset
+    }
+
+
+def direct_call(method, **kwargs):
+    return method(**kwargs)
+
+
+async def direct_call_async(method, **kwargs):
+    return await method(**kwargs)
+
+
+def lookup(client, figi: str, call=direct_call) -> dict:
+    ''' Find instrument by FIGI - its type first, then details of the type
+        call: function(method, **kwargs) making API calls (e.g. RateLimiter.call_sync)
+    '''
+    instrument = call(client.instruments.get_instrument_by, id_type=FIGI, id=figi).instrument
+    asset = instrument.instrument_type
+    if asset in LOOKUPS:
+        instrument = call(getattr(client.instruments, LOOKUPS[asset]), id_type=FIGI, id=figi).instrument
+    return instrument_dict(instrument, asset)
+
+
+async def lookup_async(client, figi: str, call=direct_call_async) -> dict:
+    ''' Same as lookup with AsyncClient
+    '''
+    instrument = (await call(client.instruments.get_instrument_by, id_type=FIGI, id=figi)).instrument
+    asset = instrument.instrument_type
+    if asset in LOOKUPS:
+        instrument = (await call(getattr(client.instruments, LOOKUPS[asset]), id_type=FIGI, id=figi)).instrument
+    return instrument_dict(instrument, asset)
+
+
+class InstrumentCache:
+    ''' Instruments by FIGI stored in file
+    '''
+
+    def __init__(self, filename=FILENAME, ttl=TTL, figis=None):
+        ''' figis: load only these instruments - partial cache can't be saved
+            filename None - cache in memory only (nothing is read or saved)
+        '''
+        self.filename = filename
+        self.ttl = ttl
+        self.instruments = {}
+        self.updated = None
+        self.changed = False
+        self.resolved = set() # instruments looked up in this run
+        self.used = set() # instruments resolved or taken by get in this run
+        self.lock = threading.Lock()
+        self.partial = figis is not None
+        if filename is None:
+            return
+        try:
+            if self.partial:
+                state = self.read_partial(set(figis))
+            else:
+                with open(filename, encoding='utf-8') as f:
+                    state = json.load(f)
+        except FileNotFoundError:
+            return
+        if 'instruments' not in state:
+            self.instruments = state # old format - no version and time of update
+        elif state.get('version') == VERSION:
+            self.instruments = state['instruments']
+            self.updated = state['updated'] and datetime.datetime.fromisoformat(state['updated'])
+
+    def read_partial(self, figis: set) -> dict:
+        ''' Cache file with just instruments of figis
+        '''
+        # version and time of update are written before instruments - the rest isn't scanned
+        state = jsonstream.load(self.filename, {'version', 'updated'})
+        if 'version' not in state:
+            return jsonstream.load(self.filename, figis)
+        if state['version'] == VERSION:
+            state['instruments'] = jsonstream.load(self.filename, figis, path=('instruments',))
+        return state
+
+    def __contains__(self, figi):
+        return figi in self.instruments
+
+    def __getitem__(self, figi):
+        return self.instruments[figi]
+
+    def fresh(self):
+        ''' Check if instruments were looked up less than TTL ago
+        '''
+        return self.updated is not None and datetime.datetime.now() - self.updated < self.ttl
+
+    def expire(self):
+        ''' Look up instruments in use again even if cache is fresh
+        '''
+        self.updated = None
+
+    def missing(self, figis) -> list:
+        ''' FIGIs to look up: not in the cache or (if it's outdated) not looked up in this run
+        '''
+        fresh = self.fresh()
+        return sorted(figi for figi in set(figis)
+                      if figi and figi not in self.resolved and (not fresh or figi not in self.instruments))
+
+    def add(self, figi: str, instrument: dict):
+        self.instruments[figi] = instrument
+        self.resolved.add(figi)
+        self.changed = True
+
+    def resolve(self, client, figis, call=direct_call):
+        ''' Look up missing instruments of figis (see lookup for call)
+        '''
+        with self.lock: # accounts processed in parallel share the cache
+            for figi in self.missing(figis):
+                self.add(figi, lookup(client, figi, call))
+            self.used.update(figi for figi in figis if figi)
+
+    def get(self, client, figi: str) -> dict:
+        ''' Instrument by FIGI - looked up if it isn't in the cache
+        '''
+        if figi not in self.instruments:
+            self.resolve(client, [figi])
+        self.used.add(figi)
+        return self.instruments[figi]
+
+    def save(self):
+        ''' Store cache if it's changed
+        '''
+        if not self.changed or self.filename is None:
+            return
+        if self.partial:
+            raise ValueError('Partial cache of instruments can\'t be saved')
+        if not self.fresh():
+            self.updated = datetime.datetime.now() # instruments in use are looked up again
+        state = {'version': VERSION,
+                 'updated': self.updated.isoformat(),
+                 'instruments': self.instruments}
+        # write to temporary file and replace - file is never left half written
+        folder = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(state, f, indent=4, default=str)
+            os.replace(tmp, self.filename)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.changed = False
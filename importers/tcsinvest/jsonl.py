@@ -0,0 +1,80 @@
+''' Line-delimited output of tcsdownload (file with .jsonl extension)
+    One compact JSON record per line:
+        {"account":"<id>","operation":{...}}  - operation of the account
+        {"account":"<id>","header":{...}}     - the rest of account's data (positions, dates, last_operation)
+    Each download appends operations of an account and then its header as soon as the
+    account is downloaded - the latest header of account is valid. Operations downloaded
+    twice (at the boundary of downloads) are merged by id on reading.
+'''
+import json
+
+SEPARATORS = (',', ':')
+
+
+def operation_key(oper: dict):
+    ''' Key to merge stored and downloaded operations - id (operations without id
+        are identified by their content)
+    '''
+    return oper['id'] or (oper['date'], int(oper['type']), oper['figi'], oper['payment'])
+
+
+def merge_operations(stored: list, downloaded: list) -> list:
+    ''' Stored operations updated with downloaded ones - sorted by date
+    '''
+    operations = {operation_key(oper): oper for oper in stored}
+    operations.update((operation_key(oper), oper) for oper in downloaded)
+    return sorted(operations.values(), key=lambda oper: oper['date'])
+
+
+def dumps(record: dict) -> str:
+    return json.dumps(record, separators=SEPARATORS, ensure_ascii=False, default=str)
+
+
+def prefix(account_id: str) -> str:
+    ''' Start of all records of the account - other accounts' lines are skipped unparsed
+    '''
+    return '{"account":' + dumps(account_id) + ','
+
+
+def write_account(f, account_id: str, account: dict):
+    ''' Append account's data to open file
+        Header is written after operations - download interrupted in the middle of account
+        doesn't move its last_operation, so the operations are downloaded again next time.
+    '''
+    header = {key: value for key, value in account.items() if key != 'operations'}
+    for oper in account.get('operations', []):
+        f.write(dumps({'account': account_id, 'operation': oper}) + '\n')
+    f.write(dumps({'account': account_id, 'header': header}) + '\n')
+    f.flush()
+
+
+def headers(filename: str) -> dict:
+    ''' Latest headers of all accounts in file (without operations)
+    '''
+    result = {}
+    with open(filename, encoding='utf-8') as f:
+        for line in f:
+            if '"header":' in line: # can't be in string value - quotes are escaped there
+                record = json.loads(line)
+                result[record['account']] = record['header']
+    return result
+
+
+def read_account(filename: str, account_id: str) -> dict:
+    ''' Account's data in the format of JSON output (None if account isn't in file)
+    '''
+    start = prefix(account_id)
+    header = None
+    operations = []
+    with open(filename, encoding='utf-8') as f:
+        for line in f:
+            if not line.startswith(start):
+                continue
+            record = json.loads(line)
+            if 'header' in record:
+                header = record['header']
+            else:
+                operations.append(record['operation'])
+    if header is None:
+        return None
+    return header | {'operations': merge_operations([], operations)}
@@ -0,0 +1,436 @@
+''' Stand-in of Tinkoff Invest API for load tests of tcsdownload and tcsinvest importer
+    gRPC server with the subset of the API used here:
+        UsersService: GetAccounts
+        OperationsService: GetPositions, GetOperations, GetOperationsByCursor
+        InstrumentsService: GetInstrumentBy, ShareBy, BondBy, CurrencyBy, Shares, Bonds, Etfs, Currencies
+    Data is synthetic and deterministic (same seed - same accounts, operations and instruments),
+    operations are generated page by page - history of any size takes no memory. Latency of
+    calls and rate limit (RESOURCE_EXHAUSTED with x-ratelimit-reset) are configurable.
+    Data of the universe is plain Python - grpc and tinkoff.invest are needed only by server().
+
+    Clients of tinkoff.invest connect with TLS only - server needs certificate and key, and
+    clients trust it by environment variable:
+        openssl req -x509 -newkey rsa:2048 -nodes -keyout key.pem -out cert.pem -days 365 -subj /CN=localhost
+        python -m importers.tcsinvest.standin --cert cert.pem --key key.pem --accounts 30 --operations 100000
+        GRPC_DEFAULT_SSL_ROOTS_FILE_PATH=cert.pem python -m importers.tcsinvest.tcsdownload   # target = localhost:50051 in tcsdownload.cfg
+    Importer tcsinvest connects to it the same way with target='localhost:50051'.
+'''
+import time
+import random
+import asyncio
+import argparse
+import datetime
+
+PORT = 50051
+SEED = 1
+ACCOUNTS = 3
+OPERATIONS = 1000 # per account
+# instruments of each type: share, bond, etf, currency
+INSTRUMENTS = {'share': 2000, 'bond': 5000, 'etf': 300, 'currency': 20}
+OPENED = datetime.datetime(2012, 1, 1, tzinfo=datetime.timezone.utc) # accounts are opened
+END = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc) # last operation
+PAGE_SIZE = 1000 # operations per page of cursor API if limit isn't given
+TRADED = 50 # instruments traded by each account
+# operations generated: type (name of OperationType value), its name, share of all operations (the rest are trades)
+CASH_OPERATIONS = [('OPERATION_TYPE_INPUT', 'Пополнение брокерского счёта', 0.05),
+                   ('OPERATION_TYPE_BROKER_FEE', 'Удержание комиссии за операцию', 0.25),
+                   ('OPERATION_TYPE_DIVIDEND', 'Выплата дивидендов', 0.05)]
+
+
+class Universe:
+    ''' Synthetic instruments and accounts with operations
+        Instrument and operation are generated from their numbers - nothing is stored.
+    '''
+
+    def __init__(self, seed=SEED, accounts=ACCOUNTS, operations=OPERATIONS, instruments=INSTRUMENTS):
+        self.seed = seed
+        self.accounts = accounts
+        self.operations = operations
+        self.instruments = instruments
+
+    def figi(self, asset, n):
+        return 'SI{}{:08d}'.format(asset[:2].upper(), n)
+
+    def parse_figi(self, figi):
+        ''' Type and number of instrument by its FIGI - None if there is no such instrument
+        '''
+        for asset, count in self.instruments.items():
+            if figi.startswith(self.figi(asset, 0)[:4]):
+                n = int(figi[4:]) if figi[4:].isdigit() else -1
+                return (asset, n) if 0 <= n < count else None
+        return None
+
+    def fields(self, asset, n) -> dict:
+        ''' Common fields of instrument messages
+        '''
+        ticker = '{}{}'.format(asset[:2].upper(), n)
+        return {'figi': self.figi(asset, n), 'ticker': ticker, 'class_code': 'STANDIN',
+                'isin': 'RU{:010d}'.format(n), 'lot': 1 if asset != 'share' else 10,
+                'currency': 'rub', 'name': 'Stand-in {} {}'.format(asset, n)}
+
+    def nominal(self, asset, n):
+        ''' Nominal of instrument: (value, currency) - None for ETF
+        '''
+        if asset == 'share':
+            return 1, 'rub'
+        if asset == 'bond':
+            return 1000, 'rub'
+        if asset == 'currency':
+            return 1, 'usd' if n % 2 else 'eur'
+        return None
+
+    def account_id(self, n):
+        return '2{:09d}'.format(n)
+
+    def account_number(self, account_id):
+        n = int(account_id[1:]) if account_id[1:].isdigit() else -1
+        return n if 0 <= n < self.accounts else None
+
+    def date(self, k):
+        ''' Time of k-th operation of account - operations are spread evenly
+        '''
+        return OPENED + (END - OPENED) * (k + 1) / (self.operations + 1)
+
+    def index(self, dt):
+        ''' Number of the first operation at dt or later
+        '''
+        if dt is None or dt <= OPENED:
+            return 0
+        k = int((dt - OPENED) / (END - OPENED) * (self.operations + 1)) - 1
+        while k > 0 and self.date(k - 1) >= dt:
+            k -= 1
+        while k < self.operations and self.date(k) < dt:
+            k += 1
+        return min(max(k, 0), self.operations)
+
+    def period(self, from_=None, to=None):
+        ''' Numbers of the first and after the last operation of the period (whole history by default)
+        '''
+        return self.index(from_), self.index(to) if to is not None else self.operations
+
+    def page(self, from_=None, to=None, cursor='', limit=0):
+        ''' Page of operations of the period for cursor API: (first, after the last, next cursor)
+            Cursor is the number of the next operation - empty at the last page
+        '''
+        start, end = self.period(from_, to)
+        if cursor:
+            start = max(start, int(cursor))
+        stop = min(end, start + (limit or PAGE_SIZE))
+        return start, stop, str(stop) if stop < end else ''
+
+    def traded(self, rnd):
+        asset = rnd.choice(['share', 'share', 'bond', 'etf'])
+        n = rnd.randrange(min(TRADED, self.instruments[asset]))
+        return asset, n
+
+    def operation(self, a, k) -> dict:
+        ''' Fields of k-th operation of a-th account (amounts in rubles)
+        '''
+        rnd = random.Random('{}:{}:{}'.format(self.seed, a, k))
+        oper = {'id': '{}{:09d}'.format(a, k), 'date': self.date(k), 'figi': '', 'trades': []}
+        roll = rnd.random()
+        for op_type, name, share in CASH_OPERATIONS:
+            if roll < share:
+                oper.update(type=op_type, name=name, payment=round(rnd.uniform(1, 10000), 2))
+                if op_type == 'OPERATION_TYPE_BROKER_FEE':
+                    oper['payment'] = -round(rnd.uniform(0.01, 50), 2)
+                return oper
+            roll -= share
+        asset, n = self.traded(rnd)
+        buy = rnd.random() < 0.6
+        price = round(rnd.uniform(10, 2000), 2)
+        fills = [rnd.randint(1, 20) for _ in range(rnd.choice([1, 1, 1, 2, 3]))]
+        payment = round(price * sum(fills), 2)
+        oper.update(type='OPERATION_TYPE_BUY' if buy else 'OPERATION_TYPE_SELL',
+                    name='Покупка ценных бумаг' if buy else 'Продажа ценных бумаг',
+                    figi=self.figi(asset, n), instrument_type=asset, price=price,
+                    payment=-payment if buy else payment, quantity=sum(fills),
+                    trades=[('{}-{}'.format(oper['id'], i), q) for i, q in enumerate(fills)])
+        return oper
+
+    def positions(self, a) -> dict:
+        ''' Positions of a-th account: money - [(value, currency)], securities - {figi: (type, balance)}
+        '''
+        rnd = random.Random('{}:{}:positions'.format(self.seed, a))
+        securities = {}
+        for _ in range(rnd.randint(1, TRADED)):
+            asset, n = self.traded(rnd)
+            securities[self.figi(asset, n)] = asset
+        return {'money': [(round(rnd.uniform(0, 100000), 2), 'rub'), (round(rnd.uniform(0, 1000), 2), 'usd')],
+                'securities': {figi: (asset, rnd.randint(1, 1000)) for figi, asset in securities.items()}}
+
+
+class Limits:
+    ''' Latency of calls and rate limit of API (token bucket: rate calls per second, bursts up to burst)
+    '''
+
+    def __init__(self, latency=0.0, jitter=0.0, rate=None, burst=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.calls = 0
+        self.limited = 0
+
+    def take(self) -> int:
+        ''' Count the call - seconds until reset of the limit if it's exceeded (0 if the call may go)
+        '''
+        self.calls += 1
+        if not self.rate:
+            return 0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            self.limited += 1
+            return max(1, int((1 - self.tokens) / self.rate + 0.999))
+        self.tokens -= 1
+        return 0
+
+    def delay(self) -> float:
+        return self.latency + random.uniform(0, self.jitter) if self.latency or self.jitter else 0.0
+
+
+class Messages:
+    ''' Protocol buffer messages of the API with data of the universe
+    '''
+
+    def __init__(self, universe):
+        from google.protobuf import timestamp_pb2
+        from tinkoff.invest.grpc import common_pb2, instruments_pb2, operations_pb2, users_pb2
+        self.universe = universe
+        self.timestamp_pb2 = timestamp_pb2
+        self.common = common_pb2
+        self.instruments = instruments_pb2
+        self.operations = operations_pb2
+        self.users = users_pb2
+
+    def money(self, value, currency='rub'):
+        units = int(value)
+        return self.common.MoneyValue(currency=currency, units=units, nano=int(round((value - units) * 10**9)))
+
+    def timestamp(self, dt):
+        result = self.timestamp_pb2.Timestamp()
+        result.FromDatetime(dt)
+        return result
+
+    def instrument(self, asset, n):
+        ''' Instrument message of type asset (Share, Bond, Etf or Currency)
+        '''
+        fields = self.universe.fields(asset, n)
+        nominal = self.universe.nominal(asset, n)
+        if nominal:
+            fields['nominal'] = self.money(*nominal)
+        return getattr(self.instruments, {'share': 'Share', 'bond': 'Bond', 'currency': 'Currency',
+                                          'etf': 'Etf'}[asset])(**fields)
+
+    def account(self, n):
+        return self.users.Account(id=self.universe.account_id(n), type=self.users.ACCOUNT_TYPE_TINKOFF,
+                                  name='Stand-in {}'.format(n), status=self.users.ACCOUNT_STATUS_OPEN,
+                                  opened_date=self.timestamp(OPENED),
+                                  access_level=self.users.ACCOUNT_ACCESS_LEVEL_FULL_ACCESS)
+
+    def operation(self, a, k):
+        ''' Operation of GetOperations
+        '''
+        oper = self.universe.operation(a, k)
+        price = self.money(oper['price']) if 'price' in oper else None
+        return self.operations.Operation(
+            id=oper['id'], currency='rub', payment=self.money(oper['payment']), price=price,
+            state=self.operations.OPERATION_STATE_EXECUTED, quantity=oper.get('quantity', 0),
+            figi=oper['figi'], instrument_type=oper.get('instrument_type', ''), date=self.timestamp(oper['date']),
+            type=oper['name'], operation_type=self.operations.OperationType.Value(oper['type']),
+            trades=[self.operations.OperationTrade(trade_id=trade_id, date_time=self.timestamp(oper['date']),
+                                                   quantity=q, price=price)
+                    for trade_id, q in oper['trades']])
+
+    def operation_item(self, a, k):
+        ''' Operation of GetOperationsByCursor
+        '''
+        oper = self.universe.operation(a, k)
+        price = self.money(oper['price']) if 'price' in oper else None
+        return self.operations.OperationItem(
+            cursor=str(k + 1), broker_account_id=self.universe.account_id(a), id=oper['id'], name=oper['name'],
+            date=self.timestamp(oper['date']), type=self.operations.OperationType.Value(oper['type']),
+            state=self.operations.OPERATION_STATE_EXECUTED, figi=oper['figi'],
+            instrument_type=oper.get('instrument_type', ''), payment=self.money(oper['payment']),
+            price=price, quantity=oper.get('quantity', 0), quantity_done=oper.get('quantity', 0),
+            trades_info=self.operations.OperationItemTrades(trades=[
+                self.operations.OperationItemTrade(num=trade_id, date=self.timestamp(oper['date']),
+                                                   quantity=q, price=price)
+                for trade_id, q in oper['trades']]))
+
+    def positions(self, a):
+        positions = self.universe.positions(a)
+        return self.operations.PositionsResponse(
+            money=[self.money(value, currency) for value, currency in positions['money']],
+            securities=[self.operations.PositionsSecurities(figi=figi, balance=balance, instrument_type=asset)
+                        for figi, (asset, balance) in positions['securities'].items()])
+
+
+class Service:
+    ''' Base of servicers: calls go through limits
+        status: grpc.StatusCode - codes of errors
+    '''
+
+    def __init__(self, messages, limits, status):
+        self.universe = messages.universe
+        self.messages = messages
+        self.limits = limits
+        self.status = status
+
+    async def enter(self, context):
+        ''' Delay the call (abort it if rate limit is exceeded)
+        '''
+        reset = self.limits.take()
+        if reset:
+            await context.abort(self.status.RESOURCE_EXHAUSTED, 'Rate limit exceeded',
+                                trailing_metadata=(('x-ratelimit-reset', str(reset)),))
+        delay = self.limits.delay()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class Users(Service):
+
+    async def GetAccounts(self, request, context):
+        await self.enter(context)
+        return self.messages.users.GetAccountsResponse(accounts=[self.messages.account(n)
+                                                                 for n in range(self.universe.accounts)])
+
+
+class Operations(Service):
+
+    async def account(self, account_id, context):
+        a = self.universe.account_number(account_id)
+        if a is None:
+            await context.abort(self.status.NOT_FOUND, 'Account not found')
+        return a
+
+    def period(self, request):
+        ''' Times of the period of request (None if it isn't given)
+        '''
+        from_ = getattr(request, 'from') # "from" is keyword in Python
+        return (from_.ToDatetime(datetime.timezone.utc) if request.HasField('from') else None,
+                request.to.ToDatetime(datetime.timezone.utc) if request.HasField('to') else None)
+
+    async def GetPositions(self, request, context):
+        await self.enter(context)
+        return self.messages.positions(await self.account(request.account_id, context))
+
+    async def GetOperations(self, request, context):
+        await self.enter(context)
+        a = await self.account(request.account_id, context)
+        start, end = self.universe.period(*self.period(request))
+        return self.messages.operations.OperationsResponse(
+            operations=[self.messages.operation(a, k) for k in range(start, end)])
+
+    async def GetOperationsByCursor(self, request, context):
+        await self.enter(context)
+        a = await self.account(request.account_id, context)
+        start, stop, cursor = self.universe.page(*self.period(request), request.cursor, request.limit)
+        return self.messages.operations.GetOperationsByCursorResponse(
+            has_next=bool(cursor), next_cursor=cursor,
+            items=[self.messages.operation_item(a, k) for k in range(start, stop)])
+
+
+class Instruments(Service):
+
+    async def find(self, request, context, asset=None):
+        ''' Type and number of instrument of InstrumentRequest (by FIGI only)
+        '''
+        await self.enter(context)
+        found = self.universe.parse_figi(request.id)
+        if found is None or (asset is not None and found[0] != asset):
+            await context.abort(self.status.NOT_FOUND, 'Instrument not found')
+        return found
+
+    async def GetInstrumentBy(self, request, context):
+        asset, n = await self.find(request, context)
+        return self.messages.instruments.InstrumentResponse(
+            instrument=self.messages.instruments.Instrument(instrument_type=asset, **self.universe.fields(asset, n)))
+
+    async def ShareBy(self, request, context):
+        return self.messages.instruments.ShareResponse(
+            instrument=self.messages.instrument(*await self.find(request, context, 'share')))
+
+    async def BondBy(self, request, context):
+        return self.messages.instruments.BondResponse(
+            instrument=self.messages.instrument(*await self.find(request, context, 'bond')))
+
+    async def CurrencyBy(self, request, context):
+        return self.messages.instruments.CurrencyResponse(
+            instrument=self.messages.instrument(*await self.find(request, context, 'currency')))
+
+    async def catalogue(self, asset, context):
+        await self.enter(context)
+        return [self.messages.instrument(asset, n) for n in range(self.universe.instruments[asset])]
+
+    async def Shares(self, request, context):
+        return self.messages.instruments.SharesResponse(instruments=await self.catalogue('share', context))
+
+    async def Bonds(self, request, context):
+        return self.messages.instruments.BondsResponse(instruments=await self.catalogue('bond', context))
+
+    async def Etfs(self, request, context):
+        return self.messages.instruments.EtfsResponse(instruments=await self.catalogue('etf', context))
+
+    async def Currencies(self, request, context):
+        return self.messages.instruments.CurrenciesResponse(instruments=await self.catalogue('currency', context))
+
+
+def server(universe, limits, port=PORT, cert=None, key=None):
+    ''' gRPC server of the stand-in (not started yet) and its port (port 0 - any free port)
+    '''
+    import grpc
+    from tinkoff.invest.grpc import instruments_pb2_grpc, operations_pb2_grpc, users_pb2_grpc
+    messages = Messages(universe)
+    result = grpc.aio.server()
+    users_pb2_grpc.add_UsersServiceServicer_to_server(Users(messages, limits, grpc.StatusCode), result)
+    operations_pb2_grpc.add_OperationsServiceServicer_to_server(Operations(messages, limits, grpc.StatusCode), result)
+    instruments_pb2_grpc.add_InstrumentsServiceServicer_to_server(
+        Instruments(messages, limits, grpc.StatusCode), result)
+    address = '[::]:{}'.format(port)
+    if cert:
+        with open(cert, 'rb') as f_cert, open(key, 'rb') as f_key:
+            port = result.add_secure_port(address, grpc.ssl_server_credentials([(f_key.read(), f_cert.read())]))
+    else:
+        port = result.add_insecure_port(address)
+    return result, port
+
+
+async def serve(universe, limits, port=PORT, cert=None, key=None):
+    stand_in, port = server(universe, limits, port, cert, key)
+    await stand_in.start()
+    print('Stand-in of Tinkoff Invest API at localhost:{}'.format(port))
+    try:
+        await stand_in.wait_for_termination()
+    finally:
+        print('Calls: {}, rate limited: {}'.format(limits.calls, limits.limited))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0].strip())
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--cert', help='TLS certificate (PEM) - clients of tinkoff.invest need TLS')
+    parser.add_argument('--key', help='TLS private key (PEM)')
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--accounts', type=int, default=ACCOUNTS)
+    parser.add_argument('--operations', type=int, default=OPERATIONS, help='operations per account')
+    for asset, count in INSTRUMENTS.items():
+        parser.add_argument('--' + asset, type=int, default=count, help='instruments of the type')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra latency, seconds')
+    parser.add_argument('--rate', type=float, help='calls per second (no limit by default)')
+    parser.add_argument('--burst', type=int, help='calls at once (rate by default)')
+    args = parser.parse_args()
+    universe = Universe(args.seed, args.accounts, args.operations,
+                        {asset: getattr(args, asset) for asset in INSTRUMENTS})
+    limits = Limits(args.latency, args.jitter, args.rate, args.burst)
+    asyncio.run(serve(universe, limits, args.port, args.cert, args.key))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import asyncio
+import datetime
+import unittest
+
+from . import standin
+
+try:
+    import grpc
+    from tinkoff.invest.grpc import operations_pb2, operations_pb2_grpc, users_pb2, users_pb2_grpc
+except ImportError:
+    grpc = None
+
+
+class TestUniverse(unittest.TestCase):
+
+    def setUp(self):
+        self.universe = standin.Universe(seed=7, accounts=2, operations=250)
+
+    def test_deterministic(self):
+        same = standin.Universe(seed=7, accounts=2, operations=250)
+        other = standin.Universe(seed=8, accounts=2, operations=250)
+        operations = [self.universe.operation(a, k) for a in range(2) for k in range(250)]
+        self.assertEqual(operations, [same.operation(a, k) for a in range(2) for k in range(250)])
+        self.assertNotEqual(operations, [other.operation(a, k) for a in range(2) for k in range(250)])
+        self.assertEqual(self.universe.positions(1), same.positions(1))
+        # operations are in order of time, each trade refers to instrument of the universe
+        self.assertEqual(sorted(operations[:250], key=lambda oper: oper['date']), operations[:250])
+        for oper in operations:
+            if oper['figi']:
+                self.assertIsNotNone(self.universe.parse_figi(oper['figi']))
+                self.assertEqual(sum(q for _, q in oper['trades']), oper['quantity'])
+
+    def test_figi(self):
+        self.assertEqual(self.universe.parse_figi(self.universe.figi('bond', 12)), ('bond', 12))
+        self.assertIsNone(self.universe.parse_figi(self.universe.figi('share', standin.INSTRUMENTS['share'])))
+        self.assertIsNone(self.universe.parse_figi('BBG004730N88'))
+        self.assertEqual(self.universe.account_number(self.universe.account_id(1)), 1)
+        self.assertIsNone(self.universe.account_number(self.universe.account_id(2)))
+
+    def test_pages(self):
+        from_, to = self.universe.date(10), self.universe.date(200)
+        pages = []
+        cursor = ''
+        while True:
+            start, stop, cursor = self.universe.page(from_, to, cursor, 60)
+            pages.append(range(start, stop))
+            if not cursor:
+                break
+        self.assertEqual([len(page) for page in pages], [60, 60, 60, 10])
+        # operations of the period (end is exclusive) - each of them once
+        self.assertEqual([k for page in pages for k in page], list(range(10, 200)))
+        self.assertEqual(self.universe.page(), (0, 250, ''))
+        self.assertEqual(self.universe.page(to=standin.OPENED), (0, 0, ''))
+        self.assertEqual(self.universe.index(self.universe.date(10) + datetime.timedelta(seconds=1)), 11)
+
+    def test_limits(self):
+        limits = standin.Limits(rate=1, burst=2)
+        self.assertEqual([limits.take() for _ in range(3)], [0, 0, 1])
+        self.assertEqual((limits.calls, limits.limited), (3, 1))
+        self.assertEqual(standin.Limits().take(), 0)
+
+
+@unittest.skipIf(grpc is None, 'grpc and tinkoff.invest are not installed')
+class TestServer(unittest.TestCase):
+
+    def test_serve(self):
+        universe = standin.Universe(accounts=2, operations=30)
+
+        async def run():
+            server, port = standin.server(universe, standin.Limits(), port=0)
+            await server.start()
+            try:
+                async with grpc.aio.insecure_channel('localhost:{}'.format(port)) as channel:
+                    accounts = await users_pb2_grpc.UsersServiceStub(channel).GetAccounts(
+                        users_pb2.GetAccountsRequest())
+                    operations = operations_pb2_grpc.OperationsServiceStub(channel)
+                    ids = []
+                    cursor = ''
+                    while True:
+                        resp = await operations.GetOperationsByCursor(operations_pb2.GetOperationsByCursorRequest(
+                            account_id=accounts.accounts[1].id, cursor=cursor, limit=7))
+                        ids += [item.id for item in resp.items]
+                        if not resp.has_next:
+                            return accounts, ids
+                        cursor = resp.next_cursor
+            finally:
+                await server.stop(None)
+
+        accounts, ids = asyncio.run(run())
+        self.assertEqual([acc.id for acc in accounts.accounts], [universe.account_id(0), universe.account_id(1)])
+        self.assertEqual(ids, [universe.operation(1, k)['id'] for k in range(30)])
+
+
+if __name__ == '__main__':
+    unittest.main()
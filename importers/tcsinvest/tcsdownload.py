@@ -1,15 +1,35 @@
+''' Download accounts of Tinkoff Invest to JSON file for tcsinvest_json importer
+    Run from the directory with tcsdownload.cfg as module of importers package:
+        python -m importers.tcsinvest.tcsdownload [--refresh]
+'''
 import os
+import sys
+import asyncio
+import functools
 import configparser
-from urllib import response
-from tinkoff.invest import Client, PositionsResponse, MoneyValue, OperationState, OperationsResponse, Operation, AccessLevel, OperationType, InstrumentStatus
-from rich import print
+from tinkoff.invest import AsyncClient, PositionsResponse, MoneyValue, OperationState, AccessLevel, GetOperationsByCursorRequest
 from decimal import *
 import json
+import pickle
+import shutil
 import datetime
+import tempfile
+
+from ..rufinlib import decimals
+from ..rufinlib import ratelimit
+from . import instruments
+from . import jsonl
+
+CONCURRENCY = 8 # calls in progress at the same time
+PAGE_SIZE = 1000 # operations per call of cursor API
+CHECKPOINTS = '.parts' # suffix of output for folder of downloaded windows of history (see backfill)
+# operations before the latest stored one downloaded again: operations executed late with earlier
+# date (pending at the time of download) - duplicates are merged by id (see jsonl.merge_operations)
+OVERLAP = datetime.timedelta(days=7)
 
 
 def mv2str(mv: MoneyValue) -> str:
-    return str(mv.units+mv.nano/1e9)  # .rstrip('0')
+    return decimals.mv2str(mv)
 
 
 def get_positions_securities(response: PositionsResponse, tickers: dict) -> dict:
@@ -18,122 +38,353 @@ def get_positions_securities(response: PositionsResponse, tickers: dict) -> dict
     return {tickers[i.figi]['ticker']: i.balance for i in response.securities}
 
 
-def get_tickers_list(instruments: list, asset: str) -> dict:
-    return {i.figi: {
-        'name': i.name,
-        'isin': i.isin,
-        'ticker': i.ticker,
-        'lot': i.lot,
-        'currency': i.currency.upper(),
-        'nominal_amount': 0 if asset == 'etf' else mv2str(i.nominal),
-        'nominal_currency': '' if asset == 'etf' else i.nominal.currency.upper(),
-        'type': asset
-    }
-        for i in instruments
-    }
-
-
 def get_positions_cash(response: PositionsResponse, tickers: dict) -> dict:
     if len(response.money) == 0:
         return {'RUB': 0}
     return {i.currency.upper(): mv2str(i) for i in response.money}
 
 
-def get_operations_list(resp: OperationsResponse, tickers: dict) -> list:
-    result = list()
-    print("OPER: ", len(resp.operations))
-    for op in resp.operations:
-        # 1. find out ticker of asset
+def get_asset(figi: str, currency: str, tickers: dict) -> tuple:
+    ''' Name, ticker and type of operation's asset
+    '''
+    if figi == '':
+        # Cash operations
+        name = ticker = currency.upper()  # use operation's currency as ticker
+        asset_type = 'cash'
+    # elif op.figi == 'TCS007288411':
+    #     op.figi = 'BBG004731489'
+    #     ticker = 'GMKN'
+    # elif op.operation_type in [OperationType.OPERATION_TYPE_DIVIDEND_TAX, OperationType.OPERATION_TYPE_OVERNIGHT]:
+    #     continue
+    elif tickers[figi]['type'] == 'currency':
+        # Currency conversion
+        ticker = tickers[figi]['nominal_currency']
+        name = tickers[figi]['name']
+        asset_type = tickers[figi]['type']
+    else:
+        ticker = tickers[figi]['ticker']
+        name = tickers[figi]['name']
+        asset_type = tickers[figi]['type']
+    return name, ticker, asset_type
+
+
+def get_trades_list(trades: list) -> list:
+    return [{'price': mv2str(tr.price),
+             'quantity': tr.quantity,
+             'currency' : tr.price.currency.upper()
+             }
+            for tr in trades]
+
+
+def get_operation_item(op, tickers: dict) -> dict:
+    ''' Operation from cursor API (OperationItem)
+        Instruments of operations are looked up before (see download) - operation of unknown
+        instrument fails the account, so it isn't stored and its operations are downloaded again
+    '''
+    try:
+        name, ticker, asset_type = get_asset(op.figi, op.payment.currency, tickers)
+    except KeyError:
+        raise KeyError('Instrument {} of operation {} is unknown'.format(op.figi, op.id)) from None
+    oper_dict = {'date': str(op.date.date()),
+                'id': op.id,
+                'parent_id': op.parent_operation_id,
+                'label' : op.name,
+                'type': op.type,
+                'figi': op.figi,
+                'name': name,
+                'ticker': ticker,
+                'asset type': asset_type,
+                'payment': mv2str(op.payment),
+                'payment_currency' : op.payment.currency.upper()
+                }
+    if op.trades_info and len(op.trades_info.trades) != 0:
+        oper_dict['trades'] = get_trades_list(op.trades_info.trades)
+    return oper_dict
+
+
+def get_account(acc, positions: PositionsResponse, items, tickers: dict, stored: dict) -> dict:
+    ''' Account's data with operations downloaded (items) - they are converted lazily, as the
+        operations are written (see download)
+        last_operation - time of the latest operation, next download starts OVERLAP before it
+    '''
+    last = max((item.date for item in items), default=None)
+    return {'statement_date': datetime.datetime.now().date(),
+            'opened_date': acc.opened_date.date(),
+            'closed_date' : acc.closed_date.date(),
+            'type' : acc.type,
+            'status' : acc.status,
+            'cash': get_positions_cash(positions, tickers),
+            'securities': get_positions_securities(positions, tickers),
+            'operations': (get_operation_item(item, tickers) for item in items),
+            'last_operation': last.isoformat() if last else stored.get('last_operation')
+            }
+
+
+def start_date(acc, stored: dict) -> datetime.datetime:
+    ''' Time from which operations are downloaded: OVERLAP before the latest stored operation
+        or opening of the account
+    '''
+    if stored.get('last_operation'):
+        return max(datetime.datetime.fromisoformat(stored['last_operation']) - OVERLAP, acc.opened_date)
+    return acc.opened_date
+
+
+async def limited(semaphore: asyncio.Semaphore, limiter: ratelimit.RateLimiter, method, **kwargs):
+    ''' Call API method when there are less than limit of calls in progress and
+        the rate limiter lets it through (failed calls are retried by limiter)
+    '''
+    async with semaphore:
+        return await limiter.call(method, **kwargs)
+
+
+async def get_operation_items(client, semaphore: asyncio.Semaphore, limiter: ratelimit.RateLimiter,
+                              account_id: str, from_: datetime.datetime, to: datetime.datetime) -> list:
+    ''' Executed operations of the account in the period - page by page with cursor API
+    '''
+    items = []
+    cursor = ''
+    while True:
+        resp = await limited(semaphore, limiter, client.operations.get_operations_by_cursor,
+                             request=GetOperationsByCursorRequest(
+                                 account_id=account_id,
+                                 from_=from_,
+                                 to=to,
+                                 cursor=cursor,
+                                 limit=PAGE_SIZE,
+                                 state=OperationState.OPERATION_STATE_EXECUTED))
+        items += resp.items
+        if not resp.has_next:
+            return items
+        cursor = resp.next_cursor
+
+
+def windows(from_: datetime.datetime, to: datetime.datetime, size: datetime.timedelta) -> list:
+    ''' Period split into windows of size: [(start, end), ...]
+        Windows start at from_ - they are the same in the next download (except the last one)
+    '''
+    result = []
+    start = from_
+    while start < to:
+        result.append((start, min(start + size, to)))
+        start += size
+    return result or [(from_, to)]
+
+
+def stitch(parts):
+    ''' Operations of consecutive windows (iterable of lists) sorted by time - yielded window
+        by window. Operations at boundaries of windows are returned by both of them, they are
+        dropped by id (only ids of the previous window are kept).
+    '''
+    previous = set() # ids of the previous window
+    for part in parts:
+        ids = set()
+        for item in sorted(part, key=lambda item: (item.date, item.id)):
+            if item.id and item.id in previous:
+                continue
+            ids.add(item.id)
+            yield item
+        previous = ids
+
+
+class Checkpoints:
+    ''' Windows of history downloaded already - stored in folder, so interrupted download
+        continues from them
+    '''
+
+    def __init__(self, folder: str):
+        self.folder = folder
+
+    def path(self, account_id: str, start: datetime.datetime, end: datetime.datetime) -> str:
+        return os.path.join(self.folder, '{}-{:%Y%m%d%H%M%S}-{:%Y%m%d%H%M%S}.pickle'.format(account_id, start, end))
+
+    def exists(self, account_id, start, end) -> bool:
+        return os.path.exists(self.path(account_id, start, end))
+
+    def load(self, account_id, start, end):
+        ''' Operations of the window - None if it isn't downloaded
+        '''
         try:
-            if op.figi == '':
-                # Cash operations
-                name = ticker = op.currency.upper()  # use operation's currency as ticker
-                asset_type = 'cash'
-            # elif op.figi == 'TCS007288411':
-            #     op.figi = 'BBG004731489'
-            #     ticker = 'GMKN'
-            # elif op.operation_type in [OperationType.OPERATION_TYPE_DIVIDEND_TAX, OperationType.OPERATION_TYPE_OVERNIGHT]:
-            #     continue
-            elif tickers[op.figi]['type'] == 'currency':
-                # Currency conversion
-                ticker = tickers[op.figi]['nominal_currency']
-                name = tickers[op.figi]['name']
-                asset_type = tickers[op.figi]['type']
-            else:
-                ticker = tickers[op.figi]['ticker']
-                name = tickers[op.figi]['name']
-                asset_type = tickers[op.figi]['type']
-        
-            oper_dict = {'date': str(op.date.date()),
-                        'id': op.id,
-                        'parent_id': op.parent_operation_id,
-                        'label' : op.type,
-                        'type': op.operation_type,
-                        'figi': op.figi,
-                        'name': name,
-                        'ticker': ticker,
-                        'asset type': asset_type,
-                        'payment': mv2str(op.payment), 
-                        'payment_currency' : op.currency.upper()
-                        }
-        except KeyError:
-            print(op)
-
-        if len(op.trades) != 0:
-            trades = list()
-            for tr in op.trades:
-                trades.append(
-                                {'price': mv2str(tr.price),
-                                'quantity': tr.quantity,
-                                'currency' : tr.price.currency.upper()
-                                }
-                            )
-            result.append(oper_dict | {'trades': trades})
-        else:
-        # no trades in operations
-            result.append(oper_dict)
-
-    return result
-
-
-configParser = configparser.RawConfigParser()
-configFilePath = r'tcsdownload.cfg'
-configParser.read(configFilePath)
-
-token = configParser.get('tcsinvest', 'token')
-output = configParser.get('tcsinvest', 'output')
-
-result = {}
-#client = Client(token)
-with Client(token) as client:
-    #print(client.instruments.currencies(instrument_status = InstrumentStatus.INSTRUMENT_STATUS_ALL).instruments)
-    tickers = (get_tickers_list(client.instruments.shares(instrument_status = InstrumentStatus.INSTRUMENT_STATUS_ALL).instruments, 'share') |
-               get_tickers_list(client.instruments.bonds(instrument_status = InstrumentStatus.INSTRUMENT_STATUS_ALL).instruments, 'bond') |
-               get_tickers_list(client.instruments.etfs(instrument_status = InstrumentStatus.INSTRUMENT_STATUS_ALL).instruments, 'etf') |
-               get_tickers_list(client.instruments.currencies(instrument_status = InstrumentStatus.INSTRUMENT_STATUS_ALL).instruments, 'currency'))
-    accounts = client.users.get_accounts().accounts
-    for acc in accounts:
-        if acc.access_level == AccessLevel.ACCOUNT_ACCESS_LEVEL_NO_ACCESS:
-            continue
-        positions = client.operations.get_positions(account_id=acc.id)
-        positions_dict = get_positions_securities(positions, tickers)
-        cash_dict = get_positions_cash(positions, tickers)
-        resp = client.operations.get_operations(account_id=acc.id,
-                                                from_=acc.opened_date,
-                                                to=datetime.datetime.now(),
-                                                state=OperationState.OPERATION_STATE_EXECUTED)
-        result |= {acc.id: {'statement_date': datetime.datetime.now().date(),
-                            'opened_date': acc.opened_date.date(),
-                            'closed_date' : acc.closed_date.date(),
-                            'type' : acc.type,
-                            'status' : acc.status,
-                            'cash': cash_dict,
-                            'securities': positions_dict,
-                            'operations': get_operations_list(resp, tickers)
-                            }
-                   }
-
-with open(output, "w") as f:
-    json.dump(result, f, indent=4, default=str)
-with open("tickers.json", "w") as f:
-    json.dump(tickers, f, indent=4, default=str)
+            with open(self.path(account_id, start, end), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, account_id, start, end, items: list):
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.path(account_id, start, end)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(items, f)
+        os.replace(path + '.tmp', path) # window is never left half written
+
+    def clear(self):
+        ''' Drop all windows - download is complete
+        '''
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+class Stitched:
+    ''' Operations of the account's windows stitched from checkpoints - each iteration reads
+        them again one window at a time, so history is never in memory as a whole
+    '''
+
+    def __init__(self, checkpoints: Checkpoints, account_id: str, parts: list):
+        self.checkpoints = checkpoints
+        self.account_id = account_id
+        self.parts = parts
+
+    def __iter__(self):
+        return stitch(self.checkpoints.load(self.account_id, start, end) for start, end in self.parts)
+
+
+async def backfill(client, semaphore: asyncio.Semaphore, limiter: ratelimit.RateLimiter,
+                   account_id: str, from_: datetime.datetime, to: datetime.datetime,
+                   window: datetime.timedelta, checkpoints: Checkpoints,
+                   parallel: int = CONCURRENCY) -> Stitched:
+    ''' Same as get_operation_items with period split into windows downloaded in parallel
+        No more than parallel windows are downloaded at once, each window is stored in
+        checkpoints as soon as it's downloaded. Operations are read from checkpoints as
+        they are iterated (see Stitched) - checkpoints are to be kept until then.
+    '''
+    parts = windows(from_, to, window)
+    pending = iter(parts) # shared by workers - next window is taken by the first free worker
+
+    async def worker():
+        for start, end in pending:
+            if not checkpoints.exists(account_id, start, end):
+                items = await get_operation_items(client, semaphore, limiter, account_id, start, end)
+                checkpoints.save(account_id, start, end, items)
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(min(parallel, len(parts)))]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel() # the rest of windows isn't needed if one of them failed
+    return Stitched(checkpoints, account_id, parts)
+
+
+async def download(token: str, target: str = None, concurrency: int = CONCURRENCY, history: dict = None,
+                   tickers: instruments.InstrumentCache = None, refresh: bool = False,
+                   rate: float = ratelimit.RATE, store=None, window: datetime.timedelta = None,
+                   checkpoints: Checkpoints = None):
+    ''' Download accounts' positions and operations and their instruments
+        All calls are issued at once (no more than concurrency calls in progress):
+        positions and operations of accounts as soon as accounts are known, instruments
+        referenced by them as soon as they are known.
+        target: API server (host:port) - default is Tinkoff Invest API
+        rate: initial calls per second - adapted to API limits (see rufinlib.ratelimit)
+        history: accounts' data downloaded before - only newer operations are downloaded
+        tickers: cache of instruments - only instruments missing in it (all instruments in use
+                 if it's outdated or refresh is asked) are looked up by FIGI
+        store: function(account_id, account) called as soon as account is downloaded -
+               accounts aren't kept in result then
+        window: operations are downloaded by windows of this size in parallel (see backfill),
+                with checkpoints windows downloaded before are taken from them (without
+                checkpoints windows are kept in temporary folder until the download ends)
+        Out: accounts' data, tickers
+    '''
+    history = history or {}
+    tickers = tickers if tickers is not None else instruments.InstrumentCache()
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = ratelimit.RateLimiter(rate)
+    if refresh:
+        tickers.expire()
+    async with AsyncClient(token, target=target) as client:
+
+        lookups = {} # FIGI: task - instrument is looked up once for all accounts
+
+        def lookup(figi):
+            if figi not in lookups:
+                lookups[figi] = asyncio.ensure_future(instruments.lookup_async(
+                    client, figi, functools.partial(limited, semaphore, limiter)))
+            return lookups[figi]
+
+        async def get(acc):
+            stored = history.get(acc.id, {})
+            positions, items = await asyncio.gather(
+                limited(semaphore, limiter, client.operations.get_positions, account_id=acc.id),
+                backfill(client, semaphore, limiter, acc.id, start_date(acc, stored), now, window, checkpoints,
+                         concurrency)
+                if window else
+                get_operation_items(client, semaphore, limiter, acc.id, start_date(acc, stored), now))
+            # look up instruments of the account which aren't in the cache
+            missing = tickers.missing({i.figi for i in positions.securities} | {item.figi for item in items})
+            for figi, instrument in zip(missing, await asyncio.gather(*[lookup(figi) for figi in missing])):
+                tickers.add(figi, instrument)
+            account = get_account(acc, positions, items, tickers, stored)
+            if store is None:
+                # whole history is kept in result - stored operations are updated with new ones
+                account['operations'] = jsonl.merge_operations(stored.get('operations', []), account['operations'])
+                return account
+            store(acc.id, account) # operations are streamed to the output
+            return None
+
+        accounts = [acc for acc in (await limited(semaphore, limiter, client.users.get_accounts)).accounts
+                    if acc.access_level != AccessLevel.ACCOUNT_ACCESS_LEVEL_NO_ACCESS]
+        now = datetime.datetime.now(datetime.timezone.utc)
+        temporary = window is not None and checkpoints is None
+        if temporary:
+            checkpoints = Checkpoints(tempfile.mkdtemp(prefix='tcsdownload-'))
+        try:
+            downloaded = await asyncio.gather(*[get(acc) for acc in accounts])
+        finally:
+            if temporary:
+                checkpoints.clear() # operations of accounts are written or kept in result already
+
+    result = {} if store else dict(history) # accounts which are not available now are kept as they were
+    for acc, account in zip(accounts, downloaded):
+        if account is not None:
+            result[acc.id] = account
+    return result, tickers
+
+
+def main():
+    configParser = configparser.RawConfigParser()
+    configFilePath = r'tcsdownload.cfg'
+    configParser.read(configFilePath)
+
+    token = configParser.get('tcsinvest', 'token')
+    output = configParser.get('tcsinvest', 'output')
+    target = configParser.get('tcsinvest', 'target', fallback=None)
+    concurrency = configParser.getint('tcsinvest', 'concurrency', fallback=CONCURRENCY)
+    tickers = instruments.InstrumentCache(
+        configParser.get('tcsinvest', 'instruments', fallback=instruments.FILENAME),
+        datetime.timedelta(hours=configParser.getfloat('tcsinvest', 'instruments_ttl',
+                                                       fallback=instruments.TTL.total_seconds() / 3600)))
+    rate = configParser.getfloat('tcsinvest', 'rate', fallback=ratelimit.RATE)
+    refresh = '--refresh' in sys.argv[1:] # look up instruments in use even if cache is fresh
+    # history is downloaded by windows of days in parallel, downloaded windows are kept until
+    # output is written - interrupted download continues from them
+    window = configParser.getfloat('tcsinvest', 'window', fallback=None)
+    window = datetime.timedelta(days=window) if window else None
+    checkpoints = Checkpoints(configParser.get('tcsinvest', 'checkpoints', fallback=output + CHECKPOINTS))
+
+    if output.endswith('.jsonl'):
+        # line-delimited output: accounts are appended as soon as they are downloaded,
+        # only headers of accounts are read to know where downloads stopped
+        history = jsonl.headers(output) if os.path.exists(output) else {}
+        with open(output, 'a', encoding='utf-8') as f:
+            _, tickers = asyncio.run(download(token, target, concurrency, history, tickers, refresh, rate,
+                                              store=lambda account_id, account: jsonl.write_account(f, account_id, account),
+                                              window=window, checkpoints=checkpoints))
+        tickers.save()
+        checkpoints.clear()
+        return
+
+    # operations downloaded before are kept in output - only new ones are downloaded
+    history = {}
+    if os.path.exists(output):
+        with open(output) as f:
+            history = json.load(f)
+
+    result, tickers = asyncio.run(download(token, target, concurrency, history, tickers, refresh, rate,
+                                           window=window, checkpoints=checkpoints))
+
+    with open(output, "w") as f:
+        json.dump(result, f, indent=4, default=str)
+    tickers.save()
+    checkpoints.clear()
+
+
+if __name__ == '__main__':
+    main()
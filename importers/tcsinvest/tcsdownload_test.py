@@ -0,0 +1,203 @@
+import os
+import glob
+import types
+import asyncio
+import datetime
+import tempfile
+import unittest
+from unittest import mock
+
+from ..rufinlib import ratelimit
+
+try:
+    import grpc
+    from tinkoff.invest import MoneyValue, OperationType, RequestError
+    from . import tcsdownload
+except ImportError:
+    tcsdownload = None
+
+NS = types.SimpleNamespace
+OPENED = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def money(units):
+    return MoneyValue(currency='rub', units=units, nano=0)
+
+
+class Calls:
+    ''' Calls of fake client in progress - the most at the same time is kept
+    '''
+
+    def __init__(self):
+        self.current = 0
+        self.most = 0
+        self.log = []
+
+    async def __call__(self, name, result, delay=0.01):
+        self.log.append(name)
+        self.current += 1
+        self.most = max(self.most, self.current)
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self.current -= 1
+        return result
+
+
+class FakeAsyncClient:
+    ''' AsyncClient with accounts of one share each - operations come in pages of two,
+        positions of account '1' fail once with rate limit error
+    '''
+    calls = None
+    accounts = 5
+
+    def __init__(self, token, target=None):
+        self.target = target
+        calls = self.calls
+        limited = []
+
+        async def get_accounts():
+            return await calls('get_accounts', NS(accounts=[
+                NS(id=str(i), opened_date=OPENED, closed_date=OPENED, type=1, status=1, access_level=1)
+                for i in range(self.accounts)]))
+
+        async def get_positions(account_id):
+            if account_id == '1' and not limited:
+                limited.append(account_id)
+                raise RequestError(grpc.StatusCode.RESOURCE_EXHAUSTED, 'limit', NS(ratelimit_reset=0))
+            return await calls('get_positions', NS(securities=[NS(figi='FIGI' + account_id, balance=1)],
+                                                   money=[money(100)]))
+
+        async def get_operations_by_cursor(request):
+            page = int(request.cursor or 0)
+            # both ends of the period are included - windows overlap at their boundaries
+            items = [item for item in [NS(id='{}-{}'.format(request.account_id, k), parent_operation_id='', name='Покупка',
+                        type=OperationType.OPERATION_TYPE_BUY, figi='FIGI' + request.account_id,
+                        payment=money(-10), date=OPENED + datetime.timedelta(days=365 * k),
+                        trades_info=NS(trades=[NS(price=money(10), quantity=1)]))
+                     for k in (2 * page, 2 * page + 1)] if request.from_ <= item.date <= request.to]
+            return await calls('get_operations_by_cursor', NS(items=items, has_next=page == 0, next_cursor='1'))
+
+        async def get_instrument_by(id_type, id):
+            return await calls('get_instrument_by', NS(instrument=NS(instrument_type='share')))
+
+        async def share_by(id_type, id):
+            return await calls('share_by', NS(instrument=NS(name=id, isin='', ticker='T' + id, lot=1,
+                                                            currency='rub', nominal=money(1))))
+
+        self.users = NS(get_accounts=get_accounts)
+        self.operations = NS(get_positions=get_positions, get_operations_by_cursor=get_operations_by_cursor)
+        self.instruments = NS(get_instrument_by=get_instrument_by, share_by=share_by)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class RecordingLimiter(ratelimit.RateLimiter):
+    ''' Rate limiter which counts calls let through and rate limit errors - its rate is
+        high enough not to delay calls of the tests
+    '''
+    instances = []
+
+    def __init__(self, rate, **kwargs):
+        super().__init__(rate, burst=100, max_rate=rate, **kwargs)
+        self.reserved = 0
+        self.limits = 0
+        self.instances.append(self)
+
+    def reserve(self):
+        self.reserved += 1
+        return super().reserve()
+
+    def limited(self, reset=None):
+        self.limits += 1
+        super().limited(reset)
+
+
+@unittest.skipIf(tcsdownload is None, 'tinkoff.invest is not installed')
+class TestDownload(unittest.TestCase):
+
+    def setUp(self):
+        FakeAsyncClient.calls = self.calls = Calls()
+        RecordingLimiter.instances.clear()
+        patches = [mock.patch.object(tcsdownload, 'AsyncClient', FakeAsyncClient),
+                   mock.patch.object(ratelimit, 'RateLimiter', RecordingLimiter),
+                   mock.patch.object(ratelimit, 'BACKOFF', 0)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def download(self, concurrency, **kwargs):
+        return asyncio.run(tcsdownload.download('token', 'localhost:50051', concurrency, rate=1000, **kwargs))
+
+    def test_concurrency(self):
+        result, tickers = self.download(3)
+        # calls of all accounts are issued at once, but no more than 3 are in progress
+        self.assertEqual(self.calls.most, 3)
+        self.assertEqual(sorted(result), ['0', '1', '2', '3', '4'])
+        self.assertEqual([oper['id'] for oper in result['2']['operations']], ['2-0', '2-1', '2-2', '2-3'])
+        self.assertEqual(result['2']['securities'], {'TFIGI2': 1})
+        # instruments are looked up once each
+        self.assertEqual(self.calls.log.count('share_by'), 5)
+        self.assertEqual(len(tickers.instruments), 5)
+
+    def test_rate_limit_retry(self):
+        result, _ = self.download(8)
+        limiter, = RecordingLimiter.instances
+        # rate limit error of positions of account '1' went through the limiter and was retried
+        self.assertEqual(limiter.limits, 1)
+        self.assertEqual(limiter.reserved, len(self.calls.log) + 1)
+        self.assertEqual(self.calls.log.count('get_positions'), 5)
+        self.assertEqual(result['1']['cash'], {'RUB': '100'})
+
+    def test_store(self):
+        stored = {}
+        result, _ = self.download(2, store=stored.__setitem__)
+        self.assertEqual(result, {})
+        self.assertEqual(sorted(stored), ['0', '1', '2', '3', '4'])
+        self.assertLessEqual(self.calls.most, 2)
+
+    def test_window(self):
+        stored = {}
+
+        def store(account_id, account):
+            self.assertNotIsInstance(account['operations'], list) # streamed from checkpoints
+            stored[account_id] = [oper['id'] for oper in account['operations']]
+
+        before = set(glob.glob(os.path.join(tempfile.gettempdir(), 'tcsdownload-*')))
+        self.download(4, store=store, window=datetime.timedelta(days=365))
+        self.assertEqual(stored['3'], ['3-0', '3-1', '3-2', '3-3'])
+        # windows were kept in temporary folder until accounts were written
+        self.assertEqual(set(glob.glob(os.path.join(tempfile.gettempdir(), 'tcsdownload-*'))), before)
+        result, _ = self.download(4, window=datetime.timedelta(days=365))
+        self.assertEqual([oper['id'] for oper in result['3']['operations']], ['3-0', '3-1', '3-2', '3-3'])
+
+    def test_overlap(self):
+        last = OPENED + datetime.timedelta(days=365 * 3 + 3)
+        stored = [{'id': '2-0', 'date': '2021-01-01'}, {'id': '2-3', 'date': '2023-12-31'}]
+        history = {'2': {'last_operation': last.isoformat(), 'operations': stored}}
+        result, _ = self.download(4, history=history)
+        # operations shortly before the latest stored one are downloaded again - merged by id
+        self.assertEqual([oper['id'] for oper in result['2']['operations']], ['2-0', '2-3'])
+        self.assertEqual(tcsdownload.start_date(NS(opened_date=OPENED), history['2']), last - tcsdownload.OVERLAP)
+        self.assertEqual(tcsdownload.start_date(NS(opened_date=last), history['2']), last)
+
+    def test_stitch(self):
+        read = []
+
+        def parts():
+            for part in [[NS(id='2', date=2), NS(id='1', date=1)], [NS(id='2', date=2), NS(id='3', date=3)]]:
+                read.append(part)
+                yield part
+
+        items = tcsdownload.stitch(parts())
+        self.assertEqual(next(items).id, '1')
+        self.assertEqual(len(read), 1) # windows are read as operations are taken
+        self.assertEqual([item.id for item in items], ['2', '3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,6 @@
-''' Importer for VTB broker - broker reports from XML files
+''' Importer for Tinkoff Invest broker - operations downloaded from Tinkoff Invest API
+    Accounts are fetched in parallel, their balances are taken from JSON file given to bean-extract.
+    API responses may be recorded to cassette and replayed (see rufinlib.cassette).
     TODO: chcp 65001 & set PYTHONIOENCODING=utf-8
 '''
 import datetime
@@ -7,8 +9,9 @@ import re
 import os
 import pickle
 import json
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 
-from dateutil.parser import parse
 from rich import print
 
 from decimal import *
@@ -22,7 +25,21 @@ from beancount.ingest import importer
 
 from tinkoff.invest import Client, OperationState, OperationType, MoneyValue
 
-NOCOST = position.CostSpec(None, None, None, None, None, None)
+from ..rufinlib import cassette
+from ..rufinlib import compact
+from ..rufinlib import context
+from ..rufinlib import dates
+from ..rufinlib import decimals
+from ..rufinlib import dedup
+from ..rufinlib import directives
+from ..rufinlib import fills
+from ..rufinlib import ratelimit
+from ..rufinlib import watermark
+from . import instruments
+
+NOCOST = directives.NOCOST
+# operations which may be aggregated into summary transactions (compact mode)
+COMPACT_TYPES = (OperationType.OPERATION_TYPE_BROKER_FEE, OperationType.OPERATION_TYPE_OVERNIGHT)
 
 class Importer(importer.ImporterProtocol):
     '''An importer for Tinkoff Invest broker API'''
@@ -39,7 +56,16 @@ class Importer(importer.ImporterProtocol):
                  account_repo = None,
                  balance = True, 
                  token = None,
-                 start_date = None):
+                 start_date = None,
+                 watermark = None,
+                 compact = None,
+                 merge_fills = None,
+                 instruments = instruments.FILENAME,
+                 instruments_ttl = instruments.TTL,
+                 workers = 4,
+                 cassette = None,
+                 cassette_mode = None,
+                 target = None):
         self.general_agreement_id = general_agreement_id
         self.account_root = account_root
         self.account_cash = account_cash
@@ -48,14 +74,22 @@ class Importer(importer.ImporterProtocol):
         self.account_interest = account_interest
         self.account_fees = account_fees
         self.account_gains = account_gains
+        self.accounts = directives.Accounts(account_root, account_gains)
         self.account_external = account_external
         self.balance = balance
         self.token = token
         self.start_date = start_date
+        self.watermark = watermark # file with watermarks - skip already imported operations
+        self.compact = compact # 'daily' or 'monthly' - aggregate fees and overnight into summary transactions
+        self.merge_fills = merge_fills # 'price' or 'vwap' - merge fills of order into fewer postings (see fills)
+        self.instruments = instruments # file with cache of instruments (shared with tcsdownload)
+        self.instruments_ttl = instruments_ttl # look up instruments in use again if cache is older
+        self.workers = workers # accounts fetched in parallel
+        self.cassette = cassette # file to record API responses to and replay them from (see rufinlib.cassette)
+        self.cassette_mode = cassette_mode # 'record' or 'replay' - default is replay if the cassette exists
+        self.target = target # API server (host:port) - default is Tinkoff Invest API (see standin for load tests)
         self.account_repo = account_repo if account_repo else account_fees
 
-        self.assets = None
-
     def identify(self, file):
         ''' Match if the file is broker report from VTB Broker
         '''
@@ -76,59 +110,85 @@ class Importer(importer.ImporterProtocol):
         # No report creation date - use file creation date instead
         return None
 
-    def extract(self, file):
+    def extract(self, file, existing_entries=None):
         ''' Connect to Tinkoff API and download all data
+            Operations with ids which are in the ledger (existing_entries) are dropped
         '''
         entries = []
         acc = None
         # with open("assets.pickle", "rb") as f:
-        #     self.assets = pickle.load(f)
+        #     assets = pickle.load(f)
         # with open("accounts.pickle", "rb") as f:
         #         acc = pickle.load(f)
         
         # client = None
-        with Client(self.token) as client:
-            self.assets = (self.get_list_structure(client.instruments.shares().instruments, 'share') |
-                            self.get_list_structure(client.instruments.bonds().instruments, 'bond') |
-                            self.get_list_structure(client.instruments.etfs().instruments, 'etf') |
-                            self.get_list_structure(client.instruments.currencies().instruments, 'currency')
-                        )
-        #     with open("assets.pickle", "wb") as f:
-        #         pickle.dump(self.assets, f)            
-            acc = client.users.get_accounts()
+        tape = cassette.Cassette(self.cassette, self.cassette_mode) if self.cassette else None
+        replay = tape is not None and tape.replaying
+        # no connection to API when recorded responses are replayed
+        with contextlib.nullcontext() if replay else Client(self.token, target=self.target) as client:
+            if tape:
+                client = tape.wrap(client)
+            if replay:
+                # instruments used by recorded extraction are replayed as well - local cache isn't read
+                assets = instruments.InstrumentCache(None)
+                for figi, instrument in tape.recorded('instruments').items():
+                    assets.add(figi, instrument)
+            else:
+                assets = instruments.InstrumentCache(self.instruments, self.instruments_ttl)
+            ctx = context.ExtractContext(file, assets=assets, compactable=[],
+                                         limiter=ratelimit.NoLimit() if replay else ratelimit.RateLimiter())
+            acc = ctx.limiter.call_sync(client.users.get_accounts)
             # with open("accounts.pickle", "wb") as f:
             #     pickle.dump(acc, f)
 
-            for a in acc.accounts:
-                entries += self.get_oper(file, client, a)
-                entries += self.get_balances(file, a)
+            # accounts are fetched in parallel - calls are limited by ctx.limiter
+            with ThreadPoolExecutor(self.workers) as pool:
+                for account_entries in pool.map(lambda a: self.get_account(ctx, client, a), acc.accounts):
+                    entries += account_entries
+            assets.save()
+            if tape and not replay:
+                tape.record('instruments', {figi: assets[figi] for figi in assets.used})
+                tape.save()
         
+        # known operations are dropped before compaction - summary has only new ones
+        entries += compact.compact(dedup.filter_known(ctx.compactable, existing_entries,
+                                                      self.account_root, self.account_cash),
+                                   self.compact)
+        return dedup.filter_known(entries, existing_entries, self.account_root, self.account_cash)
+
+    def get_account(self, ctx, client, acc):
+        ''' Operations and balances of the account
+        '''
+        wm = watermark.Watermark(self.watermark, '{} {}'.format(self.account_root, acc.id))
+        entries = self.get_oper(ctx, client, acc, wm)
+        entries += self.get_balances(ctx, acc)
+        wm.save()
         return entries
 
-    def get_balances(self, file, acc):
+    def get_balances(self, ctx, acc):
         result = []
-        with open(file.name) as f:
+        with open(ctx.file.name) as f:
             balances = json.load(f)[acc.id]
             for currency, amt in balances['cash'].items():
-                amt_d = amount.Amount(D(amt), currency)
-                meta = data.new_metadata(file.name, 1) # TODO decide what to do with line number in meta
+                amt_d = directives.amount(D(amt), currency)
+                meta = directives.new_metadata(ctx.file.name, 1) # TODO decide what to do with line number in meta
                 result.append(
                     data.Balance(
                                 meta, 
-                                parse(balances['date']).date() + datetime.timedelta(days=1),
+                                dates.to_date(balances['date']) + datetime.timedelta(days=1),
                                 self.account_cash,
                                 amt_d,
                                 None, None
                                 )
                             )
             for ticker, amt in balances['securities'].items():
-                amt_d = amount.Amount(D(amt), ticker)
-                meta = data.new_metadata(file.name, 1) # TODO decide what to do with line number in meta
+                amt_d = directives.amount(D(amt), ticker)
+                meta = directives.new_metadata(ctx.file.name, 1) # TODO decide what to do with line number in meta
                 result.append(
                     data.Balance(
                                 meta, 
-                                parse(balances['date']).date() + datetime.timedelta(days=1),
-                                account.join(self.account_root, ticker),
+                                dates.to_date(balances['date']) + datetime.timedelta(days=1),
+                                self.accounts.instrument(ticker),
                                 amt_d,
                                 None, None
                                 )
@@ -136,41 +196,54 @@ class Importer(importer.ImporterProtocol):
         return result
 
 
-    def get_oper(self, file, client, acc):
-        '''
+    def get_oper(self, ctx, client, acc, wm):
+        ''' wm: watermark of the account - operations imported already are skipped
         '''
         entries = []
         resp = None
                 
-        start_date = self.start_date if self.start_date else acc.opened_date
+        # start_date of config may be date or naive datetime - API works with UTC times
+        start_date = dates.utc_time(self.start_date if self.start_date else acc.opened_date)
+        if wm.start and dates.utc_time(wm.start) > start_date:
+            start_date = dates.utc_time(wm.start) # older operations were imported already
         if client:
-            resp = client.operations.get_operations(account_id=acc.id,
-                                                from_=start_date,
-                                                to=datetime.datetime.now(),
-                                                state=OperationState.OPERATION_STATE_EXECUTED)
+            resp = ctx.limiter.call_sync(client.operations.get_operations,
+                                         account_id=acc.id,
+                                         from_=start_date,
+                                         to=datetime.datetime.now(datetime.timezone.utc),
+                                         state=OperationState.OPERATION_STATE_EXECUTED)
         else:
             with open("operations.pickle", "rb") as f:
                 resp = pickle.load(f)
         # with open("operations.pickle", "wb") as f:
         #         pickle.dump(resp, f)
+        # look up instruments of the account's deals at once - only those which aren't in the cache
+        if client:
+            ctx.assets.resolve(client, [trn.figi for trn in resp.operations
+                                        if trn.operation_type in [OperationType.OPERATION_TYPE_BUY,
+                                                                  OperationType.OPERATION_TYPE_SELL]],
+                               ctx.limiter.call_sync)
         for trn in resp.operations:
             #import IPython; IPython.embed()
             delivery_date = trn.date.date() #date of execution of transaction
             deal_code = trn.id
-            meta = data.new_metadata(file.name, 1) # TODO: check if it's convenient and adjust if necessary
+            if wm.skip(delivery_date, deal_code, (trn.operation_type, trn.figi, decimals.mv2str(trn.payment))):
+                continue # imported already
+            meta = directives.new_metadata(ctx.file.name, 1) # TODO: check if it's convenient and adjust if necessary
             if trn.operation_type in [OperationType.OPERATION_TYPE_BUY, OperationType.OPERATION_TYPE_SELL]:
-                asset_type = self.assets[trn.figi]['type']
+                asset = ctx.assets.get(client, trn.figi)
+                asset_type = asset['type']
                 sign = -1 if trn.operation_type == OperationType.OPERATION_TYPE_SELL else 1
                 if asset_type == 'currency':
-                    ticker = self.assets[trn.figi]['nominal'].currency.upper()
+                    ticker = asset['nominal_currency']
                     account_inst = self.account_cash
                 else:
-                    ticker = self.assets[trn.figi]['ticker']
-                    account_inst = account.join(self.account_root, ticker)
-                readable_name = self.assets[trn.figi]['name']
+                    ticker = asset['ticker']
+                    account_inst = self.accounts.instrument(ticker)
+                readable_name = asset['name']
                 # cash leg of the transaction
-                payment = Decimal(-sign)*abs(self.mv2d(trn.payment))
-                payment_amt = amount.Amount(payment, trn.payment.currency.upper())
+                payment = Decimal(-sign)*abs(decimals.mv2money(trn.payment))
+                payment_amt = directives.amount(payment, trn.payment.currency.upper())
                 p1 = data.Posting(account = self.account_cash, 
                         units = payment_amt, 
                         cost = None, 
@@ -179,38 +252,41 @@ class Importer(importer.ImporterProtocol):
                 txn = [p1]
                 if asset_type == 'bond' or (trn.operation_type == OperationType.OPERATION_TYPE_SELL and asset_type != 'currency'):
                     # add leg for NKD or sell operation
-                    p = data.Posting(account = self.account_gains.format(ticker), 
+                    p = data.Posting(account = self.accounts.gains(ticker), 
                             units = None, 
                             cost = None, 
                             price = None, 
                             flag = None, meta = None)
                     txn.append(p)
-                for trade in trn.trades:
-                    amt = amount.Amount(sign*Decimal(trade.quantity), ticker)
-                    paym_d = self.mv2d(trade.price)
+                trades = fills.merge([(Decimal(trade.quantity), self.mv2d(trade.price), trade.price.currency.upper())
+                                      for trade in trn.trades], self.merge_fills)
+                for trade in trades:
+                    amt = directives.amount(sign*trade.quantity, ticker)
+                    paym_d = trade.price
                     if trn.operation_type == OperationType.OPERATION_TYPE_SELL:
-                        payment = amount.Amount(paym_d, trade.price.currency.upper())
+                        payment = directives.amount(paym_d, trade.currency)
                         if asset_type == 'currency':
                             p = data.Posting(account = account_inst, 
                                     units = amt, 
                                     cost = None, 
                                     price = payment, 
-                                    flag = None, meta = None)    
+                                    flag = None, meta = trade.meta)    
                         else:
                             # asset leg of the transaction
                             p = data.Posting(account = account_inst, 
                                     units = amt, 
                                     cost = NOCOST, 
                                     price = payment, 
-                                    flag = None, meta = None)
+                                    flag = None, meta = trade.meta)
                         txn.append(p)
                     else:
                         # TODO: currency buy?
                         # cost of the transaction
+                        # (total cost for fills collapsed at weighted price - it's exact)
                         cost_bnc = position.CostSpec(
-                            number_per=paym_d,
-                            number_total=None,
-                            currency=trade.price.currency.upper(),
+                            number_per=Decimal(0) if trade.meta else paym_d,
+                            number_total=trade.total if trade.meta else None,
+                            currency=trade.currency,
                             date=None,
                             label=None,
                             merge=False)
@@ -219,7 +295,7 @@ class Importer(importer.ImporterProtocol):
                                     units = amt, 
                                     cost = cost_bnc, 
                                     price = None, 
-                                    flag = None, meta = None)
+                                    flag = None, meta = trade.meta)
                         # TODO: we're buying currency here!
                         if account_inst == self.account_cash:
                             print(trn)
@@ -234,8 +310,8 @@ class Importer(importer.ImporterProtocol):
                                         OperationType.OPERATION_TYPE_INPUT, 
                                         OperationType.OPERATION_TYPE_OVERNIGHT,
                                         OperationType.OPERATION_TYPE_TAX]:
-                payment = amount.Amount(self.mv2d(trn.payment), trn.payment.currency.upper())
-                meta = data.new_metadata(file.name, 1) # TODO decide what to do with line number in meta
+                payment = directives.amount(decimals.mv2money(trn.payment), trn.payment.currency.upper())
+                meta = directives.new_metadata(ctx.file.name, 1) # TODO decide what to do with line number in meta
                 txn = data.Transaction(
                             meta, delivery_date, self.FLAG, None, trn.type, data.EMPTY_SET, {deal_code}, 
                             [
@@ -244,12 +320,16 @@ class Importer(importer.ImporterProtocol):
                                 data.Posting(self.account_external, -payment, None, None, None,
                                                 None),
                             ])
-                entries.append(txn)
+                if trn.operation_type in COMPACT_TYPES:
+                    ctx.compactable.append(txn) # see extract()
+                else:
+                    entries.append(txn)
             elif trn.operation_type in [OperationType.OPERATION_TYPE_BROKER_FEE, 
                                         OperationType.OPERATION_TYPE_MARGIN_FEE,
                                         OperationType.OPERATION_TYPE_SERVICE_FEE]:
-                payment = amount.Amount(round(self.mv2d(trn.payment), 2), trn.payment.currency.upper())
-                meta = data.new_metadata(file.name, 1) # TODO decide what to do with line number in meta
+                currency = trn.payment.currency.upper()
+                payment = directives.amount(decimals.mv2money(trn.payment), currency)
+                meta = directives.new_metadata(ctx.file.name, 1) # TODO decide what to do with line number in meta
                 txn = data.Transaction(
                             meta, delivery_date, self.FLAG, None, trn.type, data.EMPTY_SET, {deal_code}, 
                             [
@@ -258,12 +338,15 @@ class Importer(importer.ImporterProtocol):
                                 data.Posting(self.account_fees, -payment, None, None, None,
                                                 None),
                             ])
-                entries.append(txn)
+                if trn.operation_type in COMPACT_TYPES:
+                    ctx.compactable.append(txn) # see extract()
+                else:
+                    entries.append(txn)
             elif trn.operation_type in [OperationType.OPERATION_TYPE_COUPON, 
                                         OperationType.OPERATION_TYPE_DIVIDEND, 
                                         OperationType.OPERATION_TYPE_DIVIDEND_TAX]:
-                payment = amount.Amount(self.mv2d(trn.payment), trn.payment.currency.upper())
-                meta = data.new_metadata(file.name, 1) # TODO decide what to do with line number in meta
+                payment = directives.amount(decimals.mv2money(trn.payment), trn.payment.currency.upper())
+                meta = directives.new_metadata(ctx.file.name, 1) # TODO decide what to do with line number in meta
                 txn = data.Transaction(
                             meta, delivery_date, self.FLAG, None, trn.type, data.EMPTY_SET, {deal_code}, 
                             [
@@ -279,20 +362,4 @@ class Importer(importer.ImporterProtocol):
         return entries
 
     def mv2d(self, mv : MoneyValue):
-        return Decimal(str(mv.units+mv.nano/1e9).rstrip('0'))
-
-    def get_list_structure(self, instruments, asset):
-        struct = {}
-
-        for i in instruments:
-            struct[i.figi] = {
-                'name': i.name,
-                'isin': i.isin,
-                'ticker': i.ticker,
-                'lot': i.lot,
-                'currency' : i.currency.upper(),
-                'nominal' : 0 if asset == 'etf' else i.nominal,
-                'type' : asset
-            }
-
-        return struct
\ No newline at end of file
+        return decimals.mv2d(mv)
@@ -8,7 +8,6 @@ import os
 import pickle
 import json
 
-from dateutil.parser import parse
 from rich import print
 
 from decimal import *
@@ -22,7 +21,21 @@ from beancount.ingest import importer
 
 from tinkoff.invest import Client, OperationState, OperationType, MoneyValue
 
-NOCOST = position.CostSpec(None, None, None, None, None, None)
+from ..rufinlib import compact
+from ..rufinlib import context
+from ..rufinlib import dates
+from ..rufinlib import decimals
+from ..rufinlib import dedup
+from ..rufinlib import directives
+from ..rufinlib import fills
+from ..rufinlib import jsonstream
+from ..rufinlib import watermark
+from . import instruments
+from . import jsonl
+
+NOCOST = directives.NOCOST
+# operations which may be aggregated into summary transactions (compact mode)
+COMPACT_TYPES = (OperationType.OPERATION_TYPE_BROKER_FEE, OperationType.OPERATION_TYPE_OVERNIGHT)
 
 
 class Importer(importer.ImporterProtocol):
@@ -40,7 +53,11 @@ class Importer(importer.ImporterProtocol):
                  account_repo=None,
                  balance=True,
                  token=None,
-                 start_date=None):
+                 start_date=None,
+                 watermark=None,
+                 compact=None,
+                 merge_fills=None,
+                 instruments=instruments.FILENAME):
         self.general_agreement_id = general_agreement_id
         self.account_root = account_root
         self.account_cash = account_cash
@@ -49,27 +66,27 @@ class Importer(importer.ImporterProtocol):
         self.account_interest = account_interest
         self.account_fees = account_fees
         self.account_gains = account_gains
+        self.accounts = directives.Accounts(account_root, account_gains)
         self.account_external = account_external
         self.balance = balance
         self.token = token
         self.start_date = start_date
+        self.watermark = watermark # file with watermarks - skip already imported operations
+        self.compact = compact # 'daily' or 'monthly' - aggregate fees and overnight into summary transactions
+        self.merge_fills = merge_fills # 'price' or 'vwap' - merge fills of order into fewer postings (see fills)
+        self.instruments = instruments # file with cache of instruments (tickers.json of tcsdownload)
         self.account_repo = account_repo if account_repo else account_fees
 
-        self.assets = None
-
     def identify(self, file):
         ''' Match if the file is broker report from TCS Invest
         '''
-        # Match file extension - should be JSON
+        # Match file extension - should be JSON (or line-delimited JSON of tcsdownload)
+        if file.name.endswith('.jsonl'):
+            return self.general_agreement_id in jsonl.headers(file.name)
         if not file.name.endswith('.json'):
             return False
-        # Load JSON file
-        with open(file.name, 'r') as f:
-            # load first key from file and compare to self.general_agreement_id
-            acc_data = json.load(f)
-        if acc_data.get(self.general_agreement_id):
-            return True
-        return False
+        # Look for the account among top-level keys - accounts data isn't parsed
+        return self.general_agreement_id in jsonstream.keys(file.name)
 
     def file_account(self, _):
         ''' *
@@ -82,36 +99,46 @@ class Importer(importer.ImporterProtocol):
         # No report creation date - use file creation date instead
         return None
 
-    def extract(self, file):
+    def extract(self, file, existing_entries=None):
         ''' Connect to Tinkoff API and download all data
+            Operations with ids which are in the ledger (existing_entries) are dropped
         '''
         entries = []
-        # load tickers from JSON file
-        with open("tickers.json", 'r') as f:
-            self.assets = json.load(f)
-
-        # load account data from JSON file
-        with open(file.name, 'r') as f:
-            acc_data = json.load(f).get(self.general_agreement_id)
+        # load only data of the account from JSON file
+        if file.name.endswith('.jsonl'):
+            acc_data = jsonl.read_account(file.name, self.general_agreement_id)
+        else:
+            acc_data = jsonstream.load_key(file.name, self.general_agreement_id)
 
         if not acc_data:
             return []
 
-        entries += self.get_oper(file, acc_data)
-        entries += self.get_balances(file, acc_data)
+        # load tickers of the account operations from cache of instruments (tickers.json of tcsdownload)
+        figis = {trn['figi'] for trn in acc_data['operations'] if trn.get('figi')}
+        ctx = context.ExtractContext(file, assets=instruments.InstrumentCache(self.instruments, figis=figis),
+                                     compactable=[])
 
-        return entries
+        wm = watermark.Watermark(self.watermark, '{} {}'.format(self.account_root, self.general_agreement_id))
+        entries += self.get_oper(ctx, acc_data, wm)
+        entries += self.get_balances(ctx, acc_data)
+        wm.save()
+
+        # known operations are dropped before compaction - summary has only new ones
+        entries += compact.compact(dedup.filter_known(ctx.compactable, existing_entries,
+                                                      self.account_root, self.account_cash),
+                                   self.compact)
+        return dedup.filter_known(entries, existing_entries, self.account_root, self.account_cash)
 
-    def get_balances(self, file, acc_data : dict) -> list:
+    def get_balances(self, ctx, acc_data : dict) -> list:
         result = []
         for currency, amt in acc_data['cash'].items():
-            amt_d = amount.Amount(D(amt), currency)
+            amt_d = directives.amount(D(amt), currency)
             # TODO decide what to do with line number in meta
-            meta = data.new_metadata(file.name, 1)
+            meta = directives.new_metadata(ctx.file.name, 1)
             result.append(
                 data.Balance(
                     meta,
-                    parse(acc_data['statement_date']).date() +
+                    dates.iso_date(acc_data['statement_date']) +
                     datetime.timedelta(days=1),
                     self.account_cash,
                     amt_d,
@@ -119,53 +146,51 @@ class Importer(importer.ImporterProtocol):
                 )
             )
         for ticker, amt in acc_data['securities'].items():
-            amt_d = amount.Amount(D(amt), ticker)
+            amt_d = directives.amount(D(amt), ticker)
             # TODO decide what to do with line number in meta
-            meta = data.new_metadata(file.name, 1)
+            meta = directives.new_metadata(ctx.file.name, 1)
             result.append(
                 data.Balance(
                     meta,
-                    parse(acc_data['statement_date']).date() +
+                    dates.iso_date(acc_data['statement_date']) +
                     datetime.timedelta(days=1),
-                    account.join(self.account_root, ticker),
+                    self.accounts.instrument(ticker),
                     amt_d,
                     None, None
                 )
             )
         return result
 
-    def get_oper(self, file, acc_data):
-        '''
+    def get_oper(self, ctx, acc_data, wm):
+        ''' wm: watermark of the account - operations imported already are skipped
         '''
         entries = []
-        resp = None
-
-        start_date = self.start_date if self.start_date else acc_data['opened_date']
-
         for trn in acc_data['operations']:
             #import IPython; IPython.embed()
-            delivery_date = parse(trn['date']).date()  # date of execution of transaction
+            delivery_date = dates.iso_date(trn['date'])  # date of execution of transaction
             deal_code = trn['id'] if trn['id'] else trn['parent_id']
+            if wm.skip(delivery_date, deal_code, (trn['type'], trn.get('figi'), trn.get('payment'))):
+                continue # imported already
             trn_tags = { deal_code } if deal_code else data.EMPTY_SET
             # TODO: check if it's convenient and adjust if necessary
-            meta = data.new_metadata(file.name, 1)
+            meta = directives.new_metadata(ctx.file.name, 1)
             if trn['type'] in [OperationType.OPERATION_TYPE_BUY, OperationType.OPERATION_TYPE_SELL]:
                 figi = trn['figi']
-                asset_type = self.assets[figi]['type']
-                readable_name = self.assets[figi]['name']
+                asset_type = ctx.assets[figi]['type']
+                readable_name = ctx.assets[figi]['name']
                 sign = -1 if trn['type'] == OperationType.OPERATION_TYPE_SELL else 1
                 if asset_type == 'currency':
-                    ticker = self.assets[figi]['nominal_currency']
+                    ticker = ctx.assets[figi]['nominal_currency']
                     account_inst = self.account_cash
                 else:
-                    ticker = self.assets[figi]['ticker']
-                    account_inst = account.join(self.account_root, ticker)
+                    ticker = ctx.assets[figi]['ticker']
+                    account_inst = self.accounts.instrument(ticker)
                 txn = list()
                 # cash leg of the transaction
                 trn_pmt = trn.get('payment')
                 if trn_pmt: 
-                    payment = Decimal(-sign)*abs(Decimal(trn_pmt))
-                    payment_amt = amount.Amount(payment, trn['payment_currency'])
+                    payment = Decimal(-sign)*abs(decimals.money(trn_pmt, trn['payment_currency']))
+                    payment_amt = directives.amount(payment, trn['payment_currency'])
                     p1 = data.Posting(account=self.account_cash,
                                     units=payment_amt,
                                     cost=None,
@@ -173,36 +198,39 @@ class Importer(importer.ImporterProtocol):
                                     flag=None, meta=None)
                     txn.append(p1)
                 else:
-                    amt = amount.Amount(sign*Decimal(trn['quantity']), ticker)
+                    amt = directives.amount(sign*Decimal(trn['quantity']), ticker)
                     paym_d = Decimal(trn['price'])
-                    payment = amount.Amount(paym_d, trn['currency'])
+                    payment = directives.amount(paym_d, trn['currency'])
 
-                for trade in trn['trades']:
-                    paym_d_trade = Decimal(trade['price'])
-                    amt_trade = amount.Amount(sign*Decimal(trade['quantity']), ticker)
+                trades = fills.merge([(Decimal(trade['quantity']), Decimal(trade['price']), trade['currency'])
+                                      for trade in trn['trades']], self.merge_fills)
+                for trade in trades:
+                    paym_d_trade = trade.price
+                    amt_trade = directives.amount(sign*trade.quantity, ticker)
                     if trn['type'] == OperationType.OPERATION_TYPE_SELL:
-                        payment_trade = amount.Amount(paym_d_trade, trade['currency'])
+                        payment_trade = directives.amount(paym_d_trade, trade.currency)
                         if asset_type == 'currency':
                             p = data.Posting(account=account_inst,
                                                 units=amt_trade,
                                                 cost=None,
                                                 price=payment_trade,
-                                                flag=None, meta=None)
+                                                flag=None, meta=trade.meta)
                         else:
                             # asset leg of the transaction
                             p = data.Posting(account=account_inst,
                                                 units=amt_trade,
                                                 cost=NOCOST,
                                                 price=payment_trade,
-                                                flag=None, meta=None)
+                                                flag=None, meta=trade.meta)
                         txn.append(p)
                     else:
                         # TODO: currency buy?
                         # cost of the transaction
+                        # (total cost for fills collapsed at weighted price - it's exact)
                         cost_bnc = position.CostSpec(
-                                            number_per=paym_d_trade,
-                                            number_total=None,
-                                            currency=trade['currency'],
+                                            number_per=Decimal(0) if trade.meta else paym_d_trade,
+                                            number_total=trade.total if trade.meta else None,
+                                            currency=trade.currency,
                                             date=None,
                                             label=None,
                                             merge=False)
@@ -211,14 +239,14 @@ class Importer(importer.ImporterProtocol):
                                             units=amt_trade,
                                             cost=cost_bnc,
                                             price=None,
-                                            flag=None, meta=None)
+                                            flag=None, meta=trade.meta)
                         # TODO: we're buying currency here!
                         if account_inst == self.account_cash:
                             print(trn)
                         txn.append(p)
                 if asset_type == 'bond' or (trn['type'] == OperationType.OPERATION_TYPE_SELL and asset_type != 'currency'):
                     # add leg for NKD or sell operation
-                    p = data.Posting(account=self.account_gains.format(ticker),
+                    p = data.Posting(account=self.accounts.gains(ticker),
                                      units=None,
                                      cost=None,
                                      price=None,
@@ -234,9 +262,9 @@ class Importer(importer.ImporterProtocol):
                                         OperationType.OPERATION_TYPE_INPUT,
                                         OperationType.OPERATION_TYPE_OVERNIGHT,
                                         OperationType.OPERATION_TYPE_TAX]:
-                payment = amount.Amount(Decimal(trn["payment"]), trn["payment_currency"])
+                payment = directives.amount(decimals.money(trn["payment"], trn["payment_currency"]), trn["payment_currency"])
                 # TODO decide what to do with line number in meta
-                meta = data.new_metadata(file.name, 1)
+                meta = directives.new_metadata(ctx.file.name, 1)
                 txn = data.Transaction(
                     meta=meta, date=delivery_date, flag=self.FLAG, payee=None, 
                     narration=trn["label"], tags=trn_tags, links=data.EMPTY_SET,
@@ -246,14 +274,16 @@ class Importer(importer.ImporterProtocol):
                         data.Posting(self.account_external, -payment, None, None, None,
                                      None),
                     ])
-                entries.append(txn)
+                if trn['type'] in COMPACT_TYPES:
+                    ctx.compactable.append(txn) # see extract()
+                else:
+                    entries.append(txn)
             elif trn['type'] in [OperationType.OPERATION_TYPE_BROKER_FEE,
                                         OperationType.OPERATION_TYPE_MARGIN_FEE,
                                         OperationType.OPERATION_TYPE_SERVICE_FEE]:
-                payment = amount.Amount(
-                    round(Decimal(trn["payment"]), 2), trn["payment_currency"])
+                payment = directives.amount(decimals.money(trn["payment"], trn["payment_currency"]), trn["payment_currency"])
                 # TODO decide what to do with line number in meta
-                meta = data.new_metadata(file.name, 1)
+                meta = directives.new_metadata(ctx.file.name, 1)
                 txn = data.Transaction(
                     meta=meta, date=delivery_date, flag=self.FLAG, payee=None, 
                     narration=trn["label"], tags=trn_tags, links=data.EMPTY_SET,
@@ -263,13 +293,16 @@ class Importer(importer.ImporterProtocol):
                         data.Posting(self.account_fees, -payment, None, None, None,
                                      None),
                     ])
-                entries.append(txn)
+                if trn['type'] in COMPACT_TYPES:
+                    ctx.compactable.append(txn) # see extract()
+                else:
+                    entries.append(txn)
             elif trn['type'] in [OperationType.OPERATION_TYPE_COUPON,
                                         OperationType.OPERATION_TYPE_DIVIDEND,
                                         OperationType.OPERATION_TYPE_DIVIDEND_TAX]:
-                payment = amount.Amount(Decimal(trn["payment"]), trn["payment_currency"])
+                payment = directives.amount(decimals.money(trn["payment"], trn["payment_currency"]), trn["payment_currency"])
                 # TODO decide what to do with line number in meta
-                meta = data.new_metadata(file.name, 1)
+                meta = directives.new_metadata(ctx.file.name, 1)
                 txn = data.Transaction(
                     meta=meta, date=delivery_date, flag=self.FLAG, payee=None, 
                     narration=trn["label"], tags=trn_tags, links=data.EMPTY_SET,
@@ -286,4 +319,4 @@ class Importer(importer.ImporterProtocol):
         return entries
 
     def mv2d(self, mv: MoneyValue):
-        return Decimal(str(mv.units+mv.nano/1e9).rstrip('0'))
+        return decimals.mv2d(mv)
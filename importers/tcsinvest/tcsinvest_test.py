@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import types
+import shutil
+import datetime
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from beancount.core import data
+from beancount.ingest import cache
+
+try:
+    from tinkoff.invest import MoneyValue, OperationType
+    from . import tcsinvest
+except ImportError:
+    tcsinvest = None
+
+NS = types.SimpleNamespace
+OPENED = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+ACCOUNTS = 6
+
+
+def money(units):
+    return MoneyValue(currency='rub', units=units, nano=0)
+
+
+class FakeClient:
+    ''' Client with accounts of a deposit and a purchase of one share each - calls of
+        operations in progress at the same time are counted
+    '''
+
+    def __init__(self, token, target=None):
+        self.target = target
+        self.lock = threading.Lock()
+        self.current = 0
+        self.most = 0
+        self.lookups = []
+        self.users = NS(get_accounts=lambda: NS(accounts=[NS(id=str(i), opened_date=OPENED)
+                                                          for i in range(ACCOUNTS)]))
+        self.operations = NS(get_operations=self.get_operations)
+        self.instruments = NS(
+            get_instrument_by=self.get_instrument_by,
+            share_by=lambda id_type, id: NS(instrument=NS(name='Share', isin='', ticker='SHR', lot=1,
+                                                          currency='rub', nominal=money(1)))
+        )
+
+    def get_instrument_by(self, id_type, id):
+        self.lookups.append(id)
+        return NS(instrument=NS(instrument_type='share'))
+
+    def get_operations(self, account_id, from_, to, state):
+        with self.lock:
+            self.current += 1
+            self.most = max(self.most, self.current)
+        time.sleep(0.05)
+        with self.lock:
+            self.current -= 1
+        date = OPENED + datetime.timedelta(days=1)
+        return NS(operations=[
+            NS(id=account_id + '-1', date=date, operation_type=OperationType.OPERATION_TYPE_INPUT, figi='',
+               payment=money(1000), type='Пополнение брокерского счёта', trades=[]),
+            NS(id=account_id + '-2', date=date, operation_type=OperationType.OPERATION_TYPE_BUY, figi='FIGI',
+               payment=money(-100), type='Покупка ценных бумаг', trades=[NS(quantity=10, price=money(10))]),
+        ])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+@unittest.skipIf(tcsinvest is None, 'tinkoff.invest is not installed')
+class TestImporter(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'balances.json')
+        with open(self.filename, 'w') as f:
+            json.dump({str(i): {'date': '2021-03-31', 'cash': {'RUB': '900'}, 'securities': {}}
+                       for i in range(ACCOUNTS)}, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def importer(self, **kwargs):
+        return tcsinvest.Importer('1', 'Assets:Tinkoff', 'Assets:Tinkoff:Cash', 'Assets:Tinkoff:FX',
+                                  'Income:Tinkoff:Dividends', 'Income:Tinkoff:Interest', 'Expenses:Tinkoff:Fees',
+                                  'Income:Tinkoff:{}:Gains', 'Assets:External', token='token',
+                                  instruments=os.path.join(self.dir, 'tickers.json'), **kwargs)
+
+    def extract(self, importer, clients):
+
+        def client(token, target=None):
+            clients.append(FakeClient(token, target))
+            return clients[-1]
+
+        with mock.patch.object(tcsinvest, 'Client', client):
+            return importer.extract(cache._FileMemo(self.filename))
+
+    def test_workers(self):
+        clients = []
+        entries = self.extract(self.importer(workers=3, target='localhost:50051'), clients)
+        fake, = clients
+        self.assertEqual(fake.target, 'localhost:50051')
+        # accounts are fetched by the pool - no more than workers at once
+        self.assertEqual(fake.most, 3)
+        self.assertEqual(len([entry for entry in entries if isinstance(entry, data.Transaction)]), 2 * ACCOUNTS)
+        self.assertEqual(len([entry for entry in entries if isinstance(entry, data.Balance)]), ACCOUNTS)
+        # instrument is looked up once for all accounts and cached
+        self.assertEqual(fake.lookups, ['FIGI'])
+        with open(os.path.join(self.dir, 'tickers.json')) as f:
+            self.assertEqual(list(json.load(f)['instruments']), ['FIGI'])
+
+    def test_cassette(self):
+        clients = []
+        self.extract(self.importer(), clients)
+        # instruments are taken from fresh local cache - they aren't looked up while recording
+        importer = self.importer(cassette=os.path.join(self.dir, 'cassette.pickle'))
+        recorded = self.extract(importer, clients)
+        self.assertEqual(clients[1].lookups, [])
+        # but they are replayed from cassette - local cache isn't read
+        os.unlink(os.path.join(self.dir, 'tickers.json'))
+        replayed = self.extract(importer, clients)
+        self.assertEqual(len(clients), 2) # no connection to API in replay
+        self.assertEqual(replayed, recorded)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, 'tickers.json')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,7 +8,6 @@ import os
 import csv
 
 import xml.etree.ElementTree as ET
-from dateutil.parser import parse
 import pprint
 
 from decimal import *
@@ -23,8 +22,15 @@ from beancount.ingest import importer
 from beancount.parser import printer
 
 from ..rufinlib import rufinlib
-
-NOCOST = position.CostSpec(None, None, None, None, None, None)
+from ..rufinlib import compact
+from ..rufinlib import context
+from ..rufinlib import dates
+from ..rufinlib import dedup
+from ..rufinlib import directives
+from ..rufinlib import tables
+from ..rufinlib import watermark
+
+NOCOST = directives.NOCOST
 CASH_OPER = {'Списание денежных средств', 'Вознаграждение Брокера', 'Зачисление денежных средств', 
         'Сальдо расчётов по сделкам с ценными бумагами', 'Сальдо расчётов по сделкам с иностранной валютой', 'НДФЛ'}
 
@@ -41,7 +47,9 @@ class Importer(importer.ImporterProtocol):
                  account_gains,
                  account_external,
                  account_repo = None,
-                 balance = True):
+                 balance = True,
+                 watermark = None,
+                 compact = None):
         self.general_agreement_id = general_agreement_id
         self.account_root = account_root
         self.account_cash = account_cash
@@ -50,20 +58,33 @@ class Importer(importer.ImporterProtocol):
         self.account_interest = account_interest
         self.account_fees = account_fees
         self.account_gains = account_gains
+        self.accounts = directives.Accounts(account_root, account_gains)
         self.account_external = account_external
         self.balance = balance
+        self.watermark = watermark # file with watermarks - skip already imported operations
+        self.compact = compact # 'daily' or 'monthly' - aggregate repo operations into summary transactions
         self.account_repo = account_repo if account_repo else account_fees
 
-        self.ns = ''
-
     def check_vtb(self, xmlfile, genid):
         ''' Verify if file from VTB broker
+            Only header of the report is read - first two elements below root
         '''
-        tree = ET.parse(xmlfile)
-        root = tree.getroot()
-        if 'Отчет Банка ВТБ (ПАО)' not in root[0].attrib['Textbox290']:
+        header = []
+        depth = 0
+        for event, el in ET.iterparse(xmlfile, events=('start', 'end')):
+            if event == 'end':
+                depth -= 1
+                continue
+            depth += 1
+            if depth == 2:
+                header.append(el)
+                if len(header) == 2:
+                    break
+        if len(header) < 2:
             return False
-        if root[1].attrib['agr_num1'] == genid:
+        if 'Отчет Банка ВТБ (ПАО)' not in header[0].attrib.get('Textbox290', ''):
+            return False
+        if header[1].attrib.get('agr_num1') == genid:
             return True
         return False
 
@@ -88,63 +109,96 @@ class Importer(importer.ImporterProtocol):
         return None
 
     def c(self, currency):
-        return 'RUB' if 'RUR' in currency else currency
+        return directives.name('RUB' if 'RUR' in currency else currency)
 
-    def extract(self, file):
-        ''' Open XLS file and create directives
+    def extract(self, file, existing_entries=None):
+        ''' Open XML file and create directives
+            Deals with ids which are in the ledger (existing_entries) are dropped
         '''
-        entries = []
-        self.isindb = rufinlib.load_isin()
-        
-        tree = ET.parse(file.name)
-        root = tree.getroot()
-        self.ns = {"": root.attrib['Name']}
-        # extract broker report dates
-        t = root[0].attrib['Textbox290']
-        self.stmt_begin = datetime.datetime.strptime(t[34:44], '%d.%m.%Y').date()
-        self.stmt_end = datetime.datetime.strptime(t[48:58], '%d.%m.%Y').date()
-
-        # Load assets transactions
-        # check if there is necessary data in file
-        el = root.find("Tablix_b11", self.ns)
-        if el:
-            entries += self.get_trn(el, file)
-        # Load assets balances
-        el = root.find("Tablix6", self.ns).find("bond_type_Collection", self.ns)
-        if el:
-            entries += self.get_assets_balances(el, file)
-        # Load cash transaction
-        el = root.find("Tablix_b4", self.ns)
-        if el:
-            entries += self.get_cashflow(el, file)
-        # Load cash balances
-        el = root.find("Tablix_b2", self.ns)
-        if el:
-            entries += self.get_cash_balances(el, file)
-        # Load fx operations
-        el = root.find("Tablix_b12", self.ns)
-        if el:
-            entries += self.get_fx(el, file)
-        # Load repo operations
-        el = root.find("Tablix_b16", self.ns)
-        if el:
-            entries += self.get_repo(el, file)
-
-        # # 1. Load end of report balances: 'Динамика позиций' sheet
-        # sheet = workbook.sheet_by_name('Динамика позиций') #TODO change sheet to 0 (first sheet in workbook)
-        # del sheet
-
-        # if self.balance:
-        #     entries += self.get_balance(workbook, file)
-
-        # entries += self.get_trn(workbook, file)
-        # entries += self.get_cflow(workbook, file)
-
-        return entries
+        return list(self.iter_extract(file, existing_entries))
+
+    def iter_extract(self, file, existing_entries=None):
+        ''' Stream XML file and yield directives row by row
+            Every row of report section (Tablix) is passed to its handler as soon as it's parsed
+            and then dropped, so memory doesn't depend on the size of the report.
+            Cash operations (columns of ctx.cash) and repo operations are yielded at the end -
+            repo is compacted if it's configured.
+        '''
+        ctx = context.ExtractContext(file, isindb=rufinlib.load_isin(), ns='', compactable=[], repo={},
+                                     cash=tables.CashTable(),
+                                     wm=watermark.Watermark(self.watermark, self.account_root))
+        # section: path from section to element with rows (number of child or tag, None - any), handler of row
+        rows = {
+            'Tablix_b11': ((0,), self.get_trn), # assets transactions
+            'Tablix6': (('bond_type_Collection', None, 1), self.get_assets_balance), # assets balances
+            'Tablix_b4': ((0, 0, 0), self.get_cashflow), # cash transactions
+            'Tablix_b2': ((0,), self.get_cash_balance), # cash balances
+            'Tablix_b12': ((0,), self.get_fx), # fx operations
+            'Tablix_b16': ((0,), self.get_repo), # repo operations
+        }
+        yield from dedup.iter_filter_known(self.iter_rows(ctx, rows), existing_entries,
+                                           self.account_root, self.account_cash)
+        yield from dedup.iter_filter_known(ctx.cash.build(self.FLAG), existing_entries,
+                                           self.account_root, self.account_cash)
+        # known operations are dropped before compaction - summary has only new ones
+        ctx.compactable += self.build_repo(ctx)
+        yield from compact.compact(dedup.filter_known(ctx.compactable, existing_entries,
+                                                      self.account_root, self.account_cash),
+                                   self.compact)
+        ctx.wm.save()
+
+    def iter_rows(self, ctx, rows):
+        ''' Directives of rows of report sections - row is dropped as soon as it's handled
+        '''
+        # open elements: element, tag without namespace, number in parent, number of children
+        stack = []
+        for event, el in ET.iterparse(ctx.file.name, events=('start', 'end')):
+            if event == 'start':
+                number = 0
+                if stack:
+                    number = stack[-1][3]
+                    stack[-1][3] += 1
+                stack.append([el, el.tag.rpartition('}')[2], number, 0])
+                if len(stack) == 1:
+                    ctx.ns = {"": el.attrib['Name']}
+                elif len(stack) == 2 and ctx.stmt_begin is None:
+                    # extract broker report dates from the first section
+                    t = el.attrib['Textbox290']
+                    ctx.stmt_begin = dates.ru_date(t[34:44])
+                    ctx.stmt_end = dates.ru_date(t[48:58])
+                continue
+            stack.pop()
+            if len(stack) == 1:
+                # section is processed - free it
+                el.clear()
+                stack[0][0].remove(el)
+            if len(stack) < 2:
+                continue
+            path, handler = rows.get(stack[1][1], ((), None))
+            # elements between section and the row
+            between = stack[2:]
+            if handler is None or len(between) != len(path):
+                if len(stack) == 2:
+                    el.clear() # element of section which isn't used
+                continue
+            if all(step is None or step == (tag if isinstance(step, str) else number)
+                   for step, (_, tag, number, _) in zip(path, between)):
+                yield from handler(el, ctx)
+                el.clear()
+                stack[-1][0].remove(el)
+
+    def get_assets_balance(self, r, ctx):
+        ''' * Balance of asset - row of assets balances collection in "Tablix6" section
+        '''
+        ticker, readable_name, isin = self.get_ticker(ctx, r.attrib['FinInstr'])
+        account_inst = self.accounts.instrument(ticker)
+        amt = amount.Amount(D(r[0][0][0][0].attrib['remains_out'].split('.')[0]), self.c(ticker))
+        meta = directives.new_metadata(ctx.file.name, 1) # TODO decide what to do with line number in meta
+        return [data.Balance(meta, ctx.stmt_end + datetime.timedelta(days=1), account_inst, amt, None, None)]
 
-    def get_ticker(self, text):
+    def get_ticker(self, ctx, text):
         nm = text.split(', ')
-        isin = self.isindb[nm[2]] # get ISIN code
+        isin = ctx.isindb[nm[2]] # get ISIN code
         ticker = isin['ticker'] # get stock ticker 
         readable_name = nm[0] # store human-readable name of the asset
         return ticker, readable_name, isin
@@ -156,34 +210,40 @@ class Importer(importer.ImporterProtocol):
             return text[3:]
 
 
-    def get_repo(self, element, file):
-        ''' * Parse broker report for repo operations
-            In: XML element "Tablix_b16", file
-            Out: list of transactions
+    def get_repo(self, r, ctx):
+        ''' * Parse row of repo operations ("Tablix_b16")
+            Parts of repo deal are collected in ctx.repo - transactions are built by build_repo
+        '''
+        oper = ctx.repo
+        oper_id = self.get_repo_id(r.attrib['deal_number2'])
+        sign = 1 if 'Покупка' in r.attrib['NameEnd4'] else -1
+        try:
+            repo_deal = oper[oper_id]
+            repo_deal['code'] = repo_deal['code'] + ' ' + r.attrib['deal_number2']
+            repo_deal['date'] = max(repo_deal['date'], dates.to_date(r.attrib['date_pay2']))
+            repo_deal['first'] = min(repo_deal['first'], dates.to_date(r.attrib['date_pay2']))
+            repo_deal['amount'] += sign*Decimal(r.attrib['deal_cost2'])
+            repo_deal['comis'] += Decimal(r.get('bank_сommition2', 0))
+        except KeyError:
+            oper[oper_id] = {
+                'code' : r.attrib['deal_number2'],
+                'date': dates.to_date(r.attrib['date_pay2']),
+                'first': dates.to_date(r.attrib['date_pay2']), # settlement of the first leg
+                'amount' : sign*Decimal(r.attrib['deal_cost2']),
+                'comis' : Decimal(r.attrib['bank_сommition2']),
+                'currency' : r.attrib['currency_paym2']
+            }
+        return []
+
+    def build_repo(self, ctx):
+        ''' * Transactions of repo deals collected by get_repo
         '''
         result = []
-        oper = dict()
-
-        for r in element[0]:
-            oper_id = self.get_repo_id(r.attrib['deal_number2'])
-            sign = 1 if 'Покупка' in r.attrib['NameEnd4'] else -1
-            try:
-                repo_deal = oper[oper_id]
-                repo_deal['code'] = repo_deal['code'] + ' ' + r.attrib['deal_number2']
-                repo_deal['date'] = max(repo_deal['date'], parse(r.attrib['date_pay2']).date())
-                repo_deal['amount'] += sign*Decimal(r.attrib['deal_cost2'])
-                repo_deal['comis'] += Decimal(r.get('bank_сommition2', 0))
-            except KeyError:
-                oper[oper_id] = {
-                    'code' : r.attrib['deal_number2'],
-                    'date': parse(r.attrib['date_pay2']).date(),
-                    'amount' : sign*Decimal(r.attrib['deal_cost2']),
-                    'comis' : Decimal(r.attrib['bank_сommition2']),
-                    'currency' : r.attrib['currency_paym2']
-                }
-
-        for o in oper.values():
-            meta = data.new_metadata(file.name, 1)
+        for o in ctx.repo.values():
+            # keyed on the first leg - second one is settled weeks later
+            if ctx.wm.skip(o['first'], o['code']):
+                continue # imported already
+            meta = directives.new_metadata(ctx.file.name, 1)
             p1 = data.Posting(account = self.account_cash, 
                             units = None, 
                             cost = None, 
@@ -207,214 +267,159 @@ class Importer(importer.ImporterProtocol):
         return result
 
 
-    def get_fx(self, element, file):
-        ''' * Parse broker report for foreign exchange operations
-            In: XML element "Tablix_b12", file
-            Out: list of transactions
-        '''
-        result = []
-
-        for r in element[0]:
-            try:
-                currency_sell = r.attrib['NameBeg7'][0:3]
-                currency_buy = r.attrib['deal_price5']
-                trn_date = parse(r.attrib['bank_сommition5']).date()
-                amt_sell = amount.Amount(-D(r.attrib['NameEnd7']), self.c(currency_sell))
-                amt_buy = amount.Amount(D(r.attrib['currency_price5']), self.c(currency_buy))
-                fx_rate = amount.Amount(D(r.attrib['deal_count5']), self.c(currency_buy))
-                note = r.attrib['deliv_date4']
-                meta = data.new_metadata(file.name, 1) # TODO decide what to do with line number in meta
-                commision = amount.Amount(Decimal(r.attrib['currency_paym5']) + 
-                                    Decimal(r.attrib['deal_cost5']), 'RUB') # broker comission
-                txn = data.Transaction(
-                        meta, trn_date, self.FLAG, None, note, data.EMPTY_SET, {trn_date}, [
-                            data.Posting(self.account_cash, amt_sell, None, fx_rate, None, None),
-                            data.Posting(self.account_cash, amt_buy, None, None, None, None),
-                            data.Posting(self.account_cash, -commision, None, None, None, None),
-                            data.Posting(self.account_fees, commision, None, None, None, None)
-                        ])
-                result.append(txn)
-            except KeyError as e:
-                print(e)
-                print("Unknown key:", r)
-        return result
-
-    def get_cashflow(self, element, file):
-        ''' * Parse broker report for cash operations
-            In: XML element "Tablix_b4", file
-            Out: list of transactions
+    def get_fx(self, r, ctx):
+        ''' * Parse row of foreign exchange operations ("Tablix_b12")
         '''
-        result = []
-
-        for r in element[0][0][0]:
-            try:
-                operation = r.attrib['operation_type']
-                if operation not in CASH_OPER:
-                    print("Unknown operation: {}".format(operation))
-                    continue
-                note = r.attrib.get('notes1', operation)
-                if (operation in ['Списание денежных средств', 'Зачисление денежных средств', 'НДФЛ'] or
-                ('Вознаграждение Брокера' in operation) and 'Проведение расчетных операций с ценными бумагами' in note):
-                    trn_date = parse(r.attrib['debt_type4']).date()
-                    cur = r.attrib['decree_amount2'] # get currency of transaction
-                    amt = amount.Amount(D(r.attrib['debt_date4']), self.c(cur))
-                    meta = data.new_metadata(file.name, 1) # TODO decide what to do with line number in meta
-                    txn = data.Transaction(
-                            meta, trn_date, self.FLAG, None, note, data.EMPTY_SET, {trn_date}, [
-                                data.Posting(self.account_cash, amt, None, None, None,
-                                                None),
-                                data.Posting(self.account_external, -amt, None, None, None,
-                                                None),
-                            ])
-                    result.append(txn)
-            except KeyError as e:
-                print(e)
-                print("No key:", r)
-        return result
-
-    def get_cash_balances(self, element, file):
-        ''' * Parse broker report for end of period balances - cash
-            In: XML element "Tablix_b2", file
-            Out: list of transactions
+        try:
+            currency_sell = r.attrib['NameBeg7'][0:3]
+            currency_buy = r.attrib['deal_price5']
+            trn_date = dates.to_date(r.attrib['bank_сommition5'])
+            if ctx.wm.skip(trn_date, row=r.attrib.values()):
+                return [] # imported already
+            amt_sell = amount.Amount(-D(r.attrib['NameEnd7']), self.c(currency_sell))
+            amt_buy = amount.Amount(D(r.attrib['currency_price5']), self.c(currency_buy))
+            fx_rate = amount.Amount(D(r.attrib['deal_count5']), self.c(currency_buy))
+            note = r.attrib['deliv_date4']
+            meta = directives.new_metadata(ctx.file.name, 1) # TODO decide what to do with line number in meta
+            commision = amount.Amount(Decimal(r.attrib['currency_paym5']) + 
+                                Decimal(r.attrib['deal_cost5']), 'RUB') # broker comission
+            txn = data.Transaction(
+                    meta, trn_date, self.FLAG, None, note, data.EMPTY_SET, {trn_date}, [
+                        data.Posting(self.account_cash, amt_sell, None, fx_rate, None, None),
+                        data.Posting(self.account_cash, amt_buy, None, None, None, None),
+                        data.Posting(self.account_cash, -commision, None, None, None, None),
+                        data.Posting(self.account_fees, commision, None, None, None, None)
+                    ])
+            return [txn]
+        except KeyError as e:
+            print(e)
+            print("Unknown key:", r)
+        return []
+
+    def get_cashflow(self, r, ctx):
+        ''' * Parse row of cash operations ("Tablix_b4") - operation is added to ctx.cash
         '''
-        result = []
-
-        for r in element[0]:
-            cur = r.attrib['currency_ISO2']
-            amt = amount.Amount(D(r.attrib['outpl_2']), self.c(cur))
-            meta = data.new_metadata(file.name, 1) # TODO decide what to do with line number in meta
-            result.append(
-                data.Balance(
-                            meta, 
-                            self.stmt_end + datetime.timedelta(days=1),
-                            self.account_cash,
-                            amt,
-                            None, None
-                            )
-                        )
-        return result
-    
-    def get_assets_balances(self, element, file):
-        ''' * Parse broker report for end of period balances - assets
-            In: XML element "Tablix6", file
-            Out: list of transactions
+        try:
+            operation = r.attrib['operation_type']
+            if operation not in CASH_OPER:
+                print("Unknown operation: {}".format(operation))
+                return []
+            note = r.attrib.get('notes1', operation)
+            if (operation in ['Списание денежных средств', 'Зачисление денежных средств', 'НДФЛ'] or
+            ('Вознаграждение Брокера' in operation) and 'Проведение расчетных операций с ценными бумагами' in note):
+                trn_date = dates.to_date(r.attrib['debt_type4'])
+                if ctx.wm.skip(trn_date, row=r.attrib.values()):
+                    return [] # imported already
+                cur = r.attrib['decree_amount2'] # get currency of transaction
+                # TODO decide what to do with line number in meta
+                ctx.cash.add(ctx.file.name, 1, trn_date, self.account_cash, self.account_external,
+                             D(r.attrib['debt_date4']), self.c(cur), note, links={trn_date})
+        except KeyError as e:
+            print(e)
+            print("No key:", r)
+        return []
+
+    def get_cash_balance(self, r, ctx):
+        ''' * Parse row of end of period balances - cash ("Tablix_b2")
         '''
-        result = []
+        cur = r.attrib['currency_ISO2']
+        amt = amount.Amount(D(r.attrib['outpl_2']), self.c(cur))
+        meta = directives.new_metadata(ctx.file.name, 1) # TODO decide what to do with line number in meta
+        return [data.Balance(meta, ctx.stmt_end + datetime.timedelta(days=1), self.account_cash, amt, None, None)]
 
-        for collection in element:
-            for r in collection[1]:
-                ticker, readable_name, isin = self.get_ticker(r.attrib['FinInstr'])
-                account_inst = account.join(self.account_root, ticker)
-                amt = amount.Amount(D(r[0][0][0][0].attrib['remains_out'].split('.')[0]), self.c(ticker))
-                meta = data.new_metadata(file.name, 1) # TODO decide what to do with line number in meta
-                result.append(
-                    data.Balance(
-                                meta, 
-                                self.stmt_end + datetime.timedelta(days=1),
-                                account_inst,
-                                amt,
-                                None, None
-                                )
-                            )
-        return result
-
-    def get_trn(self, element, file):
-        ''' Parse broker report for all assets transactions
+    def get_trn(self, r, ctx):
+        ''' Parse row of assets transactions ("Tablix_b11")
         '''
-        result = []
-
-        for r in element[0]:
-            p1 = p2 = p3 = p4 = None
-            payment = amt = 0
+        p1 = p2 = p3 = p4 = None
+        payment = amt = 0
 
-            # extract asset name from record
-            ticker, readable_name, isin = self.get_ticker(r.attrib['NameBeg10']) # store human-readable name of the asset
-            
-            cur = r.attrib['currency_price8'] # get currency of transaction
-            delivery_date = parse(r.attrib['deliv_date7']).date() #date of execution of transaction
-            deal_code = r.attrib['deal_code7'] # transaction code for narration/tag
-            meta = data.new_metadata(file.name, 1) # TODO: check if it's convenient and adjust if necessary
-            commision = amount.Amount(Decimal(r.attrib['bank_сommition8']) + 
-                                    Decimal(r.attrib['deal_code6']), self.c(r.attrib['currency_price8'])) # broker comission
-
-            # get cost information
-            # if isin['isbond']:
-            #     cost_d = Decimal(r.attrib['deal_price8'])*isin['facevalue']/Decimal(100)
-            #     price = amount.Amount(cost_d, isin['currency'])
-            # else:
-            cost_d = Decimal(r.attrib['deal_price8'])
-            price = amount.Amount(cost_d, self.c(cur)) 
-
-            account_inst = account.join(self.account_root, ticker) # account for asset
-
-            if 'Продажа' in r.attrib['currency_ISO10']:
-                amt = amount.Amount(Decimal(-1*int(r.attrib['NameEnd10'].split('.')[0])), self.c(ticker))
-                payment = amount.Amount(Decimal(r.attrib['currency_paym8']), self.c(cur))
+        # extract asset name from record
+        ticker, readable_name, isin = self.get_ticker(ctx, r.attrib['NameBeg10']) # store human-readable name of the asset
+        
+        cur = r.attrib['currency_price8'] # get currency of transaction
+        delivery_date = dates.to_date(r.attrib['deliv_date7']) #date of execution of transaction
+        deal_code = r.attrib['deal_code7'] # transaction code for narration/tag
+        if ctx.wm.skip(delivery_date, deal_code):
+            return [] # imported already
+        meta = directives.new_metadata(ctx.file.name, 1) # TODO: check if it's convenient and adjust if necessary
+        commision = amount.Amount(Decimal(r.attrib['bank_сommition8']) + 
+                                Decimal(r.attrib['deal_code6']), self.c(r.attrib['currency_price8'])) # broker comission
+
+        # get cost information
+        # if isin['isbond']:
+        #     cost_d = Decimal(r.attrib['deal_price8'])*isin['facevalue']/Decimal(100)
+        #     price = amount.Amount(cost_d, isin['currency'])
+        # else:
+        cost_d = Decimal(r.attrib['deal_price8'])
+        price = amount.Amount(cost_d, self.c(cur)) 
+
+        account_inst = self.accounts.instrument(ticker) # account for asset
+
+        if 'Продажа' in r.attrib['currency_ISO10']:
+            amt = amount.Amount(Decimal(-1*int(r.attrib['NameEnd10'].split('.')[0])), self.c(ticker))
+            payment = amount.Amount(Decimal(r.attrib['currency_paym8']), self.c(cur))
+            # asset leg of the transaction
+            p2 = data.Posting(account = account_inst, 
+                            units = amt, 
+                            cost = NOCOST, 
+                            price = price, 
+                            flag = None, meta = None)
+            # we're selling - gains leg of the transaction
+            p4 = data.Posting(account = self.accounts.gains(ticker), 
+                        units = None, 
+                        cost = None, 
+                        price = None, 
+                        flag = None, meta = None)
+        elif 'Покупка' in r.attrib['currency_ISO10']:
+            amt = amount.Amount(Decimal(int(r.attrib['NameEnd10'].split('.')[0])), self.c(ticker))
+            payment = amount.Amount(Decimal(-1)*Decimal(r.attrib['currency_paym8']), self.c(cur))
+            if not isin['isbond']:
+                cost2 = position.CostSpec(
+                    number_per=cost_d,
+                    number_total=None,
+                    currency=self.c(cur),
+                    date=None,
+                    label=None,
+                    merge=False)
                 # asset leg of the transaction
                 p2 = data.Posting(account = account_inst, 
-                                units = amt, 
-                                cost = NOCOST, 
-                                price = price, 
-                                flag = None, meta = None)
-                # we're selling - gains leg of the transaction
-                p4 = data.Posting(account = self.account_gains.format(ticker), 
-                            units = None, 
-                            cost = None, 
+                            units = amt, 
+                            cost = cost2, 
                             price = None, 
                             flag = None, meta = None)
-            elif 'Покупка' in r.attrib['currency_ISO10']:
-                amt = amount.Amount(Decimal(int(r.attrib['NameEnd10'].split('.')[0])), self.c(ticker))
-                payment = amount.Amount(Decimal(-1)*Decimal(r.attrib['currency_paym8']), self.c(cur))
-                if not isin['isbond']:
-                    cost2 = position.CostSpec(
-                        number_per=cost_d,
-                        number_total=None,
-                        currency=self.c(cur),
-                        date=None,
-                        label=None,
-                        merge=False)
-                    # asset leg of the transaction
-                    p2 = data.Posting(account = account_inst, 
-                                units = amt, 
-                                cost = cost2, 
-                                price = None, 
-                                flag = None, meta = None)
-                else:
-                    # asset leg of the transaction for bond (no cost basis info - only purchase price) 
-                    p2 = data.Posting(account = account_inst, 
-                                units = amt, 
-                                cost = NOCOST, 
-                                price = abs(payment), 
-                                flag = None, meta = None)
             else:
-                print(r)
-                assert(True, "Unknown operation!")
-            # cash leg of the transaction
-            p1 = data.Posting(account = self.account_cash, 
-                            units = payment, 
-                            cost = None, 
-                            price = None, 
+                # asset leg of the transaction for bond (no cost basis info - only purchase price) 
+                p2 = data.Posting(account = account_inst, 
+                            units = amt, 
+                            cost = NOCOST, 
+                            price = abs(payment), 
                             flag = None, meta = None)
-            # comission
-            p3 = data.Posting(account = self.account_fees, 
-                            units = commision, 
-                            cost = None, 
-                            price = None, 
-                            flag = None, meta = None) 
-            # balance comission
-            p3_1 = data.Posting(account = self.account_cash, 
-                            units = -commision, 
-                            cost = None, 
-                            price = None, 
-                            flag = None, meta = None) 
-            pp = [p1, p2, p3, p3_1]
-            if p4:
-                pp.append(p4)
-            t = data.Transaction(
-                        meta = meta, date = delivery_date, flag = self.FLAG, payee = None, 
-                        narration = readable_name, tags = {deal_code}, links = data.EMPTY_SET, 
-                        postings = pp)
-            result.append(t)
-
-        return result
-       
\ No newline at end of file
+        else:
+            print(r)
+            assert(True, "Unknown operation!")
+        # cash leg of the transaction
+        p1 = data.Posting(account = self.account_cash, 
+                        units = payment, 
+                        cost = None, 
+                        price = None, 
+                        flag = None, meta = None)
+        # comission
+        p3 = data.Posting(account = self.account_fees, 
+                        units = commision, 
+                        cost = None, 
+                        price = None, 
+                        flag = None, meta = None) 
+        # balance comission
+        p3_1 = data.Posting(account = self.account_cash, 
+                        units = -commision, 
+                        cost = None, 
+                        price = None, 
+                        flag = None, meta = None) 
+        pp = [p1, p2, p3, p3_1]
+        if p4:
+            pp.append(p4)
+        t = data.Transaction(
+                    meta = meta, date = delivery_date, flag = self.FLAG, payee = None, 
+                    narration = readable_name, tags = {deal_code}, links = data.EMPTY_SET, 
+                    postings = pp)
+        return [t]